@@ -1,9 +1,9 @@
 import asyncio
 import math
 import os
-import queue
 import re
 import shutil
+import threading
 from typing import List
 import urllib.request
 from urllib.parse import urlparse
@@ -15,7 +15,9 @@ from disnake.ext import commands, tasks
 from utils.command import botdatatypes
 from utils.command.clip import *
 from utils.command.paginator import Paginator
-from utils.tools.globals import botdata, logger, settings
+from utils.tools.globals import botdata, logger, settings, executors
+from utils.tools.audiolength import audio_lengths, get_audio_length
+from utils.tools.pcmcache import pcm_cache
 from utils.tools.helpers import *
 from utils.other.errorhandling import report_error
 
@@ -25,6 +27,8 @@ CLIPS_ITEMS_PER_PAGE = 20
 URL_CLIP_ERROR_MESSAGE = "Unfortunatley I'm removing the url clip feature for now. I've got plans to eventually implement some custom clips that will be even more flexible than this, but I'm not sure when that feature will arrive."
 
 intro_outro_length = 4.5
+# how many of a guild's queued clips can be getting prepared (synthesized, downloaded, decoded) at once
+CLIP_LOOKAHEAD = 3
 
 class TtsChannelError(Exception):
     def __init__(self, error):
@@ -42,6 +46,67 @@ def remove_if_temp(mp3name):
             logger.info("removed temp file " + mp3name)
 
 
+class ClipQueueFullError(UserError):
+    def __init__(self):
+        super().__init__("I've already got too many clips queued up. Give me a sec to get through them")
+
+class ClipChainSource(disnake.AudioSource):
+    """Plays clips one after another as a single AudioSource, so there's no gap between them.
+    It only holds the clip that's playing and the one after it. read() gets called from the voice thread"""
+    def __init__(self, audioplayer):
+        self.audioplayer = audioplayer
+        self.loop = audioplayer.bot.loop
+        self.lock = threading.Lock()
+        self.current = None
+        self.next = None
+        self.finished = False
+
+    def add(self, clip, source):
+        """Adds a clip to play after the current one. Returns False if it can't take one right now (already has a
+        next clip, or has finished playing), in which case audioplayer.chain_changed gets set when that changes"""
+        with self.lock:
+            if self.finished or self.next is not None:
+                return False
+            self.next = (clip, source)
+            return True
+
+    def read(self):
+        with self.lock:
+            while True:
+                if self.current is not None:
+                    data = self.current[1].read()
+                    if data:
+                        return data
+                    self.current[1].cleanup()
+                    self.current = None
+                if self.next is None:
+                    self.finished = True
+                    self.loop.call_soon_threadsafe(self.audioplayer.chain_changed.set)
+                    return b""
+                self.current, self.next = self.next, None
+                self.loop.call_soon_threadsafe(self.audioplayer.clip_started, self.current[0])
+
+    def stop(self):
+        """Stops taking new clips and drops the one waiting to play. Whatever is playing keeps going until the voice client stops reading"""
+        with self.lock:
+            self.finished = True
+            if self.next is not None:
+                self.next[1].cleanup()
+                self.next = None
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        with self.lock:
+            self.finished = True
+            for clip_source in (self.current, self.next):
+                if clip_source is not None:
+                    clip_source[1].cleanup()
+            self.current = None
+            self.next = None
+
+
 class AudioPlayer:
     """The guild-specific objects used for mangobyte's audio output"""
     def __init__(self, bot, guild):
@@ -49,8 +114,15 @@ class AudioPlayer:
         self.guild_id = guild.id
         self.guild = guild
         self.player = None
-        self.clipqueue = queue.Queue()
+        self.clipqueue = asyncio.Queue(maxsize=settings.clip_queue_limit)
+        self.chain: ClipChainSource = None
+        self.chain_changed = asyncio.Event()
+        self.consumer_task = None
+        self.handing_off = False # whether the consumer has a clip it's working on
+        self.generation = 0 # goes up every time the audio is stopped, so clips queued before then get dropped
+        self.prepare_semaphore = asyncio.Semaphore(CLIP_LOOKAHEAD)
         self.last_clip = None
+        self.dropped_clips = 0
 
     @property
     def voice(self):
@@ -70,6 +142,14 @@ class AudioPlayer:
         else:
             return self.voice.channel.id
 
+    # how many clips are waiting to be played
+    @property
+    def backlog(self):
+        waiting = self.clipqueue.qsize()
+        if self.chain is not None and self.chain.next is not None:
+            waiting += 1
+        return waiting
+
     async def update_guild(self):
         self.guild = await self.bot.fetch_guild(self.guild.id)
 
@@ -105,53 +185,147 @@ class AudioPlayer:
             await voice.move_to(channel)
             logger.info(f"finished move to: {channel.id}")
 
-    def done_talking(self, error):
+    # called from the voice thread when a chain of clips is done playing
+    def done_talking(self, chain, error):
         if error:
             logger.error(f"Error on voice.play: {error}")
-        if not self.clipqueue.empty():
-            coro = self.play_next_clip()
-            fut = asyncio.run_coroutine_threadsafe(coro, self.bot.loop)
-            try:
-                fut.result()
-            except:
-                logger.info(f"Error playing next clip")
-                pass
+        self.bot.loop.call_soon_threadsafe(self.chain_done, chain)
 
-    # gets the next clip from the clip queue
-    def next_clip(self):
-        if not self.clipqueue.empty():
-            return self.clipqueue.get()
-        raise ValueError("clip queue was empty when we tried to get the next one")
-
-    # plays the next clip in the queue
-    async def play_next_clip(self):
-        clip = self.next_clip()
+    def chain_done(self, chain):
+        if self.chain is chain:
+            self.chain = None
+        self.chain_changed.set()
 
+    # called (on the event loop) when the chain starts playing a clip
+    def clip_started(self, clip):
+        logger.info("playing: " + clip.audiopath)
+        if self.last_clip != None and clip.audiopath != self.last_clip.audiopath:
+            remove_if_temp(self.last_clip.audiopath)
+        self.last_clip = clip
+        self.chain_changed.set() # theres room for the next clip now
+
+    # hands a clip to the chain thats playing, or starts a new chain if nothing is playing.
+    # returns False if the audio got stopped before the clip could be handed off
+    async def hand_off_clip(self, clip, generation):
+        source = pcm_cache.get_source(clip.audiopath, clip.volume)
+        while self.chain is not None and generation == self.generation:
+            if self.chain.add(clip, source):
+                return True
+            self.chain_changed.clear()
+            await self.chain_changed.wait()
+        if generation != self.generation:
+            source.cleanup()
+            return False
+
+        chain = ClipChainSource(self)
+        chain.add(clip, source)
         try:
-            self.voice.play(disnake.FFmpegPCMAudio(clip.audiopath), after=self.done_talking)
+            self.voice.play(chain, after=lambda error: self.done_talking(chain, error))
         except disnake.errors.ClientException as e:
+            chain.cleanup()
             if str(e) == "Not connected to voice.":
                 raise UserError("Error playing clip. Try doing `/summon`.")
             else:
                 raise
+        self.chain = chain
+        return True
+
+    # gets a clip's audio ready, and decodes it ahead of time (if its short) so it can be played straight from memory
+    async def prepare_clip(self, clip):
+        async with self.prepare_semaphore:
+            await clip.prepare()
+            await pcm_cache.prepare(clip.audiopath, clip.volume)
+
+    # plays the clips in the queue, one after another, in the order they were queued
+    async def play_clips(self):
+        while True:
+            clip, preparing, generation, handed_off = await self.clipqueue.get()
+            self.handing_off = True
+            try:
+                await self.play_queued_clip(clip, preparing, generation, handed_off)
+            finally:
+                self.handing_off = False
+                if handed_off is not None and not handed_off.done():
+                    handed_off.set_result(False)
 
-        self.voice.source = disnake.PCMVolumeTransformer(self.voice.source)
-        self.voice.source.volume = clip.volume
-        logger.info("playing: " + clip.audiopath)
-        if self.last_clip != None and clip.audiopath != self.last_clip.audiopath:
-            remove_if_temp(self.last_clip.audiopath)
-        self.last_clip = clip
-
-    # try queueing an mp3 to play
+    async def play_queued_clip(self, clip, preparing, generation, handed_off):
+        try:
+            await preparing
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return # the error goes back to whoever queued the clip
+        if generation != self.generation:
+            return # the audio got stopped while this was getting ready
+        try:
+            if self.voice is None:
+                logger.warning(f"dropped clip {clip.clipid} because we're not in a voice channel anymore")
+                return
+            played = await self.hand_off_clip(clip, generation)
+            if handed_off is not None:
+                handed_off.set_result(played)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error playing clip {clip.clipid}: {e}")
+            if handed_off is not None:
+                handed_off.set_exception(e)
+
+    # try queueing an mp3 to play. the clip keeps its place in the queue while it gets prepared (alongside whatever
+    # is playing), and this returns once it's ready, raising any error from preparing it (or from starting to play it,
+    # if nothing else was playing)
     async def queue_clip(self, clip, ctx_inter: InterContext):
         if(self.voice is None):
             logger.warning("tried to talk while not in voice channel")
             raise AudioPlayerNotFoundError("not in voice channel m8")
 
-        self.clipqueue.put(clip)
-
-        if self.voice and not self.voice.is_playing():
-            await self.play_next_clip()
+        if self.clipqueue.full():
+            self.dropped_clips += 1
+            logger.event("clip_dropped", {
+                "server_id": self.guild_id,
+                "clip_type": clip.type(),
+                "backlog": self.backlog,
+                "dropped_clips": self.dropped_clips
+            })
+            raise ClipQueueFullError()
+
+        # if nothing is playing or waiting to, this clip starts playing as soon as its ready, so wait for that too.
+        # clips that are queued behind others just get logged if they cant be played
+        handed_off = None
+        if self.chain is None and self.clipqueue.empty() and not self.handing_off:
+            handed_off = asyncio.get_running_loop().create_future()
+
+        preparing = asyncio.ensure_future(self.prepare_clip(clip))
+        self.clipqueue.put_nowait((clip, preparing, self.generation, handed_off))
+
+        if self.consumer_task is None or self.consumer_task.done():
+            self.consumer_task = asyncio.create_task(self.play_clips())
+
+        await asyncio.shield(preparing)
+        if handed_off is not None:
+            await asyncio.shield(handed_off)
+
+    # clears the queue and stops whatever is playing
+    def stop(self):
+        self.generation += 1 # so the consumer drops any clip it's already taken off the queue
+        while not self.clipqueue.empty():
+            clip, preparing, generation, handed_off = self.clipqueue.get_nowait()
+            if handed_off is not None and not handed_off.done():
+                handed_off.set_result(False)
+        if self.chain is not None:
+            self.chain.stop()
+            if self.voice is None: # nothing is going to finish playing it, so we're done with it now
+                self.chain.cleanup()
+                self.chain_done(self.chain)
+        if self.voice is not None:
+            self.voice.stop()
+        self.chain_changed.set()
+
+    def close(self):
+        self.stop()
+        if self.consumer_task is not None:
+            self.consumer_task.cancel()
+            self.consumer_task = None
 
 
 
@@ -274,6 +448,7 @@ class Audio(MangoCog):
                         logger.info(v.vcid)
         audioplayer = await self.audioplayer(guild, False)
         if audioplayer is not None:
+            audioplayer.close()
             self.audioplayers.remove(audioplayer)
 
     @tasks.loop(hours=1)
@@ -418,13 +593,7 @@ class Audio(MangoCog):
         """Stops the currently playing clip"""
         await self.safe_defer(inter)
         audioplayer = await self.audioplayer(inter)
-        while not audioplayer.clipqueue.empty():
-            try:
-                audioplayer.clipqueue.get()
-            except queue.Empty:
-                continue
-        if audioplayer.voice is not None:
-            audioplayer.voice.stop()
+        audioplayer.stop()
         await inter.send("✅ stopped!")
 
     @commands.slash_command()
@@ -649,6 +818,8 @@ class Audio(MangoCog):
                     except disnake.errors.Forbidden as e:
                         logger.warn("on_message usererror blocked because permissions")
                         pass
+                except ClipQueueFullError:
+                    return # dont add to the spam by warning about it
                 except UserError as e:
                     try:
                         await message.channel.send(e.message)
@@ -786,7 +957,7 @@ class Audio(MangoCog):
         await clip.save(temp_filename)
         
         # verify that it is less than 4 seconds
-        clip_duration = round(float(run_command(["ffprobe", "-i", temp_filename, "-show_entries", "format=duration", "-v", "quiet", "-of", "csv=p=0"])), 2)
+        clip_duration = round(await executors.run_thread(get_audio_length, temp_filename), 2)
         if clip_duration > 4:
             os.remove(temp_filename)
             raise UserError("Custom clips for intros and outros must be less than 4 seconds long")
@@ -796,6 +967,7 @@ class Audio(MangoCog):
             os.remove(filename)
         shutil.copy(temp_filename, filename)
         os.remove(temp_filename)
+        await audio_lengths.fill(filename)
 
         clipid = f"custom:{clip_identifier}"
 
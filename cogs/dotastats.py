@@ -3,7 +3,6 @@ import datetime
 import math
 import os
 import re
-import statistics
 import time
 from types import *
 from enum import Enum
@@ -11,12 +10,17 @@ from collections import OrderedDict
 
 import aiohttp
 import disnake
+import numpy as np
 import utils.drawing.dota as drawdota
 import utils.drawing.graph as drawgraph
 from disnake.ext import commands
 from utils.command.commandargs import *
 from utils.other.metastats import get_total_pro_games
-from utils.tools.globals import botdata, httpgetter, logger, settings
+from utils.tools.globals import botdata, httpgetter, logger, settings, executors
+from utils.tools.matchstore import match_store
+from utils.tools.playerindex import player_index, SIGNIFICANT_COLUMN
+from utils.tools.matchstats import MatchStats
+from utils.drawing.rendercache import get_match_render
 from utils.tools.helpers import *
 
 from cogs.mangocog import *
@@ -101,34 +105,68 @@ async def opendota_query(querystring, cache=False):
 	url = opendota_query_get_url(querystring)
 	return await httpgetter.get(url, cache=cache, errors=opendota_html_errors)
 
-async def opendota_query_filter(matchfilter):
+# gets the local copy of the player's match history, if we have one with everything needed to check all of these
+# matchfilters (which should all be for the same player). otherwise returns None
+async def get_covering_history(*matchfilters):
+	columns = []
+	for matchfilter in matchfilters:
+		check_columns = matchfilter.get_check_columns()
+		if check_columns is None:
+			return None
+		columns.extend(check_columns)
+		columns.extend(matchfilter.get_result_columns())
+	return await player_index.get(matchfilters[0].player.steam_id, list(dict.fromkeys(columns)), opendota_query, covered_only=True)
+
+# use_index=False always asks opendota, for when we need to see matches that were just played
+async def opendota_query_filter(matchfilter, use_index=True):
+	if use_index:
+		history = await get_covering_history(matchfilter)
+		if history is not None:
+			return history.rows(matchfilter.get_result_columns(), indexes=matchfilter.check_matches(history))
 	matches = await opendota_query(matchfilter.to_query_url())
 	matches = matchfilter.post_filter(matches)
 	return matches
 
+# gets a match from the old http cache, moving it over to the match store if its there
+async def get_cached_match(source, match_id, url, is_parsed_check):
+	cached_data = await httpgetter.cache.get(url, "json")
+	if cached_data is None:
+		return None
+	await httpgetter.cache.remove(url)
+	if not is_parsed_check(cached_data):
+		return None
+	await match_store.save(source, match_id, cached_data)
+	return cached_data
+
 # rate_limit = false if this is the only query we're sending
 async def get_match(match_id):
+	match_id = int(match_id)
 	url = opendota_query_get_url(f"/matches/{match_id}")
-	cached_data = await httpgetter.cache.get(url, "json")
 
 	def check_valid_match(match_data):
 		if match_data.get('radiant_win', True) is None:
 			raise InvalidMatchIdError(match_id)
-	
+
+	# only parsed matches are kept in the store, since unparsed ones need to be re-checked
+	cached_data = await match_store.get("opendota", match_id)
+	if cached_data is None:
+		cached_data = await get_cached_match("opendota", match_id, url, is_parsed)
 	if cached_data:
-		if is_parsed(cached_data):
-			check_valid_match(cached_data)
-			return cached_data
-		else:
-			await httpgetter.cache.remove(url)
+		check_valid_match(cached_data)
+		return cached_data
 
-	try:
-		data = await httpgetter.get(url, cache=True, errors=opendota_html_errors)
+	async def download_match():
+		data = await httpgetter.get(url, errors=opendota_html_errors)
 		check_valid_match(data)
+		if is_parsed(data):
+			await match_store.save("opendota", match_id, data)
 		return data
+
+	try:
+		# shielded so that the match still gets saved to the store if the caller is cancelled (like by gather_in_order)
+		return await asyncio.shield(download_match())
 	except HttpError as e:
 		if e.code == 404:
-			await httpgetter.cache.remove(url)
 			raise InvalidMatchIdError(match_id)
 		else:
 			raise 
@@ -139,25 +177,27 @@ async def get_stratz_match(match_id):
 	if settings.stratz is None:
 		raise UserError("Stratz not configured properly. The bot owner has gotta put the stratz api key in the config file")
 
+	match_id = int(match_id)
 	url = f"https://api.stratz.com/api/v1/match/{match_id}"
-	cached_data = await httpgetter.cache.get(url, "json")
-	
+	cached_data = await match_store.get("stratz", match_id)
+	if cached_data is None:
+		cached_data = await get_cached_match("stratz", match_id, url, is_stratz_parsed)
 	if cached_data:
-		if is_stratz_parsed(cached_data):
-			return cached_data
-		else:
-			await httpgetter.cache.remove(url)
+		return cached_data
 
 	try:
 		headers = { 
 			"Authorization": f"Bearer {settings.stratz}",
 			"User-Agent": "STRATZ_API"
 		}
-		return await httpgetter.get(url, cache=True, errors={
+		data = await httpgetter.get(url, errors={
 			500: "Looks like something wrong with the STRATZ api",
 			204: "STRATZ hasn't recieved this match yet. Try again a bit later",
-			403: "Got a STRATZ auth error. I'll notify the bot developer of this issue."
+			403: "Got a STRATZ auth error. I'll notify the bot developer of the issue."
 		}, headers=headers)
+		if is_stratz_parsed(data):
+			await match_store.save("stratz", match_id, data)
+		return data
 	except aiohttp.ClientConnectorError:
 		logger.info("ClientConnectorError on stratz api result")
 		raise StratzMatchNotParsedError(match_id)
@@ -170,7 +210,7 @@ async def get_lastmatch_id(matchfilter, reverse=False):
 	matchfilter.set_arg("significant", 0, False)
 	if not reverse:
 		matchfilter.set_arg("limit", 1)
-	matches = await opendota_query_filter(matchfilter)
+	matches = await opendota_query_filter(matchfilter, use_index=False)
 	if matches:
 		if reverse:
 			return matches[-1]["match_id"]
@@ -248,47 +288,6 @@ def format_teamfight(teamfight):
 	return format_str.format(**teamfight)
 
 
-def _match_avg(player_matches, key, round_place=0):
-	x = 0
-	total_count = 0
-	for player in player_matches:
-		if isinstance(key, LambdaType):
-			val = key(player)
-		else:
-			if player.get(key) is None:
-				continue
-			val = player.get(key, 0)
-		x += val
-		total_count += 1
-	if total_count == 0:
-		return None
-	x = round(x / total_count, round_place)
-	return int(x) if round_place == 0 else x
-
-def _match_percent(player_matches, key, round_place=0, needs_key=None):
-	count = 0
-	total_count = 0
-	for player in player_matches:
-		if needs_key and player.get(needs_key) is None:
-			continue
-		if isinstance(key, LambdaType):
-			success = key(player)
-		else:
-			success = player.get(key, 0)
-		if success:
-			count += 1
-		total_count += 1
-	if total_count == 0:
-		return None
-	if round_place == "floor":
-		count = math.floor((count * 100) / total_count)
-		round_place = 0
-	else:
-		count = round((count * 100) / total_count, round_place)
-	value = int(count) if round_place == 0 else count
-	return f"{value}%"
-
-
 class DotaStats(MangoCog):
 	"""Commands for displaying information about Dota 2 players and matches
 
@@ -588,7 +587,7 @@ class DotaStats(MangoCog):
 			"Denies: {denies}\n"
 			"Level: {level}\n".format(**player)))
 
-		match_image = disnake.File(await drawdota.create_match_image(match), "match.png")
+		match_image = disnake.File(await get_match_render("match_image", match, lambda: drawdota.create_match_image(match)), "match.png")
 		embed.set_image(url=f"attachment://{match_image.filename}")
 
 		self.set_match_footer(match, embed)
@@ -660,7 +659,7 @@ class DotaStats(MangoCog):
 		embed.add_field(name="Game Mode", value=game_mode)
 		embed.add_field(name="Lobby Type", value=game_mode)
 
-		match_image = disnake.File(await drawdota.create_match_image(match), filename="matchimage.png")
+		match_image = disnake.File(await get_match_render("match_image", match, lambda: drawdota.create_match_image(match)), filename="matchimage.png")
 		embed.set_image(url=f"attachment://{match_image.filename}")
 
 		self.set_match_footer(match, embed)
@@ -883,70 +882,45 @@ class DotaStats(MangoCog):
 		await self.safe_defer(inter)
 
 		playerinfo = await opendota_query(f"/players/{steam32}")
-		matches = await opendota_query(f"/players/{steam32}/matches")
-		matches = list(filter(lambda m: m.get('player_slot') is not None, matches))
+		history = await player_index.get(steam32, [ "player_slot", "radiant_win", "hero_id", "start_time", "duration" ], opendota_query)
+		indexes = np.flatnonzero((history.get_array(SIGNIFICANT_COLUMN) == 1) & ~np.isnan(history.get_array("player_slot")))
+		stats = MatchStats.from_history(history, indexes)
 
 		rank_string = self.get_player_rank(playerinfo)
 
-		gamesplayed = len(matches)
+		gamesplayed = len(stats)
 		if gamesplayed > 0:
-			winrate = "{:.2%}".format(len(list(filter(lambda m: m.get('radiant_win', False) == ((m.get('player_slot', 0) or 0) < 128), matches))) / gamesplayed)
+			winrate = "{:.2%}".format(np.count_nonzero(stats.won()) / gamesplayed)
 		else:
 			winrate = "0%"
 
-		heroes = {}
-		for match in matches:
-			heroes[match['hero_id']] = heroes.get(match['hero_id'], 0) + 1
-		heroes = sorted(heroes.items(), key=lambda x: x[1], reverse=True)
-		favs = ""
-		for i in range(0,3):
-			if i < len(heroes):
-				favs += self.get_hero_info(heroes[i][0])['emoji']
+		heroes = stats.group_counts("hero_id")
+		favs = "".join(self.get_hero_info(hero_id)['emoji'] for hero_id, count in heroes[0:3])
 
 		# Recent means 2 months / 60 days 
 		timecutoff = time.time() - (86400 * 60)
 
-		heroes = {}
-		for match in matches:
-			if match['start_time'] > timecutoff:
-				heroes[match['hero_id']] = heroes.get(match['hero_id'], 0) + 1
-		heroes = sorted(heroes.items(), key=lambda x: x[1], reverse=True)
-		recent_favs = ""
-		for i in range(0,3):
-			if i < len(heroes):
-				recent_favs += self.get_hero_info(heroes[i][0])['emoji']
-
-		recent_count = 0
-		activity_delta = []
-		activity_count = []
-		count = 1
-		for i in range(0, len(matches) - 1):
-			delta = matches[i]["start_time"] - (matches[i + 1]["start_time"] + matches[i]["duration"])
-			if delta < (60 * 60 * 2): # If these are part of the same group
-				count += 1
-				continue
-			else:
-				activity_count.append(count)
-				activity_delta.append(delta)
-				count = 1
-				if matches[i]["start_time"] > timecutoff:
-					recent_count += 1
+		start_times = stats.get("start_time")
+		durations = stats.get("duration")
+		heroes = stats.group_counts("hero_id", start_times > timecutoff)
+		recent_favs = "".join(self.get_hero_info(hero_id)['emoji'] for hero_id, count in heroes[0:3])
 
-		if not activity_delta:
-			activity_delta = [ 0 ]
-			activity_count = [ 0 ]
+		# the gaps between each match and the one played before it (matches are newest first). a gap of 2+ hours starts a new group of games
+		deltas = start_times[:-1] - (start_times[1:] + durations[:-1])
+		group_ends = deltas >= (60 * 60 * 2)
+		activity_delta = deltas[group_ends]
+		recent_count = int(np.count_nonzero(group_ends & (start_times[:-1] > timecutoff)))
 
-		overall_time_played = 0
-		for match in matches:
-			overall_time_played += match["duration"]
+		if len(activity_delta) == 0:
+			activity_delta = np.zeros(1)
+
+		overall_time_played = int(np.nansum(durations))
 
-		overall_activity_delta = get_pretty_time((int(statistics.mean(activity_delta)) // 60) * 60)
+		overall_activity_delta = get_pretty_time((int(activity_delta.mean()) // 60) * 60)
 		if recent_count:
-			recent_activity_delta = get_pretty_time((int(statistics.mean(activity_delta[:recent_count])) // 60) * 60)
+			recent_activity_delta = get_pretty_time((int(activity_delta[:recent_count].mean()) // 60) * 60)
 		else:
 			recent_activity_delta = None
-		# overall_activity_count = int(statistics.mean(activity_count))
-		# recent_activity_count = int(statistics.mean(activity_count[:recent_count]))
 
 		plus_text = ""
 		if playerinfo["profile"].get("plus"):
@@ -1036,19 +1010,19 @@ class DotaStats(MangoCog):
 		player_matches = []
 
 		if do_downloaded:
-			matches = []
-			i = 0
-			while i < len(matches_info) and len(matches) < 20:
-				if matches_info[i].get('version', None) is not None:
-					match_id = matches_info[i]['match_id']
-					match = await get_match(match_id)
-					match["match_id"] = match_id
-					player_match = next((p for p in match['players'] if p.get('account_id') == steam32), None)
-					if player_match is not None:
-						player_match["match_id"] = match_id
-						player_matches.append(player_match)
-						matches.append(match)
-				i += 1
+			async def get_player_match(match_id):
+				match = await get_match(match_id)
+				match["match_id"] = match_id
+				player_match = next((p for p in match['players'] if p.get('account_id') == steam32), None)
+				if player_match is None:
+					return None
+				player_match["match_id"] = match_id
+				return (match, player_match)
+
+			parsed_match_ids = [ m['match_id'] for m in matches_info if m.get('version', None) is not None ]
+			results = await gather_in_order(parsed_match_ids, get_player_match, limit=20)
+			matches = [ match for match, player_match in results ]
+			player_matches = [ player_match for match, player_match in results ]
 		else:
 			player_matches = matches_info
 
@@ -1114,22 +1088,22 @@ class DotaStats(MangoCog):
 		# 
 		# STEP 3: define all stats together
 		# 
-		def avg(*args, **kwargs):
-			return _match_avg(player_matches, *args, **kwargs)
-		def percent(*args, **kwargs):
-			return _match_percent(player_matches, *args, **kwargs)
+		stats = MatchStats.from_matches(player_matches)
+		avg = stats.avg
+		percent = stats.percent
 
 		# compute favorites
-		heroes = {}
-		for match in player_matches:
-			heroes[match['hero_id']] = heroes.get(match['hero_id'], 0) + 1
-		heroes = sorted(heroes.items(), key=lambda x: x[1], reverse=True)
+		heroes = stats.group_counts("hero_id")
 		favorite_heroes = "".join(map(lambda h: self.get_hero_info(h[0])['emoji'], heroes[0:3]))
+		hero_attrs = stats.map_values("hero_id", lambda hero_id: self.get_hero_info(hero_id).get('attr'))
 		zeropercent = "0%"
 
+		def lane_percent(lane_role):
+			return percent((stats.get("lane_role") == lane_role) & ~stats.is_true("is_roaming"), needs_key="lane_role")
+
 		# laning postfix if needed
 		laning_postfix = ""
-		parsed_count = len(list(filter(lambda m: m.get("version") is not None, player_matches)))
+		parsed_count = int(np.count_nonzero(stats.has("version")))
 		if parsed_count != len(player_matches) and not do_downloaded:
 			laning_postfix = f" ({parsed_count} parsed matches)"
 
@@ -1158,22 +1132,22 @@ class DotaStats(MangoCog):
 				"caption": "General",
 				"stats": [
 					CoolStat(f"[Matches]({matches_url})", len(player_matches)),
-					CoolStat("Winrate", percent(lambda p: p.get('radiant_win') == (p.get('player_slot') < 128)), filter_key="win"),
+					CoolStat("Winrate", percent(stats.won()), filter_key="win"),
 					CoolStat("KDA", f"{avg('kills')}/{avg('deaths')}/{avg('assists')}"),
 					CoolStat("Duration", format_duration_simple(avg('duration') or 0)),
-					CoolStat("In a Party", percent(lambda p: p.get('party_size') > 1, needs_key='party_size', round_place="floor")),
-					CoolStat("Ranked", percent(lambda p: p['lobby_type'] == 7), filter_key="lobby_type")
+					CoolStat("In a Party", percent(stats.get("party_size") > 1, needs_key='party_size', round_place="floor")),
+					CoolStat("Ranked", percent(stats.get("lobby_type") == 7), filter_key="lobby_type")
 				]
 			},
 			{
 				"caption": "Heroes",
 				"filter_key": "hero_id",
 				"stats": [
-					CoolStat(self.get_emoji('attr_strength'), percent(lambda p: self.get_hero_info(p['hero_id']).get('attr') == 'strength'), separator=" "),
-					CoolStat(self.get_emoji('attr_agility'), percent(lambda p: self.get_hero_info(p['hero_id']).get('attr') == 'agility'), separator=" "),
-					CoolStat(self.get_emoji('attr_intelligence'), percent(lambda p: self.get_hero_info(p['hero_id']).get('attr') == 'intelligence'), separator=" "),
-					CoolStat(self.get_emoji('attr_universal'), percent(lambda p: self.get_hero_info(p['hero_id']).get('attr') == 'universal'), separator=" "),
-					CoolStat("Randomed", percent('randomed'), ignore_value=zeropercent),
+					CoolStat(self.get_emoji('attr_strength'), percent(hero_attrs == 'strength'), separator=" "),
+					CoolStat(self.get_emoji('attr_agility'), percent(hero_attrs == 'agility'), separator=" "),
+					CoolStat(self.get_emoji('attr_intelligence'), percent(hero_attrs == 'intelligence'), separator=" "),
+					CoolStat(self.get_emoji('attr_universal'), percent(hero_attrs == 'universal'), separator=" "),
+					CoolStat("Randomed", percent(stats.is_true('randomed')), ignore_value=zeropercent),
 					CoolStat("__Favorites__", f"\n{favorite_heroes}")
 				]
 			},
@@ -1181,11 +1155,11 @@ class DotaStats(MangoCog):
 				"caption": f"Laning{laning_postfix}",
 				"filter_key": "lane_role",
 				"stats": [
-					CoolStat("Safe Lane", percent(lambda p: p.get('lane_role') == 1 and not p.get('is_roaming'), needs_key="lane_role"), ignore_value=zeropercent),
-					CoolStat("Mid Lane", percent(lambda p: p.get('lane_role') == 2 and not p.get('is_roaming'), needs_key="lane_role"), ignore_value=zeropercent),
-					CoolStat("Off Lane", percent(lambda p: p.get('lane_role') == 3 and not p.get('is_roaming'), needs_key="lane_role"), ignore_value=zeropercent),
-					CoolStat("Jungle", percent(lambda p: p.get('lane_role') == 4 and not p.get('is_roaming'), needs_key="lane_role"), ignore_value=zeropercent),
-					CoolStat("Roaming", percent(lambda p: p.get('is_roaming'), needs_key="is_roaming"), ignore_value=zeropercent),
+					CoolStat("Safe Lane", lane_percent(1), ignore_value=zeropercent),
+					CoolStat("Mid Lane", lane_percent(2), ignore_value=zeropercent),
+					CoolStat("Off Lane", lane_percent(3), ignore_value=zeropercent),
+					CoolStat("Jungle", lane_percent(4), ignore_value=zeropercent),
+					CoolStat("Roaming", percent(stats.is_true("is_roaming"), needs_key="is_roaming"), ignore_value=zeropercent),
 				]
 			}
 		]
@@ -1230,10 +1204,8 @@ class DotaStats(MangoCog):
 					icon = self.get_emoji("chat_wheel_sound" if message.get('is_sound') else "chat_wheel_text")
 					lines.append(f"{icon} {message['message']}")
 				chat_wheel_text = "\n".join(lines)
-			def wards_placed(p):
-				obs = 0 if p.get('obs_placed') is None else p.get('obs_placed')
-				sents = 0 if p.get('sen_placed') is None else p.get('sen_placed')
-				return obs + sents
+			last_hits = stats.get('last_hits')
+			wards_placed = np.nan_to_num(stats.get('obs_placed')) + np.nan_to_num(stats.get('sen_placed'))
 
 			# these are the downloaded_only sections
 			stat_sections.extend([{
@@ -1241,8 +1213,8 @@ class DotaStats(MangoCog):
 				"stats": [
 					CoolStat("GPM", avg('gold_per_min')),
 					CoolStat("XPM", avg('xp_per_min')),
-					CoolStat("Last Hits/min", avg(lambda p: p['last_hits'] / (1 + (p['duration'] / 60)), 2)),
-					CoolStat("Neutral Creeps", avg(lambda p: 100 * p.get('neutral_kills', 0) / (1 + p['last_hits'])))
+					CoolStat("Last Hits/min", avg(last_hits / (1 + (stats.get('duration') / 60)), 2)),
+					CoolStat("Neutral Creeps", avg(100 * np.nan_to_num(stats.get('neutral_kills')) / (1 + last_hits)))
 				]
 			},
 			{
@@ -1250,7 +1222,7 @@ class DotaStats(MangoCog):
 				"stats": [
 					CoolStat("APM", avg('actions_per_min')),
 					CoolStat("Pings", avg('pings')),
-					CoolStat("Wards Placed", avg(lambda p: wards_placed(p)))
+					CoolStat("Wards Placed", avg(wards_placed))
 				]
 			},
 			{
@@ -1533,7 +1505,7 @@ class DotaStats(MangoCog):
 			icon_url=playerinfo["profile"]["avatar"] or default_steam_icon, 
 			url=playerinfo["profile"]["profileurl"] or f"https://www.opendota.com/players/{player.steam_id}")
 
-		image = disnake.File(drawdota.draw_polygraph(role_scores, roles), "rolesgraph.png")
+		image = disnake.File(await executors.run_process(drawgraph.draw_polygraph, role_scores, roles), "rolesgraph.png")
 		embed.set_image(url=f"attachment://{image.filename}")
 		await inter.send(embed=embed, file=image)
 
@@ -1555,7 +1527,7 @@ class DotaStats(MangoCog):
 
 		embed.description = "Skill Builds"
 
-		image = disnake.File(await drawdota.draw_match_ability_upgrades(match), "upgrades.png")
+		image = disnake.File(await get_match_render("match_ability_upgrades", match, lambda: drawdota.draw_match_ability_upgrades(match)), "upgrades.png")
 		embed.set_image(url=f"attachment://{image.filename}")
 
 		self.set_match_footer(match, embed)
@@ -1611,7 +1583,8 @@ class DotaStats(MangoCog):
 		else:
 			raise UserError("oops, look like thats not implemented yet")
 
-		image = disnake.File(drawgraph.drawgraph(lines, colors, labels), "graph.png")
+		render = lambda: executors.run_process(drawgraph.drawgraph, lines, colors, labels)
+		image = disnake.File(await get_match_render("match_graph", match, render, { "graphtype": graphtype }), "graph.png")
 		embed.set_image(url=f"attachment://{image.filename}")
 
 		self.set_match_footer(match, embed)
@@ -1704,50 +1677,86 @@ class DotaStats(MangoCog):
 		await inter.send(embed=embed, file=image)
 				
 	@commands.slash_command()
-	async def percent(self, inter: disnake.CmdInter, filter1: MatchFilter = None, filter2: MatchFilter = None):
+	async def percent(self, inter: disnake.CmdInter, filter1: MatchFilter = None, filter2: MatchFilter = None, filter3: MatchFilter = None, filter4: MatchFilter = None, by_hero: bool = False):
 		"""Out of the matches that match filter1, the percent of them that also match filter2
-    
+
 		Parameters
 		----------
 		filter1: The primary filter that determines the denominator
 		filter2: The secondary filter that determines the numerator
+		filter3: Another filter that the matches also have to match, to narrow it down further
+		filter4: Another filter that the matches also have to match, to narrow it down further
+		by_hero: Also show the percent for each of the heroes played in the filter1 matches
 		"""
 		await self.safe_defer(inter)
 
 		filter1 = await MatchFilter.init(filter1, inter)
 		filter2 = await MatchFilter.init(filter2, inter)
-		
-		matches1 = await opendota_query_filter(filter1)
-		if not matches1:
+		filters = [ filter1, filter2 ] + [ f for f in [ filter3, filter4 ] if f is not None ]
+		if by_hero:
+			filter1.add_projections([ "hero_id" ])
+
+		# the match ids (or history indexes) that match each filter, as sorted arrays so they can be intersected quickly
+		history = None
+		if all(f.player.steam_id == filter1.player.steam_id for f in filters):
+			history = await get_covering_history(*filters)
+		if history is not None:
+			# all of the filters are checked against the one local history, so the indexes line up
+			matchids = [ np.sort(f.check_matches(history)) for f in filters ]
+			hero_ids = history.get_array("hero_id")[matchids[0]] if by_hero else None
+		else:
+			results = await asyncio.gather(*(opendota_query_filter(f) for f in filters))
+			matchids = [ np.unique(np.array([ m["match_id"] for m in matches ], dtype=np.int64)) for matches in results ]
+			if by_hero:
+				heroes = { m["match_id"]: m.get("hero_id") for m in results[0] }
+				hero_ids = np.array([ heroes[match_id] for match_id in matchids[0] ], dtype=np.float64)
+		if len(matchids[0]) == 0:
 			raise MatchNotFoundError(filter1)
 
-		matches2 = await opendota_query_filter(filter2)
+		# narrow it down one filter at a time
+		steps = [ matchids[0] ]
+		for ids in matchids[1:]:
+			steps.append(np.intersect1d(steps[-1], ids, assume_unique=True))
+		both_matching = steps[-1]
 
-		matchids1 = list(map(lambda m: m["match_id"], matches1))
-		matchids2 = list(map(lambda m: m["match_id"], matches2))
-		both_matching = list(filter(lambda id: id in matchids2, matchids1))
-
-		percent = 100 * len(both_matching) / len(matchids1)
+		percent = 100 * len(both_matching) / len(matchids[0])
 
 		embed = disnake.Embed()
 
 		embed.title = f"Percent: {percent:.2f}%"
 
-		description = f"{len(both_matching)} out of {len(matchids1)} matches, or {percent:.2f}% is the answer to the question:\n\n"
+		description = f"{len(both_matching)} out of {len(matchids[0])} matches, or {percent:.2f}% is the answer to the question:\n\n"
 
-		players_match = filter1.player.mention == filter2.player.mention
+		def localize_secondary(matchfilter):
+			text = matchfilter.localize().replace("All matches ", "")
+			text = re.sub(r"^All matches", "", text)
+			if matchfilter.player.mention == filter1.player.mention:
+				text = re.sub(r"^played by [^\s]+", "played", text)
+			return text
 
-		filter1 = filter1.localize()
-		filter2 = filter2.localize().replace("All matches ", "")
-		filter2 = re.sub(r"^All matches", "", filter2)
-		if players_match:
-			filter2 = re.sub(r"^played by [^\s]+", "played", filter2)
+		secondary = [ localize_secondary(f) for f in filters[1:] ]
+		description += "**Out of** " + filter1.localize() + ", **what percent of them were** " + ", **and** ".join(secondary) + "?"
 
-		description += "**Out of** " + filter1 + ", **what percent of them were** " + filter2 + "?"
+		if len(filters) > 2:
+			description += "\n"
+			for text, previous, step in zip(secondary, steps, steps[1:]):
+				step_percent = 100 * len(step) / len(previous) if len(previous) else 0
+				description += f"\n{len(step)} / {len(previous)} ({step_percent:.2f}%) were {text}"
 
 		embed.description = description
 
-		await inter.send(embed=embed)
+		if by_hero:
+			matched = np.isin(matchids[0], both_matching, assume_unique=True)
+			hero_counts = []
+			for hero_id in np.unique(hero_ids[~np.isnan(hero_ids)]):
+				is_hero = hero_ids == hero_id
+				hero_counts.append((int(hero_id), int(is_hero.sum()), int((is_hero & matched).sum())))
+			hero_counts = sorted(hero_counts, key=lambda h: h[1], reverse=True)[:20]
+			image = disnake.File(await drawdota.draw_percent_table(hero_counts), "percent.png")
+			embed.set_image(url=f"attachment://{image.filename}")
+			await inter.send(embed=embed, file=image)
+		else:
+			await inter.send(embed=embed)
 
 
 
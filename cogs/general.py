@@ -13,10 +13,10 @@ import string
 from collections import OrderedDict
 from io import BytesIO
 import urllib.parse
-import base64
 import inspect
 import zoneinfo
 
+import aiohttp
 import disnake
 import praw
 from prawcore import Redirect
@@ -124,6 +124,7 @@ def get_docs_keys():
 if settings.loki:
 	BOT_STAT_MONTHLY_COUNTER = 24 # makes sure we only grab the monthly stats every day
 	LOKI_APPLICATION_NAME = settings.loki["application"]
+	LOKI_AUTH_HEADERS = { "Authorization": aiohttp.BasicAuth(settings.loki["username"], settings.loki["password"]).encode() }
 class BotStats():
 	server_count: int
 	user_count: int
@@ -142,10 +143,7 @@ class BotStats():
 			query_args.append(f"{key}={value}")
 		url += "?" + "&".join(query_args)
 
-		userpass = f"{settings.loki['username']}:{settings.loki['password']}"
-		headers = { "Authorization": f"Basic {base64.b64encode(userpass.encode()).decode()}" }
-
-		data = await httpgetter.get(url, headers=headers)
+		data = await httpgetter.get(url, headers=LOKI_AUTH_HEADERS)
 		return data
 
 	async def query_single_result(self, query):
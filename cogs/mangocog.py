@@ -54,7 +54,8 @@ class MangoCog(disnake.ext.commands.Cog):
 					continue
 		raise MissingClipType(clipid)
 
-	async def get_clip(self, clipid, clip_ctx: ClipContext):
+	# gets a clip. if prepare is False, the clip's audio might not be downloaded/created yet (see Clip.prepare)
+	async def get_clip(self, clipid, clip_ctx: ClipContext, prepare=True):
 		cliptypes = Clip.types_dict()
 
 		match = re.search(f"^({'|'.join(cliptypes)}):(.*)$", clipid.replace("\n", " "))
@@ -62,11 +63,14 @@ class MangoCog(disnake.ext.commands.Cog):
 		if not match:
 			raise MissingClipType(clipid)
 
-		return await cliptypes[match.group(1)]().init(match.group(2), self.bot, clip_ctx)
+		clip = await cliptypes[match.group(1)]().init(match.group(2), self.bot, clip_ctx)
+		if prepare:
+			await clip.prepare()
+		return clip
 
 	async def play_clip(self, clip, clip_ctx: ClipContext, print=False):
 		if isinstance(clip, str):
-			clip = await self.get_clip(clip, clip_ctx)
+			clip = await self.get_clip(clip, clip_ctx, prepare=False) # the audio player gets it ready
 		
 		if clip.type == "url":
 			clip = await self.get_clip("tts:U R L clips have been deprecated", clip_ctx)
@@ -91,5 +95,5 @@ class MangoCog(disnake.ext.commands.Cog):
 			await inter.send("You gotta give me something to say!")
 			return
 		if isinstance(clip, str):
-			clip = await self.get_clip(clip, inter)
+			clip = await self.get_clip(clip, inter, prepare=False)
 		await inter.send(f"{self.get_emoji('chat_wheel_sound')} {clip.clipid}")
@@ -1,13 +1,14 @@
 import asyncio
 import shutil
-from concurrent.futures import ThreadPoolExecutor
 
 import disnake
 import youtube_dl
 from disnake.ext import commands
 from sqlalchemy import desc
 from utils.command import checks
-from utils.tools.globals import botdata, httpgetter, settings, logger
+from utils.tools.globals import botdata, httpgetter, settings, logger, executors
+from utils.tools.httpsessions import close_sessions
+from utils.tools.tts import tts_service
 from utils.tools.helpers import *
 
 from dotabase import Hero
@@ -40,7 +41,7 @@ class Owner(MangoCog):
 		return checks.is_owner_check(ctx_inter.author)
 
 	async def youtube_download(self, youtube_id, video_file):
-		return await self.bot.loop.run_in_executor(ThreadPoolExecutor(max_workers=1), youtube_download_func, youtube_id, video_file)
+		return await executors.run_thread(youtube_download_func, youtube_id, video_file)
 
 	@commands.command()
 	async def addclip(self, ctx, url, clipname, start, end, start_fade=0.25, end_fade=0.25):
@@ -220,8 +221,13 @@ class Owner(MangoCog):
 	@commands.command(aliases=["restart", "quit", "kill", "pokemango", "exit"])
 	async def close(self, ctx):
 		"""Kills the bot"""
+		await botdata.flush_async()
 		await self.bot.change_presence(status=disnake.Status.offline)
+		await httpgetter.close()
 		await self.bot.close()
+		executors.shutdown()
+		tts_service.shutdown()
+		await close_sessions() # the loki logging session goes last, so we can log right up until the end
 
 def setup(bot):
 	bot.add_cog(Owner(bot))
@@ -4,67 +4,69 @@ import sys
 import disnake
 from disnake.ext import commands
 
-import utils.other.errorhandling as errorhandling
-import utils.other.initialization as initialization
-import utils.other.update_script as update_script
-from utils.tools.globals import botdata, logger, settings, httpgetter
-from utils.tools.helpers import *
+# the process pool's workers run this file too (as __mp_main__) when they start up, so the bot only gets set up when
+# this is the script being run. importing the bot's modules opens its databases and http sessions, which workers dont need
+if __name__ == '__main__':
+	import utils.other.errorhandling as errorhandling
+	import utils.other.initialization as initialization
+	import utils.other.update_script as update_script
+	from utils.tools.globals import botdata, logger, settings, httpgetter
+	from utils.tools.helpers import *
 
-startupTimer = SimpleTimer()
+	startupTimer = SimpleTimer()
 
-description = """A discord bot built primarily around playing audio clips and dota related commands.
+	description = """A discord bot built primarily around playing audio clips and dota related commands.
 				For more information about me, try `/bot info`"""
 
-intents = disnake.Intents.default()
-intents.message_content = True
+	intents = disnake.Intents.default()
+	intents.message_content = True
 
-sync_flags = commands.CommandSyncFlags.default()
-sync_flags.sync_commands_debug = False
+	sync_flags = commands.CommandSyncFlags.default()
+	sync_flags.sync_commands_debug = False
 
-bot = commands.AutoShardedBot(
-	command_prefix="?", # for any lingering owner-only commands
-	description=description, 
-	case_insensitive=True,
-	shard_count=settings.shard_count,
-	command_sync_flags=sync_flags,
-	test_guilds=settings.test_guilds,
-	guild_ready_timeout=10.0,
-	reload=False,
-	intents=intents)
-bot.remove_command("help")
+	bot = commands.AutoShardedBot(
+		command_prefix="?", # for any lingering owner-only commands
+		description=description, 
+		case_insensitive=True,
+		shard_count=settings.shard_count,
+		command_sync_flags=sync_flags,
+		test_guilds=settings.test_guilds,
+		guild_ready_timeout=10.0,
+		reload=False,
+		intents=intents)
+	bot.remove_command("help")
 
 
-# registering some global events
-@bot.event
-async def on_shard_ready(shard_id):
-	logger.info(f"shard {shard_id} ({len(bot.shards)} total) called its on_shard_ready ({len(bot.guilds)} guilds)")
+	# registering some global events
+	@bot.event
+	async def on_shard_ready(shard_id):
+		logger.info(f"shard {shard_id} ({len(bot.shards)} total) called its on_shard_ready ({len(bot.guilds)} guilds)")
 
-@bot.event
-async def on_ready():
-	logger.info(f"on_ready() triggered")
+	@bot.event
+	async def on_ready():
+		logger.info(f"on_ready() triggered")
 
-@bot.application_command_check()
-def check_app_commands(inter: disnake.Interaction):
-	return bot.get_cog("Admin").bot_check(inter)
+	@bot.application_command_check()
+	def check_app_commands(inter: disnake.Interaction):
+		return bot.get_cog("Admin").bot_check(inter)
 
-@bot.event
-async def on_command_error(ctx: commands.Context, error: commands.CommandError):
-	await errorhandling.on_prefix_command_error(ctx, error)
+	@bot.event
+	async def on_command_error(ctx: commands.Context, error: commands.CommandError):
+		await errorhandling.on_prefix_command_error(ctx, error)
 
-@bot.event
-async def on_slash_command_error(inter: disnake.Interaction, error: commands.CommandError):
-	await errorhandling.on_app_command_error(inter, error)
+	@bot.event
+	async def on_slash_command_error(inter: disnake.Interaction, error: commands.CommandError):
+		await errorhandling.on_app_command_error(inter, error)
 
 
-from cogs.admin import Admin
-from cogs.audio import Audio
-from cogs.dotabase import Dotabase
-from cogs.dotastats import DotaStats
-from cogs.general import General
-from cogs.owner import Owner
-from cogs.pokemon import Pokemon
+	from cogs.admin import Admin
+	from cogs.audio import Audio
+	from cogs.dotabase import Dotabase
+	from cogs.dotastats import DotaStats
+	from cogs.general import General
+	from cogs.owner import Owner
+	from cogs.pokemon import Pokemon
 
-if __name__ == '__main__':
 	bot.add_cog(General(bot))
 	bot.add_cog(Audio(bot))
 	bot.add_cog(Dotabase(bot))
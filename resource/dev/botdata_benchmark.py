@@ -0,0 +1,135 @@
+# this script benchmarks the botdata stores:
+# - "writes" compares the speed of writing botdata settings with the old botdata.json store vs the sqlite store
+# - "lookups" compares resolving the settings used by on_message via the old list scan vs botdata.guildinfo(...).<key>
+#   and botdata.userinfo(...).<key> (through the item cache and BotDataItem.__getattr__) on both stores
+# run it from the root of the repo with: python resource/dev/botdata_benchmark.py [writes|lookups]
+# it runs in a temporary directory with its own settings.json, so it doesnt touch the real botdata
+
+import os
+import sys
+import json
+import random
+import tempfile
+import argparse
+from collections import OrderedDict
+
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, repo_dir)
+
+tempdir = tempfile.TemporaryDirectory()
+os.chdir(tempdir.name)
+os.symlink(os.path.join(repo_dir, "resource"), "resource") # botdata reads some json from here
+with open("settings.json", "w") as f:
+	json.dump({ "token": "botdata_benchmark" }, f)
+
+from utils.tools.botdatastore import JsonBotDataStore, SqliteBotDataStore
+from utils.tools.botdata import BotData
+from utils.tools.settings import settings
+from utils.tools.helpers import SimpleTimer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("benchmark", choices=["writes", "lookups"], nargs="?", default="writes")
+parser.add_argument("--guilds", type=int, default=None, help="how many guilds to put in the store (2000 for writes, 50000 for lookups)")
+parser.add_argument("--users", type=int, default=200000, help="how many users to put in the store for the lookups benchmark")
+parser.add_argument("--writes", type=int, default=10000, help="how many settings writes to time")
+parser.add_argument("--messages", type=int, default=10000, help="how many on_message settings resolutions to time")
+args = parser.parse_args()
+
+defaults = OrderedDict([
+	("userinfo" , []),
+	("guildinfo" , []),
+	("dotapatch", None),
+	("dotablog",None)
+])
+
+# the settings that get read when handling a message in a tts channel
+ON_MESSAGE_GUILD_KEYS = [ "banned_users", "allowwebhooks", "allowedbots", "ttschannel", "ttsvoicechannel", "voicechannel", "reactions" ]
+ON_MESSAGE_USER_KEYS = [ "ignoremytts" ]
+
+def make_guild_row(guild_id):
+	return OrderedDict([ ("id", guild_id), ("voicechannel", guild_id * 10), ("ttslang", "en") ])
+
+def make_user_row(user_id):
+	return OrderedDict([ ("discord", user_id), ("steam", user_id * 3) ])
+
+def fill_store(store, guild_count, user_count=0):
+	if isinstance(store, JsonBotDataStore):
+		# skip the per-write save while filling up the store
+		store.json_data["guildinfo"] = [make_guild_row(i) for i in range(1, guild_count + 1)]
+		store.json_data["userinfo"] = [make_user_row(i) for i in range(1, user_count + 1)]
+		store._build_indexes(store.json_data)
+	else:
+		rows = {}
+		for i in range(1, guild_count + 1):
+			rows[("guildinfo", i)] = make_guild_row(i)
+		for i in range(1, user_count + 1):
+			rows[("userinfo", i)] = make_user_row(i)
+		store._write((rows, {}))
+		store._load()
+
+def run_writes(name, store):
+	guild_count = args.guilds or 2000
+	fill_store(store, guild_count)
+
+	timer = SimpleTimer()
+	for i in range(args.writes):
+		guild_id = random.randint(1, guild_count)
+		row = OrderedDict(store.get_row("guildinfo", guild_id))
+		row["voicechannel"] = i
+		store.set_row("guildinfo", guild_id, row)
+	print(f"{name}: {args.writes} writes over {guild_count} guilds took {timer.miliseconds}ms")
+
+# how BotDataItem used to find its row: a scan of the whole list for every attribute read
+def old_list_scan(json_data, list_key, key_name, primary_key):
+	for item in json_data[list_key]:
+		if item.get(key_name) == primary_key:
+			return item
+	return None
+
+def run_old_lookups(messages, guild_count):
+	store = JsonBotDataStore(os.path.join(tempdir.name, "old_botdata.json"), defaults)
+	fill_store(store, guild_count, args.users)
+	# the old list scan is far too slow to do for every message, so we only do a sample
+	old_messages = messages[:max(1, args.messages // 100)]
+	timer = SimpleTimer()
+	for guild_id, user_id in old_messages:
+		for key in ON_MESSAGE_GUILD_KEYS:
+			old_list_scan(store.json_data, "guildinfo", "id", guild_id).get(key)
+		for key in ON_MESSAGE_USER_KEYS:
+			old_list_scan(store.json_data, "userinfo", "discord", user_id).get(key)
+	print(f"list scan: {timer.miliseconds / len(old_messages):.4f}ms per message")
+
+# resolves the settings the way on_message does, through botdata's item cache and BotDataItem.__getattr__
+def run_lookups(backend, messages, guild_count):
+	os.makedirs(backend)
+	os.chdir(backend) # BotData keeps its files in the working directory
+	settings.json_data["botdata_backend"] = backend
+	botdata = BotData()
+	fill_store(botdata.store, guild_count, args.users)
+
+	timer = SimpleTimer()
+	for guild_id, user_id in messages:
+		guildinfo = botdata.guildinfo(guild_id)
+		for key in ON_MESSAGE_GUILD_KEYS:
+			getattr(guildinfo, key)
+		userinfo = botdata.userinfo(user_id)
+		for key in ON_MESSAGE_USER_KEYS:
+			getattr(userinfo, key)
+	print(f"{backend} botdata: {timer.miliseconds / len(messages):.4f}ms per message")
+	botdata.flush()
+	if isinstance(botdata.store, SqliteBotDataStore):
+		botdata.store.close()
+	os.chdir(tempdir.name)
+
+if args.benchmark == "writes":
+	run_writes("json", JsonBotDataStore(os.path.join(tempdir.name, "botdata.json"), defaults))
+	store = SqliteBotDataStore(os.path.join(tempdir.name, "botdata.db"))
+	run_writes("sqlite", store)
+	store.close()
+else:
+	guild_count = args.guilds or 50000
+	messages = [(random.randint(1, guild_count), random.randint(1, args.users)) for i in range(args.messages)]
+	print(f"on_message settings resolution over {guild_count} guilds and {args.users} users:")
+	run_old_lookups(messages, guild_count)
+	run_lookups("json", messages, guild_count)
+	run_lookups("sqlite", messages, guild_count)
@@ -0,0 +1,49 @@
+# this script checks that the http cache's byte budgets evict the least recently used files, including ones that were
+# cached permanently (like the vpk images from get_url_image). it runs in a temporary directory with its own
+# settings.json and cache, so it doesnt touch the real cache
+# run it from the root of the repo with: python resource/dev/cache_budget_check.py
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, repo_dir)
+
+temp_dir = tempfile.TemporaryDirectory()
+os.chdir(temp_dir.name)
+with open("settings.json", "w") as f:
+	json.dump({ "token": "cache_budget_check", "cache_budget": { "image": 1000 } }, f)
+
+from utils.tools.cache import Cache
+
+async def add_file(cache, uri, size, permanent=False):
+	filename = await cache.new(uri, "png", permanent=permanent)
+	with open(filename, "wb") as f:
+		f.write(b"x" * size)
+	await asyncio.sleep(0.01) # so each file gets its own timestamp
+	return filename
+
+async def main():
+	cache = Cache(asyncio.get_running_loop())
+	old_filename = await add_file(cache, "https://cdn.example.com/old_permanent.png", 600, permanent=True)
+	await add_file(cache, "https://cdn.example.com/newer.png", 300)
+	await add_file(cache, "https://cdn.example.com/newest_permanent.png", 300, permanent=True)
+	await add_file(cache, "https://example.com/other.json", 5000) # in a class without a budget
+	await cache.evict_over_budget()
+
+	remaining = sorted(uri.split("/")[-1] for uri in cache.cache_data)
+	print(f"left after eviction: {remaining}")
+	assert "old_permanent.png" not in remaining, "an over-budget permanent image didn't get evicted"
+	assert "newer.png" in remaining and "newest_permanent.png" in remaining, "evicted more than it needed to"
+	assert "other.json" in remaining, "evicted something from a class that isn't over budget"
+	assert not os.path.exists(old_filename), "the evicted file is still on disk"
+	stats = cache.stats["image"]
+	assert stats["evicted_count"] == 1 and stats["evicted_bytes"] == 600, f"wrong eviction stats: {stats}"
+	print("all good")
+	cache.conn.close()
+
+asyncio.run(main())
+temp_dir.cleanup()
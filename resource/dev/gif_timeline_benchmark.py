@@ -0,0 +1,119 @@
+# this script benchmarks building the per-second timelines used by the match gif (player positions, deaths, and runes)
+# it compares the old approach of scanning every event for every second against the numpy timeline builders,
+# and checks that they both give the same result. by default it uses a generated 60 minute stratz match
+# run it from the root of the repo with: python resource/dev/gif_timeline_benchmark.py [stratz_match.json]
+
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from utils.tools.helpers import SimpleTimer, read_json
+from utils.drawing.timeline import get_position_timeline, get_death_timeline, RuneTimeline
+
+parser = argparse.ArgumentParser()
+parser.add_argument("match_file", nargs="?", help="a stratz match json file to use instead of a generated match")
+parser.add_argument("--start", type=int, default=-89, help="the start of the gif, in seconds")
+parser.add_argument("--end", type=int, default=None, help="the end of the gif, in seconds (defaults to the end of the match)")
+args = parser.parse_args()
+
+MATCH_START = -89
+
+def make_stratz_match(duration):
+	players = []
+	for slot in range(10):
+		deaths = []
+		for t in sorted(random.sample(range(300, duration), 10)):
+			deaths.append({ "time": t, "timeDead": random.randint(10, 90) })
+		positions = []
+		for t in range(MATCH_START, duration):
+			if random.random() < 0.7: # stratz only sends a position when it changes
+				positions.append({ "time": t, "x": random.randint(64, 192), "y": random.randint(64, 192) })
+		players.append({ "playbackData": { "playerUpdatePositionEvents": positions, "deathEvents": deaths } })
+	rune_events = []
+	index_id = 0
+	for t in range(0, duration, 120):
+		for i in range(2):
+			index_id += 1
+			x, y = random.randint(64, 192), random.randint(64, 192)
+			rune = random.randint(0, 9)
+			rune_events.append({ "time": t, "action": 0, "indexId": index_id, "rune": rune, "positionX": x, "positionY": y })
+			rune_events.append({ "time": t + random.randint(5, 110), "action": 1, "indexId": index_id, "rune": rune, "positionX": x, "positionY": y })
+	return { "durationSeconds": duration, "players": players, "playbackData": { "runeEvents": rune_events } }
+
+# the timeline code that create_dota_gif_main used to have
+def old_player_timeline(positionEvents, deathEvents, start_time, end_time):
+	x = 0
+	y = 0
+	data = {}
+	for t in range(MATCH_START, end_time + 1):
+		event = next((e for e in positionEvents if e["time"] == t), None)
+		if event:
+			x = event["x"]
+			y = event["y"]
+		if t >= start_time:
+			data[t] = { "x": x, "y": y }
+
+	death_timer = 0
+	for t in range(MATCH_START, end_time + 1):
+		event = next((e for e in deathEvents if e["time"] == t), None)
+		if event:
+			death_timer = event["timeDead"]
+		if t >= start_time:
+			data[t]["dead"] = death_timer > 0
+		if death_timer > 0:
+			death_timer -= 1
+	return data
+
+def old_rune_timeline(runeEvents, start_time, end_time):
+	current_runes = {}
+	runes = {}
+	for t in range(MATCH_START, end_time + 1):
+		for e in filter(lambda e: e["time"] == t and e["action"] == 0, runeEvents):
+			current_runes[e["indexId"]] = {
+				"type": e["rune"],
+				"x": e["positionX"],
+				"y": e["positionY"]
+			}
+		if t >= start_time and current_runes:
+			runes[t] = current_runes.copy()
+		for e in filter(lambda e: e["time"] == t and e["action"] == 1, runeEvents):
+			if e["indexId"] in current_runes:
+				del current_runes[e["indexId"]]
+	return runes
+
+def new_player_timeline(positionEvents, deathEvents, start_time, end_time):
+	xs, ys = get_position_timeline(positionEvents, MATCH_START, start_time, end_time)
+	dead = get_death_timeline(deathEvents, MATCH_START, start_time, end_time)
+	return xs, ys, dead
+
+stratz_match = read_json(args.match_file) if args.match_file else make_stratz_match(60 * 60)
+start_time = max(args.start, MATCH_START)
+end_time = args.end if args.end is not None else stratz_match["durationSeconds"]
+players = [ (p["playbackData"]["playerUpdatePositionEvents"], p["playbackData"]["deathEvents"]) for p in stratz_match["players"] ]
+rune_events = stratz_match["playbackData"]["runeEvents"]
+print(f"timelines from {start_time}s to {end_time}s for {len(players)} players and {len(rune_events)} rune events")
+
+timer = SimpleTimer()
+old_players = [ old_player_timeline(positions, deaths, start_time, end_time) for positions, deaths in players ]
+old_runes = old_rune_timeline(rune_events, start_time, end_time)
+old_time = timer.miliseconds
+print(f"old: {old_time}ms")
+
+timer = SimpleTimer()
+new_players = [ new_player_timeline(positions, deaths, start_time, end_time) for positions, deaths in players ]
+new_runes = RuneTimeline(rune_events, MATCH_START, end_time)
+new_time = timer.miliseconds
+print(f"new: {new_time}ms ({old_time / max(new_time, 1):.0f}x faster)")
+
+# make sure they match
+for old, (xs, ys, dead) in zip(old_players, new_players):
+	for i, t in enumerate(range(start_time, end_time + 1)):
+		assert (old[t]["x"], old[t]["y"], old[t]["dead"]) == (xs[i], ys[i], dead[i]), f"player timelines differ at {t}"
+for t in range(start_time, end_time + 1):
+	old = sorted((r["type"], r["x"], r["y"]) for r in old_runes.get(t, {}).values())
+	new = sorted((r["type"], r["x"], r["y"]) for r in new_runes.get(t))
+	assert old == new, f"rune timelines differ at {t}"
+print("results match")
@@ -0,0 +1,74 @@
+# this script checks that HttpGetter.get coalesces concurrent duplicate requests. it starts a local aiohttp server that
+# counts how many times each path gets hit, fires a bunch of identical requests at it at once, and asserts that the
+# server only saw one of them. requests with different headers should not be coalesced, so those are checked too
+# run it from the root of the repo with: python resource/dev/httpgetter_coalesce_check.py [--callers 100]
+
+import os
+import sys
+import asyncio
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from aiohttp import web
+from utils.tools.helpers import SimpleTimer
+import utils.tools.httpgetter
+from utils.tools.httpgetter import HttpGetter
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--callers", type=int, default=100, help="how many callers request the same url at once")
+parser.add_argument("--delay", type=float, default=0.2, help="how many seconds the server takes to respond")
+args = parser.parse_args()
+
+hits = Counter()
+
+async def handle(request):
+	hits[(request.path, request.headers.get("Authorization"))] += 1
+	await asyncio.sleep(args.delay) # so that all of the callers are waiting on the request at the same time
+	return web.json_response({ "path": request.path, "auth": request.headers.get("Authorization") })
+
+async def check(httpgetter, name, url, expected_hits, **kwargs):
+	hits.clear()
+	timer = SimpleTimer()
+	results = await asyncio.gather(*(httpgetter.get(url, **kwargs) for i in range(args.callers)))
+	total_hits = sum(hits.values())
+	print(f"{name}: {args.callers} callers, {total_hits} upstream hit(s), {timer.miliseconds}ms")
+	assert total_hits == expected_hits, f"expected {expected_hits} upstream hit(s), got {total_hits}"
+	assert all(result == results[0] for result in results), "callers got different results"
+	assert len(set(id(result) for result in results)) == len(results), "callers were given the same object"
+	return results
+
+async def check_headers(httpgetter, url):
+	hits.clear()
+	results = await asyncio.gather(*(httpgetter.get(url, headers={ "Authorization": f"token{i % 2}" }) for i in range(args.callers)))
+	print(f"different headers: {args.callers} callers with 2 different auth headers, {sum(hits.values())} upstream hit(s)")
+	assert sum(hits.values()) == 2, "requests with different headers were coalesced"
+	assert all(result["auth"] == f"token{i % 2}" for i, result in enumerate(results)), "a caller got a response for someone else's headers"
+
+async def main():
+	app = web.Application()
+	app.router.add_get("/{name}", handle)
+	runner = web.AppRunner(app)
+	await runner.setup()
+	site = web.TCPSite(runner, "127.0.0.1", 0)
+	await site.start()
+	port = site._server.sockets[0].getsockname()[1]
+	base_url = f"http://127.0.0.1:{port}"
+
+	# the global httpgetter gets created on import, but we want one made on this loop
+	global_httpgetter = utils.tools.httpgetter.httpgetter
+	for session in [ global_httpgetter.session, *global_httpgetter.pool_sessions.values() ]:
+		await session.close()
+	httpgetter = HttpGetter()
+	try:
+		await check(httpgetter, "uncached", f"{base_url}/uncached", 1)
+		await check(httpgetter, "cached", f"{base_url}/cached", 1, cache=True)
+		await httpgetter.cache.remove(f"{base_url}/cached")
+		await check_headers(httpgetter, f"{base_url}/headers")
+		print(f"all good, {httpgetter.coalesced_count} requests coalesced")
+	finally:
+		await httpgetter.close()
+		await runner.cleanup()
+
+asyncio.run(main())
@@ -0,0 +1,112 @@
+# this script compares the match store against keeping match json in the http cache, for read latency and bytes on disk
+# by default it uses generated stratz-style matches, but you can point it at real match json files (like ones from resource/cache/)
+# run it from the root of the repo with: python resource/dev/matchstore_benchmark.py [--source stratz|opendota] [files...]
+
+import os
+import sys
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import orjson
+from utils.tools.helpers import SimpleTimer, read_json
+from utils.tools.matchstore import MatchStore, split_match
+
+parser = argparse.ArgumentParser()
+parser.add_argument("files", nargs="*", help="match json files to use instead of generated matches")
+parser.add_argument("--source", choices=["stratz", "opendota"], default="stratz")
+parser.add_argument("--matches", type=int, default=20, help="how many matches to generate if no files are given")
+parser.add_argument("--reads", type=int, default=5, help="how many times to read each match")
+args = parser.parse_args()
+
+def make_stratz_match(match_id):
+	duration = random.randint(1800, 3000)
+	players = []
+	for slot in range(10):
+		players.append({
+			"steamAccountId": random.randint(1, 10**9),
+			"heroId": random.randint(1, 130),
+			"isRadiant": slot < 5,
+			"numKills": random.randint(0, 20),
+			"numDeaths": random.randint(0, 20),
+			"numAssists": random.randint(0, 30),
+			"playbackData": {
+				"playerUpdatePositionEvents": [ { "time": t, "x": random.randint(60, 190), "y": random.randint(60, 190) } for t in range(-90, duration) ],
+				"playerUpdateHealthEvents": [ { "time": t, "hp": random.randint(0, 3000), "maxHp": 3000 } for t in range(-90, duration, 2) ],
+				"purchaseEvents": [ { "time": random.randint(0, duration), "item": random.randint(1, 300) } for i in range(40) ],
+				"killEvents": [ { "time": random.randint(0, duration), "target": random.randint(1, 130) } for i in range(10) ]
+			},
+			"stats": {
+				"networthPerMinute": [ random.randint(0, 40000) for m in range(duration // 60) ],
+				"experiencePerMinute": [ random.randint(0, 40000) for m in range(duration // 60) ],
+				"lastHitsPerMinute": [ random.randint(0, 15) for m in range(duration // 60) ]
+			}
+		})
+	return {
+		"id": match_id,
+		"didRadiantWin": random.choice([True, False]),
+		"durationSeconds": duration,
+		"parsedDateTime": 1700000000,
+		"players": players,
+		"playbackData": {
+			"buildingEvents": [ { "time": random.randint(0, duration), "npcId": random.randint(1, 50), "hp": 0 } for i in range(30) ],
+			"runeEvents": [ { "time": t, "rune": random.randint(0, 6) } for t in range(0, duration, 120) ]
+		}
+	}
+
+def load_matches():
+	if args.files:
+		return [ (i, read_json(filename)) for i, filename in enumerate(args.files) ]
+	return [ (i, make_stratz_match(i)) for i in range(args.matches) ]
+
+# what /match info and similar commands look at: top level info and each player's basic stats
+def read_summary(match):
+	for player in match["players"]:
+		player.get("isRadiant", player.get("isRadiant"))
+	return match.get("durationSeconds", match.get("duration"))
+
+with tempfile.TemporaryDirectory() as tempdir:
+	matches = load_matches()
+	store = MatchStore(os.path.join(tempdir, "matches.db"))
+
+	json_files = []
+	json_bytes = 0
+	for match_id, match in matches:
+		filename = os.path.join(tempdir, f"{match_id}.json")
+		data = orjson.dumps(match)
+		with open(filename, "wb") as f:
+			f.write(data)
+		json_bytes += len(data)
+		json_files.append(filename)
+		store._save(args.source, match_id, *split_match(args.source, match), True)
+	store_bytes = store.conn.execute("SELECT SUM(size) FROM matches").fetchone()[0]
+
+	print(f"{len(matches)} {args.source} matches")
+	print(f"bytes on disk: cache json {json_bytes / len(matches) / 1024:.0f}KB per match, match store {store_bytes / len(matches) / 1024:.0f}KB per match")
+
+	reads = [ match for match in range(len(matches)) for i in range(args.reads) ]
+
+	timer = SimpleTimer()
+	for i in reads:
+		read_summary(read_json(json_files[i]))
+	print(f"summary read: cache json {timer.miliseconds / len(reads):.2f}ms", end="")
+	timer = SimpleTimer()
+	for i in reads:
+		read_summary(store.load(args.source, matches[i][0]))
+	print(f", match store {timer.miliseconds / len(reads):.2f}ms")
+
+	timer = SimpleTimer()
+	for i in reads:
+		read_json(json_files[i])
+	print(f"full read: cache json {timer.miliseconds / len(reads):.2f}ms", end="")
+	timer = SimpleTimer()
+	for i in reads:
+		match = store.load(args.source, matches[i][0])
+		match.load_all()
+		for player in match["players"]:
+			player.load_all()
+	print(f", match store {timer.miliseconds / len(reads):.2f}ms")
+
+	store.close()
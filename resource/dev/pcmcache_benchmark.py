@@ -0,0 +1,89 @@
+# this script benchmarks starting the same short clip in a bunch of guilds at once (like intros when a lot of people
+# join voice at the same time), comparing a new ffmpeg process per playback (like the audio player used to do) against
+# playing it from the pcm cache. it reports the cpu time used and how long it took until each guild had its first frame
+# run it from the root of the repo with: python resource/dev/pcmcache_benchmark.py [--guilds 100] [--clip <audio file>]
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import numpy as np
+from utils.tools.pcmcache import PCMCache, FRAME_SIZE
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--guilds", type=int, default=100, help="how many guilds start the clip at once")
+parser.add_argument("--clip", default="resource/clips/spongebob/patrick.mp3", help="the clip to play")
+parser.add_argument("--volume", type=float, default=0.6)
+args = parser.parse_args()
+
+def get_cpu_time():
+	usage_self = resource.getrusage(resource.RUSAGE_SELF)
+	usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return usage_self.ru_utime + usage_self.ru_stime + usage_children.ru_utime + usage_children.ru_stime
+
+def apply_volume(frame, volume):
+	# what PCMVolumeTransformer does to each frame
+	samples = np.frombuffer(frame, dtype=np.int16)
+	return np.clip(samples * np.float32(volume), -32768, 32767).astype(np.int16).tobytes()
+
+# the old way: an ffmpeg process per playback (the same arguments disnake.FFmpegPCMAudio uses), with the volume applied to every frame
+async def play_ffmpeg(started):
+	process = await asyncio.create_subprocess_exec("ffmpeg", "-i", args.clip, "-f", "s16le", "-ar", "48000", "-ac", "2", "-loglevel", "warning", "pipe:1",
+		stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+	first_frame = None
+	frames = 0
+	while True:
+		try:
+			frame = await process.stdout.readexactly(FRAME_SIZE)
+		except asyncio.IncompleteReadError as e:
+			frame = e.partial
+		if not frame:
+			break
+		apply_volume(frame, args.volume)
+		frames += 1
+		if first_frame is None:
+			first_frame = time.perf_counter() - started
+	await process.wait()
+	return first_frame, frames
+
+# the new way: decode it into the cache (once, no matter how many guilds ask at the same time), then play from memory
+async def play_cached(cache: PCMCache, started):
+	await cache.prepare(args.clip, args.volume)
+	source = cache.get_source(args.clip, args.volume)
+	first_frame = None
+	frames = 0
+	while source.read():
+		frames += 1
+		if first_frame is None:
+			first_frame = time.perf_counter() - started
+	return first_frame, frames
+
+def report(name, results, cpu_time, wall_time):
+	first_frames = sorted(first_frame * 1000 for first_frame, frames in results)
+	print(f"{name}: cpu {cpu_time * 1000:.0f}ms, wall {wall_time * 1000:.0f}ms, time to first audio: median {first_frames[len(first_frames) // 2]:.1f}ms, p95 {first_frames[int(len(first_frames) * 0.95)]:.1f}ms, max {first_frames[-1]:.1f}ms")
+
+async def run(name, play):
+	cpu_start = get_cpu_time()
+	started = time.perf_counter()
+	results = await asyncio.gather(*(play(started) for i in range(args.guilds)))
+	report(name, results, get_cpu_time() - cpu_start, time.perf_counter() - started)
+	return results
+
+async def main():
+	print(f"{args.guilds} guilds playing {args.clip}")
+	old_results = await run("ffmpeg per playback", play_ffmpeg)
+
+	cache = PCMCache(64 * 1024 * 1024)
+	await cache.prepare(args.clip, args.volume) # clips only get cached once they've been played before, so this is the first play
+	cache.reset_stats()
+	new_results = await run("pcm cache (cold)", lambda started: play_cached(cache, started))
+	await run("pcm cache (warm)", lambda started: play_cached(cache, started))
+	print(f"cache: {cache.size} clips, {cache.total_bytes // 1024}KB, {cache.hits} hits, {cache.misses} misses, {cache.decoded} decoded")
+	assert abs(old_results[0][1] - new_results[0][1]) <= 1, "frame counts differ"
+
+asyncio.run(main())
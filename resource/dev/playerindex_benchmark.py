@@ -0,0 +1,129 @@
+# this script benchmarks /profile's match history lookup with the player index, against pulling the whole history
+# from opendota every time (like /profile used to). opendota is faked with a generated 10k match history, so the
+# numbers for the old approach dont include the actual download, which is usually the slowest part
+# run it from the root of the repo with: python resource/dev/playerindex_benchmark.py [--matches 10000]
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import argparse
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import orjson
+from utils.tools.helpers import SimpleTimer
+from utils.tools.playerindex import PlayerIndex
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--matches", type=int, default=10000, help="how many matches the player has played")
+parser.add_argument("--reads", type=int, default=20, help="how many warm lookups to time")
+args = parser.parse_args()
+
+STEAM_ID = 12345
+# what opendota sends when nothing is projected
+DEFAULT_COLUMNS = [ "start_time", "duration", "game_mode", "lobby_type", "hero_id", "version", "kills", "deaths", "assists", "party_size" ]
+PROFILE_COLUMNS = [ "player_slot", "radiant_win", "hero_id", "start_time", "duration" ]
+
+def make_match(match_id, start_time):
+	return {
+		"match_id": match_id,
+		"player_slot": random.choice([ 0, 1, 2, 3, 4, 128, 129, 130, 131, 132 ]),
+		"radiant_win": random.random() < 0.5,
+		"start_time": start_time,
+		"duration": random.randint(900, 4000),
+		"game_mode": random.choice([ 1, 22, 22, 22, 23 ]),
+		"lobby_type": random.choice([ 0, 7, 7 ]),
+		"hero_id": random.randint(1, 130),
+		"version": random.choice([ None, None, 21 ]),
+		"kills": random.randint(0, 20),
+		"deaths": random.randint(0, 15),
+		"assists": random.randint(0, 30),
+		"party_size": random.randint(1, 5),
+		"hero_variant": random.randint(1, 3),
+		"significant": random.random() < 0.9
+	}
+
+class FakeOpenDota:
+	"""Answers /players/{id}/matches queries the way opendota does, from a generated history"""
+	def __init__(self, count):
+		start_time = int(time.time()) - (count * 3 * 3600)
+		self.matches = [ make_match(5000000000 + i, start_time + (i * 3 * 3600)) for i in range(count) ]
+		self.queries = []
+
+	def add_match(self):
+		last = self.matches[-1]
+		self.matches.append(make_match(last["match_id"] + 1, int(time.time()) - 60))
+
+	def get_response(self, querystring):
+		url = urlparse(querystring)
+		query = parse_qs(url.query)
+		columns = [ "match_id", "player_slot", "radiant_win" ] + query.get("project", DEFAULT_COLUMNS)
+		matches = self.matches
+		if query.get("significant", [ "1" ])[0] != "0":
+			matches = [ m for m in matches if m["significant"] ]
+		if "date" in query:
+			cutoff = time.time() - (int(query["date"][0]) * 86400)
+			matches = [ m for m in matches if m["start_time"] >= cutoff ]
+		return orjson.dumps([ { column: m.get(column) for column in columns } for m in reversed(matches) ])
+
+	async def query(self, querystring):
+		response = self.get_response(querystring)
+		self.queries.append((querystring, len(response)))
+		return orjson.loads(response)
+
+def profile_stats(matches):
+	matches = [ m for m in matches if m.get("player_slot") is not None ]
+	wins = sum(1 for m in matches if m["radiant_win"] == (m["player_slot"] < 128))
+	heroes = {}
+	for match in matches:
+		heroes[match["hero_id"]] = heroes.get(match["hero_id"], 0) + 1
+	return len(matches), wins, sorted(heroes.items(), key=lambda x: x[1], reverse=True)[:3], sum(m["duration"] for m in matches)
+
+async def main():
+	opendota = FakeOpenDota(args.matches)
+	with tempfile.TemporaryDirectory() as tempdir:
+		index = PlayerIndex(os.path.join(tempdir, "player_index.db"))
+
+		timer = SimpleTimer()
+		await index.get(STEAM_ID, PROFILE_COLUMNS, opendota.query)
+		print(f"cold (full sync of {args.matches} matches): {timer.miliseconds}ms, {len(opendota.queries)} queries, {sum(size for q, size in opendota.queries) // 1024}KB downloaded")
+
+		full_response = opendota.get_response(f"/players/{STEAM_ID}/matches")
+		old_times = []
+		for i in range(args.reads):
+			timer = SimpleTimer()
+			old_stats = profile_stats(orjson.loads(full_response))
+			old_times.append(timer.miliseconds)
+		print(f"old (decode the full history response + stats): {sum(old_times) / len(old_times):.1f}ms, plus downloading {len(full_response) // 1024}KB every time")
+
+		opendota.queries = []
+		new_times = []
+		for i in range(args.reads):
+			timer = SimpleTimer()
+			history = await index.get(STEAM_ID, PROFILE_COLUMNS, opendota.query)
+			new_stats = profile_stats(history.rows(PROFILE_COLUMNS, significant_only=True))
+			new_times.append(timer.miliseconds)
+		print(f"warm (load the index + stats): {sum(new_times) / len(new_times):.1f}ms, {len(opendota.queries)} queries")
+		assert old_stats == new_stats, "profile stats differ"
+
+		for i in range(3):
+			opendota.add_match()
+		timer = SimpleTimer()
+		history = await index.get(STEAM_ID, PROFILE_COLUMNS, opendota.query, max_age=0)
+		print(f"incremental sync (3 new matches): {timer.miliseconds}ms, {len(opendota.queries)} queries, {sum(size for q, size in opendota.queries) // 1024}KB downloaded")
+		assert profile_stats(history.rows(PROFILE_COLUMNS, significant_only=True)) == profile_stats(orjson.loads(opendota.get_response(f"/players/{STEAM_ID}/matches"))), "stats differ after sync"
+
+		opendota.queries = []
+		timer = SimpleTimer()
+		history = await index.get(STEAM_ID, [ "hero_variant" ], opendota.query)
+		print(f"adding a column: {timer.miliseconds}ms, {len(opendota.queries)} queries, {sum(size for q, size in opendota.queries) // 1024}KB downloaded")
+		expected = [ m["hero_variant"] for m in reversed(opendota.matches) ]
+		assert history.columns["hero_variant"] == expected, "merged column differs"
+		print("results match")
+		index.close()
+
+asyncio.run(main())
@@ -1,42 +1,13 @@
-import functools
 import re
 from abc import ABCMeta, abstractmethod
-from concurrent.futures import ThreadPoolExecutor
 
 import disnake
-import requests
-from gtts import gTTS
-from utils.tools.globals import botdata, httpgetter, logger, settings
+from utils.tools.globals import botdata, httpgetter, logger, settings, executors
+from utils.tools.audiolength import audio_lengths
+from utils.tools.tts import tts_service
 from utils.tools.helpers import *
 
 
-def tts_save(filename, text, lang):
-	# run_command(["pico2wave", "--wave", filename, "-l", "en-GB", text])
-	loop_count = 10
-	if "-" in lang:
-		lang = "en"
-	while loop_count > 0:
-		loop_count -= 1
-		try:
-			tts = gTTS(text=text, lang=lang, lang_check=False)
-			tts.save(filename)
-		except ValueError as e:
-			if loop_count > 0 and e.args and e.args[0] == "Unable to find token seed! Did https://translate.google.com change?":
-				logger.error(f"Got bad seed exception. Looping {loop_count} more times")
-				continue # loop, as reccomended here: https://github.com/pndurette/gTTS/issues/176#issuecomment-723393140
-			else:
-				raise
-		except AttributeError:
-			raise UserError("Whoops. Looks like gtts is broken right now.")
-		except (RecursionError, requests.exceptions.HTTPError):
-			raise UserError("There was a problem converting that via gtts")
-		except AssertionError as e:
-			if e.args and e.args[0] == "No text to send to TTS API":
-				raise UserError("I can't convert that to TTS. Looks like there's not much there.")
-			else:
-				raise
-		return # if we succeed, return
-
 class ClipNotFound(UserError):
 	def __init__(self, cliptype, clipname):
 		super().__init__("There ain't a {} clip with the name '{}'".format(cliptype, clipname))
@@ -53,15 +24,34 @@ class MissingClipType(UserError):
 # await Clip().init(<stuffhere>)
 # instead of:
 # Clip(<stuffhere>)
+#
+# init should be quick, and leave anything slow (like downloading or
+# synthesizing the audio) to load_audio, which gets called by prepare().
+# that way the audio player can queue a clip right away, and get it
+# ready while the clips ahead of it are playing
 
 class Clip(object):
 	async def init(self, clipname, audiopath, text="", volume=0.6):
 		self.name = clipname
-		self.audiopath = audiopath
+		self.audiopath = audiopath # None until prepare() if this clip has to load its audio
 		self.text = text
 		self.volume = volume
 		return self
 
+	async def load_audio(self):
+		"""Downloads or creates this clip's audio file, and returns its filename. Only called if init didn't set the audiopath"""
+		raise NotImplementedError()
+
+	async def prepare(self):
+		"""Makes sure this clip's audio file is ready to play"""
+		if self.audiopath is None:
+			self.audiopath = await self.load_audio()
+		try: # so we know how long the clip is without having to ffprobe it later
+			await audio_lengths.fill(self.audiopath)
+		except Exception as e:
+			logger.warning(f"couldn't get the audio length of {self.audiopath}: {e}")
+		return self
+
 	@classmethod
 	@abstractmethod
 	def type(cls):
@@ -77,7 +67,7 @@ class Clip(object):
 
 	@property
 	def audiolength(self):
-		return round(float(run_command(["ffprobe", "-i", self.audiopath, "-show_entries", "format=duration", "-v", "quiet", "-of", "csv=p=0"])), 2)
+		return round(audio_lengths.get(self.audiopath), 2)
 
 	async def get_info_embed(self):
 		embed = disnake.Embed()
@@ -140,18 +130,11 @@ class LocalClip(Clip):
 class TtsClip(Clip):
 	async def init(self, text, bot, clip_ctx: ClipContext):
 		data = botdata.guildinfo(clip_ctx)
-		ttslang = "en-au" if not data else data.ttslang
-		uri = f"clip_tts_{ttslang}:{text}"
-
-		filename = await httpgetter.cache.get_filename(uri)
-		if not filename:
-			filename = await httpgetter.cache.new(uri, "wav")
-			try:
-				await bot.loop.run_in_executor(ThreadPoolExecutor(), functools.partial(tts_save, filename, text, ttslang))
-			except:
-				await httpgetter.cache.remove(uri)
-				raise
-		return await Clip.init(self, text, filename, text)
+		self.ttslang = "en-au" if not data else data.ttslang
+		return await Clip.init(self, text, None, text)
+
+	async def load_audio(self):
+		return await tts_service.get(self.text, self.ttslang)
 
 	@classmethod
 	def type(cls):
@@ -176,13 +159,15 @@ class PokeClip(Clip):
 		if is_mega:
 			urlpart = f"{urlpart}-mega"
 
-		url = f"http://dillerm.io/data/pokemon_cries/{urlpart}.ogg"
-		filename = await httpgetter.get(url, "filename", cache=True)
+		self.url = f"http://dillerm.io/data/pokemon_cries/{urlpart}.ogg"
 		
-		clip = await Clip.init(self, clipname, filename)
+		clip = await Clip.init(self, clipname, None)
 		clip.volume = 0.1
 		return clip
 
+	async def load_audio(self):
+		return await httpgetter.get(self.url, "filename", cache=True)
+
 	@classmethod
 	def type(cls):
 		return "poke"
@@ -226,8 +211,10 @@ class UrlClip(Clip):
 		if not re.match(f'^https?://.*\.({audio_extensions})$', url):
 			raise UserError("That's not a valid audio url")
 
-		filename = await httpgetter.get(url, "filename", cache=True)
-		return await Clip.init(self, url, filename)
+		return await Clip.init(self, url, None)
+
+	async def load_audio(self):
+		return await httpgetter.get(self.name, "filename", cache=True)
 
 	@classmethod
 	def type(cls):
@@ -245,8 +232,11 @@ class DotaClip(Clip):
 		if self.response.voice.image:
 			self.voice_thumbnail = dotabase.vpkurl + self.response.voice.image
 
-		filename = await httpgetter.get(dotabase.vpkurl + self.response.mp3, "filename", cache=True)
-		return await Clip.init(self, responsename, filename, text=self.response.text, volume=0.4)
+		self.url = dotabase.vpkurl + self.response.mp3
+		return await Clip.init(self, responsename, None, text=self.response.text, volume=0.4)
+
+	async def load_audio(self):
+		return await httpgetter.get(self.url, "filename", cache=True)
 
 	@classmethod
 	def type(cls):
@@ -275,8 +265,11 @@ class DotaChatWheel(Clip):
 		if self.message == None:
 			raise ClipNotFound(self.type(), chatwheel_id)
 
-		filename = await httpgetter.get(dotabase.vpkurl + self.message.sound, "filename", cache=True)
-		return await Clip.init(self, chatwheel_id, filename, text=self.message.message, volume=0.4)
+		self.url = dotabase.vpkurl + self.message.sound
+		return await Clip.init(self, chatwheel_id, None, text=self.message.message, volume=0.4)
+
+	async def load_audio(self):
+		return await httpgetter.get(self.url, "filename", cache=True)
 
 	@classmethod
 	def type(cls):
@@ -8,11 +8,13 @@ from functools import lru_cache
 from enum import Enum
 
 
+import numpy as np
 import disnake
 from disnake.ext import commands
 from tinydb import Query
 from utils.tools.globals import botdata, httpgetter, logger, settings
 from utils.tools.helpers import *
+from utils.tools.playerindex import SIGNIFICANT_COLUMN, DEFAULT_COLUMNS
 
 
 @lru_cache(maxsize=None)
@@ -258,6 +260,7 @@ class SimpleQueryArg(QueryArg):
 class TimeSpanArg(QueryArg):
 	def __init__(self, inter, **kwargs):
 		kwargs["post_filter"] = PostFilter("start_time", self.post_filter_checker)
+		kwargs["check_filter"] = CheckFilter("start_time", self.check_filter_checker)
 		super().__init__("date", **kwargs)
 		self.dotabase = inter.bot.get_cog("Dotabase")
 		self.localized_value = None
@@ -328,6 +331,15 @@ class TimeSpanArg(QueryArg):
 				return False
 		return True
 
+	def check_filter_checker(self, columns, value):
+		start_times = columns["start_time"]
+		result = np.ones(len(start_times), dtype=bool)
+		if self.min:
+			result &= start_times >= self.min.timestamp()
+		if self.max:
+			result &= start_times <= self.max.timestamp()
+		return result
+
 	@property
 	def value(self):
 		if self.min is None:
@@ -353,6 +365,7 @@ all_item_slots = [ "item_0", "item_1", "item_2", "item_3", "item_4", "item_5", "
 class ItemArg(QueryArg):
 	def __init__(self, inter, name, **kwargs):
 		kwargs["post_filter"] = PostFilter(all_item_slots, self.post_filter_checker)
+		kwargs["check_filter"] = CheckFilter(all_item_slots, lambda c, v: np.any([ c[slot] == v for slot in all_item_slots ], axis=0))
 		kwargs["parse_levels"] = 2
 		super().__init__(name, **kwargs)
 		self.dotabase = inter.bot.get_cog("Dotabase")
@@ -433,8 +446,9 @@ class PostFilter():
 		self.key = key
 		self.func = func
 
-# a filter that can fully replace the query, for use on already-queried data
-# func is match, value (THIS ISNT FINSHED)
+# a filter that can fully replace the query, for use on already-queried data (like the player index)
+# keys are the columns it needs, and func is (columns, value), where columns is a dict of the needed columns as numpy
+# arrays (missing values are nan). func should return a numpy array of bools for which matches pass the filter
 class CheckFilter():
 	def __init__(self, keys, func):
 		if isinstance(keys, str):
@@ -442,6 +456,10 @@ class CheckFilter():
 		self.keys = keys
 		self.func = func
 
+	def check(self, history, value):
+		columns = { key: history.get_array(key) for key in self.keys }
+		return self.func(columns, value)
+
 
 class LocalizationContext(str, Enum):
 	PreMatch = 'prematch'
@@ -534,34 +552,37 @@ def create_matchfilter_args(inter: disnake.CmdInter):
 				ArgOption(1, "won", r"wins?|won|victory"),
 				ArgOption(0, "lost", r"loss|lose|lost|losses|defeat")
 			],
-			check_filter=CheckFilter(None, lambda m, v: (m.get('radiant_win') == (m.get('player_slot') < 128)) == (v == 1))
+			check_filter=CheckFilter([ "radiant_win", "player_slot" ], lambda c, v: ~np.isnan(c["radiant_win"]) & (((c["radiant_win"] == 1) == (c["player_slot"] < 128)) == (v == 1)))
 		),
 		QueryArg("is_radiant", [
 				ArgOption(1, f"on the {LOCALIZE_HIGHLIGHT_WRAPPER}radiant{LOCALIZE_HIGHLIGHT_WRAPPER} team", r"(as|on)? ?radiant"),
 				ArgOption(0, f"on the {LOCALIZE_HIGHLIGHT_WRAPPER}dire{LOCALIZE_HIGHLIGHT_WRAPPER} team", r"(as|on)? ?dire")
 			],
-			check_filter=CheckFilter(None, lambda m, v: (m.get('player_slot') < 128) == (v == 1)),
+			check_filter=CheckFilter("player_slot", lambda c, v: (c["player_slot"] < 128) == (v == 1)),
 			localization_context=LocalizationContext.PostMatch
 		),
 		QueryArg("lobby_type", [
 				ArgOption(7, "ranked", r"ranked"),
 				ArgOption(0, "non-ranked", r"(un|non)-?ranked")
 			],
+			check_filter=CheckFilter("lobby_type", lambda c, v: c["lobby_type"] == v),
 			localization_context=LocalizationContext.PreMatch
 		), 
 		QueryArg("significant", [
 				ArgOption(1, "all-pick", r"(significant|standard)"),
 				ArgOption(0, None, r"(not|non|in|un)(-| )?(significant|standard)")
 			],
-			check_filter=CheckFilter(None, lambda m, v: (v == 0) or (m.get('game_mode') in [1, 22])),
+			check_filter=CheckFilter(SIGNIFICANT_COLUMN, lambda c, v: (c[SIGNIFICANT_COLUMN] == 1) | (v == 0)),
 			localization_context=LocalizationContext.PreMatch
 		),
 		QueryArg("game_mode",
 			get_cache_game_mode_arg_options(),
+			check_filter=CheckFilter("game_mode", lambda c, v: c["game_mode"] == v),
 			localization_context=LocalizationContext.PreMatch
 		),
 		QueryArg("region",
 			get_cache_region_arg_options(),
+			check_filter=CheckFilter("region", lambda c, v: c["region"] == v),
 			localization_context=LocalizationContext.PreMatch
 		),
 		TimeSpanArg(inter,
@@ -573,18 +594,19 @@ def create_matchfilter_args(inter: disnake.CmdInter):
 		),
 		QueryArg("limit", [
 				ArgOption(lambda m: int(m.group(1)), "{value}", r"(?:limit|count|show)? ?(\d{1,3})")
-			],
-			check_filter=CheckFilter(None, lambda m, v: True)
+			]
 		),
 		QueryArg("party_size", [
 				ArgOption(1, "solo", r"solo"),
 			],
+			check_filter=CheckFilter("party_size", lambda c, v: c["party_size"] == v),
 			localization_context=LocalizationContext.PreMatch,
 			localization_index=-1
 		),
 		QueryArg("_inparty", [
 				ArgOption(True, "party", r"((in|with)? (a )?)?(party|group|friends|team)"),
 			], PostFilter("party_size", lambda p: (p.get("party_size", 0) or 0) > 1),
+			check_filter=CheckFilter("party_size", lambda c, v: c["party_size"] > 1),
 			localization_context=LocalizationContext.PreMatch,
 			localization_index=-1
 		),
@@ -594,16 +616,19 @@ def create_matchfilter_args(inter: disnake.CmdInter):
 				ArgOption(3, "offlane", r"(off|hard)( ?lane)?"),
 				ArgOption(4, "jungling", r"jungl(e|ing)"),
 			], PostFilter("is_roaming", lambda p: p.get("is_roaming") == False),
+			check_filter=CheckFilter([ "lane_role", "is_roaming" ], lambda c, v: (c["lane_role"] == v) & (c["is_roaming"] == 0)),
 			localization_context=LocalizationContext.PlayerLocation
 		),
 		QueryArg("_roaming", [
 				ArgOption(True, "roaming", r"roam(ing)?|gank(ing)?"),
 			], PostFilter("is_roaming", lambda p: p.get("is_roaming") == True),
+			check_filter=CheckFilter("is_roaming", lambda c, v: c["is_roaming"] == 1),
 			localization_context=LocalizationContext.PlayerLocation
 		),
 		QueryArg("_parsed", [
 				ArgOption(True, "parsed", r"(is)?( |_)?parsed"),
 			], PostFilter("version", lambda p: p.get("version") is not None),
+			check_filter=CheckFilter("version", lambda c, v: ~np.isnan(c["version"])),
 			localization_context=LocalizationContext.PreMatch,
 			localization_index=-2
 		),
@@ -619,7 +644,8 @@ def create_matchfilter_args(inter: disnake.CmdInter):
 		HeroArg(inter, "against_hero_id", "(?:against|vs) ",
 			localization_template="vs a {}",
 			localization_context=LocalizationContext.WhoWith),
-		HeroArg(inter, "hero_id", "(?:as )?"),
+		HeroArg(inter, "hero_id", "(?:as )?",
+			check_filter=CheckFilter("hero_id", lambda c, v: c["hero_id"] == v)),
 		PlayerArg(inter, "_player", "")
 	]
 
@@ -756,6 +782,49 @@ class MatchFilter():
 		args = self.to_query_args()
 		return f"/players/{self.player.steam_id}/matches?{args}"
 
+	# args that are handled by check_matches itself instead of by a CheckFilter
+	LOCAL_ARGS = [ "_player", "limit", "offset" ]
+
+	def get_check_columns(self):
+		"""Gets the columns needed to check this filter against a local match history, or None if it can't be checked locally"""
+		columns = []
+		for arg in self.args:
+			if not arg.has_value() or arg.name in MatchFilter.LOCAL_ARGS:
+				continue
+			if arg.check_filter is None:
+				return None
+			columns.extend(arg.check_filter.keys)
+		return list(dict.fromkeys(columns))
+
+	def get_result_columns(self):
+		"""Gets the columns that querying opendota with this filter would return"""
+		columns = list(self.projections)
+		for arg in self.args:
+			if arg.has_value() and arg.post_filter:
+				if isinstance(arg.post_filter.key, list):
+					columns.extend(arg.post_filter.key)
+				else:
+					columns.append(arg.post_filter.key)
+		if not columns:
+			columns = DEFAULT_COLUMNS
+		return list(dict.fromkeys(columns))
+
+	def check_matches(self, history):
+		"""Gets the indexes of the matches in a local match history (see PlayerIndex) that pass this filter, newest first.
+		Only works if get_check_columns isn't None, and the history has those columns"""
+		passed = np.ones(len(history), dtype=bool)
+		if not self.has_value("significant"): # opendota's default
+			passed &= history.get_array(SIGNIFICANT_COLUMN) == 1
+		for arg in self.args:
+			if arg.has_value() and arg.name not in MatchFilter.LOCAL_ARGS:
+				passed &= arg.check_filter.check(history, arg.value)
+		indexes = np.flatnonzero(passed)
+		if self.has_value("offset"):
+			indexes = indexes[self.get_arg("offset"):]
+		if self.has_value("limit"):
+			indexes = indexes[:self.get_arg("limit")]
+		return indexes
+
 
 class HeroStatArg(QueryArg):
 	def __init__(self, inter, name):
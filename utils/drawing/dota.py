@@ -3,17 +3,18 @@ import os
 import json
 from queue import Empty
 import subprocess
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 import typing
 import pytz
 
-from PIL import Image, ImageDraw, ImageFont
-from utils.tools.globals import httpgetter, logger, settings
-from utils.tools.helpers import (UserError, format_duration_simple, get_pretty_time, read_json, run_command)
+from PIL import Image, ImageDraw
+from utils.tools.globals import httpgetter, logger, settings, executors
+from utils.tools.helpers import (UserError, format_duration_simple, read_json)
 
 from .imagetools import *
+from .imagecache import image_cache, resize_cached
+from .mapgif import create_dota_gif_main
 from utils.other.metastats import get_hero_pickban_percent, get_hero_winrate
 from utils.drawing.table import (ColorCell, DoubleCell, ImageCell, SlantedTextCell, Table, TextCell, EmptyCell, CustomRenderCell, get_table_font)
 
@@ -110,7 +111,11 @@ def get_hero_name(hero_id):
 	return get_hero_info(hero_id)["name"]
 
 async def get_url_image(url):
-	return Image.open(await httpgetter.get(url, "bytes", cache_permanent=True))
+	image = image_cache.get(url)
+	if image is None:
+		with await httpgetter.get(url, "bytes", cache_permanent=True) as f:
+			image = image_cache.put(url, Image.open(f))
+	return image
 
 async def get_hero_image(hero_id):
 	try:
@@ -140,6 +145,10 @@ async def get_item_image(item_id):
 
 
 async def get_level_image(level):
+	cache_key = f"level_image:{level}"
+	image = image_cache.get(cache_key)
+	if image is not None:
+		return image
 	rowheight = 48
 
 	image = Image.new('RGBA', (rowheight - 4, rowheight), (0, 0, 0, 0))
@@ -163,7 +172,7 @@ async def get_level_image(level):
 	y_loc = (image.size[1] / 2) - (font_size[1] / 2)
 	draw.text((x_loc, y_loc + font_adjustment_y), level, font=font, fill=faded_yellow_color)
 
-	return image
+	return image_cache.put(cache_key, image)
 
 
 
@@ -193,9 +202,12 @@ async def get_talents_image(abilities, hero_id):
 				talent_slots.append(talent.slot)
 	talent_slots = sorted(talent_slots, reverse=True)
 	uri = f"talents_icon:{'_'.join(map(str, talent_slots))}"
+	image = image_cache.get(uri)
+	if image is not None and not settings.debug:
+		return image
 	filename = await httpgetter.cache.get_filename(uri)
 	if filename and not settings.debug:
-		return Image.open(filename)
+		return image_cache.put(uri, Image.open(filename))
 	filename = await httpgetter.cache.new(uri, "png")
 
 	image = Image.open(settings.resource("images/talents/talent_background.png"))
@@ -204,9 +216,13 @@ async def get_talents_image(abilities, hero_id):
 		image = paste_image(image, slot_image)
 
 	image.save(filename, format="PNG")
-	return image
+	return image_cache.put(uri, image)
 
 async def get_neutral_image(item):
+	cache_key = f"neutral_image:{item}"
+	image = image_cache.get(cache_key)
+	if image is not None:
+		return image
 	background = Image.new("RGBA", (64, 64))
 	size = background.size
 	circle_diameter = 48
@@ -238,9 +254,9 @@ async def get_neutral_image(item):
 		temp_image = Image.new("RGBA", (64, 64))
 		temp_image.paste(item_img, (0, 0), mask=mask_circle)
 		
-		return Image.alpha_composite(background, temp_image)
+		return image_cache.put(cache_key, Image.alpha_composite(background, temp_image))
 	else:
-		return background
+		return image_cache.put(cache_key, background)
 
 # gets an image for the matches table with the icons for what aghanim effects are active for the given player
 async def get_active_aghs_image(player):
@@ -376,7 +392,7 @@ async def get_hero_player_status_image(player):
 	if (player.get("leaver_status", 0) or 0) <= 1:
 		return image
 	disconnect_image = await get_url_image(vpkurl + "/panorama/images/hud/reborn/icon_disconnect_png.png")
-	disconnect_image = disconnect_image.resize((image.width, int((image.width / disconnect_image.width) * disconnect_image.height)), Image.LANCZOS)
+	disconnect_image = resize_cached(disconnect_image, (image.width, int((image.width / disconnect_image.width) * disconnect_image.height)))
 	image = paste_image(image, disconnect_image, 0, (image.height // 2) - (disconnect_image.height // 2))
 	return image
 
@@ -491,7 +507,7 @@ async def draw_match_table(match):
 	for player in match["players"]:
 		if not is_player_radiant(player):
 			await draw_match_table_row(table, match, player, is_parsed, is_ability_draft, has_talents)
-	return table.render()
+	return await executors.run_render(table.render)
 
 async def create_match_image(match):
 	table_border = 10
@@ -518,8 +534,10 @@ async def create_match_image(match):
 	return fp
 
 async def combine_image_halves(img_url1, img_url2):
-	img1 = Image.open(await httpgetter.get(img_url1, "bytes", cache=True)).convert("RGBA")
-	img2 = Image.open(await httpgetter.get(img_url2, "bytes", cache=True)).convert("RGBA")
+	with await httpgetter.get(img_url1, "bytes", cache=True) as f:
+		img1 = Image.open(f).convert("RGBA")
+	with await httpgetter.get(img_url2, "bytes", cache=True) as f:
+		img2 = Image.open(f).convert("RGBA")
 
 	pixels1 = img1.load()
 	pixels2 = img2.load()
@@ -537,42 +555,6 @@ async def combine_image_halves(img_url1, img_url2):
 
 	return fp
 
-def optimize_gif(uri, filename):
-	# if need further, try doing O3 only after colors instead of before
-	optimization = [
-		["--colors", "256"],
-		["-O3"],
-		["--colors", "128"],
-		["-O3"],
-	]
-	size_limit = 8
-
-	logger.info(f"optimizing: {uri}")
-	file_size = os.path.getsize(filename) / 1000000
-	logger.info(f"bytes: {file_size} MB")
-	i = 0
-
-	while file_size >= size_limit and i < len(optimization):
-		output = run_command(["gifsicle", "--conserve-memory", filename, "-o", filename] + optimization[i])
-		file_size = os.path.getsize(filename) / 1000000
-		logger.info(f"bytes: {file_size} MB")
-		i += 1
-
-	if file_size >= size_limit:
-		raise ValueError(f"couldn't optimize {uri} far enough")
-
-# places an icon on the map at the indicated x/y using the dota coordinant system
-# scale is how much to scale the icon
-def place_icon_on_map(map_image, icon, x, y):
-	map_padding_from_733_patch = 10
-	map_coord_padding = 64 - map_padding_from_733_patch
-	map_coord_size = 128 + (2 * map_padding_from_733_patch)
-
-	scale = map_image.width / map_coord_size
-	x = (x - map_coord_padding) * scale
-	y = (map_coord_size - (y - map_coord_padding)) * scale
-	return paste_image(map_image, icon, int(x - (icon.width / 2)), int(y - (icon.height / 2)))
-
 # wraps the main gif creation code so it doesnt block
 async def create_dota_gif(bot, match, stratz_match, start_time, end_time, ms_per_second=100):
 	uri = f"match_gif:{match['match_id']}:{start_time}:{end_time}:{ms_per_second}"
@@ -588,152 +570,7 @@ async def create_dota_gif(bot, match, stratz_match, start_time, end_time, ms_per
 		hero_id = player["heroId"]
 		hero_icons[str(hero_id)] = await get_hero_icon(hero_id)
 
-	return await bot.loop.run_in_executor(ThreadPoolExecutor(max_workers=1), create_dota_gif_main, match, stratz_match, start_time, end_time, ms_per_second, filename, uri, hero_icons)
-
-# the main code for creating the dota gif. this should be run in a separate thread because it blocks
-def create_dota_gif_main(match, stratz_match, start_time, end_time, ms_per_second, filename, uri, hero_icons):
-	building_data = read_json(settings.resource("json/building_data.json"))
-
-	map_image = Image.open(settings.resource("images/map/dota_map.png"))
-	map_image = map_image.resize((256, 256), Image.LANCZOS)
-
-	clock_bg_image = Image.open(settings.resource("images/map/clock_background.png"))
-	font = ImageFont.truetype(settings.resource("images/arial_unicode_bold.ttf"), 16)
-
-	reverse = end_time < start_time
-	if reverse:
-		temp = start_time
-		start_time = end_time
-		end_time = temp
-
-	match_start = -89
-	if start_time < match_start:
-		start_time = match_start
-	if end_time > match["duration"]:
-		end_time = match["duration"]
-
-	players = []
-	for player in stratz_match["players"]:
-		playbackData = player["playbackData"]
-		positionEvents = playbackData["playerUpdatePositionEvents"]
-		deathEvents = playbackData["deathEvents"]
-		scale = 0.75
-		icon = hero_icons[str(player["heroId"])]
-		icon = icon.resize((int(icon.width * scale), int(icon.height * scale)), Image.LANCZOS)
-		# icon = outline_image(icon, 2, (0, 255, 0) if player["isRadiant"] else (255, 0, 0))
-		x = 0
-		y = 0
-		data = {
-			"icon": icon
-		}
-		
-		for t in range(match_start, end_time + 1):
-			event = next((e for e in positionEvents if e["time"] == t), None)
-			if event:
-				x = event["x"]
-				y = event["y"]
-			if t >= start_time:
-				data[t] = { "x": x, "y": y }
-
-		death_timer = 0
-		for t in range(match_start, end_time + 1):
-			event = next((e for e in deathEvents if e["time"] == t), None)
-			if event:
-				death_timer = event["timeDead"]
-			if t >= start_time:
-				data[t]["dead"] = death_timer > 0
-			if death_timer > 0:
-				death_timer -= 1
-
-		players.append(data)
-
-	objectiveEvents = match["objectives"]
-	buildings = []
-	for b in building_data:
-		icon = Image.open(settings.resource(f"images/map/{b['icon']}"))
-		size = {
-			"tower": int(map_image.width * (16 / 300)),
-			"barracks": int(map_image.width * (12 / 300)),
-			"ancient": int(map_image.width * (25 / 300))
-		}[b["type"]]
-		icon = icon.resize((size, size), Image.LANCZOS)
-
-		building = {
-			"icon": icon,
-			"x": b["x"],
-			"y": b["y"]
-		}
-		event = next((e for e in objectiveEvents if e.get("key") == b["key"]), None)
-		if event:
-			building["death"] = event["time"]
-		buildings.append(building)
-
-	#sort from top right to bottom left for drawing
-	buildings = sorted(buildings, key=lambda b: b["x"] + b["y"], reverse=True)
-
-	# runes
-	runeEvents = stratz_match["playbackData"]["runeEvents"]
-	current_runes = {}
-	runes = {}
-	for t in range(match_start, end_time + 1):
-		events = filter(lambda e: e["time"] == t, runeEvents)
-		for e in filter(lambda e: e["time"] == t and e["action"] == 0, runeEvents):
-			current_runes[e["indexId"]] = {
-				"type": e["rune"],
-				"x": e["positionX"],
-				"y": e["positionY"]
-			}
-		if t >= start_time and current_runes:
-			runes[t] = current_runes.copy()
-		for e in filter(lambda e: e["time"] == t and e["action"] == 1, runeEvents):
-			if e["indexId"] in current_runes:
-				del current_runes[e["indexId"]]
-	# rune icons
-	rune_icons = {}
-	for i in range(0, 10):
-		scale = 0.5
-		icon = Image.open(settings.resource(f"images/map/rune_{i}.png"))
-		rune_icons[i] = icon.resize((int(icon.width * scale), int(icon.height * scale)), Image.LANCZOS)
-
-
-	process = subprocess.Popen(["gifsicle", "--multifile", "-d", str(ms_per_second // 10), "--conserve-memory", "-O3", "-", "-o", filename], stdin=subprocess.PIPE, bufsize=-1)
-
-	time_range = range(start_time, end_time + 1)
-
-	if reverse:
-		time_range = range(end_time, start_time - 1, -1)
-
-	for t in time_range:
-		image = map_image.copy()
-		for building in buildings:
-			if t < building.get("death", t + 1):
-				image = place_icon_on_map(image, building["icon"], building["x"], building["y"])
-		for player in players:
-			icon = player["icon"].convert("LA") if player[t]["dead"] else player["icon"]
-			image = place_icon_on_map(image, icon, player[t]["x"], player[t]["y"])
-		for rune in runes.get(t, {}):
-			rune = runes[t][rune]
-			if rune["type"] in rune_icons:
-				image = place_icon_on_map(image, rune_icons[rune["type"]], rune["x"], rune["y"])
-			else:
-				logger.error(f"Unknown rune_id {rune['type']} draw attempt at {t} seconds in match {stratz_match['id']}") # rune images grabbed from wiki. gotta update the range number that builds the list in this func too.
-				
-
-		image = paste_image(image, clock_bg_image, (image.width // 2) - (clock_bg_image.width // 2), 0)
-		draw = ImageDraw.Draw(image)
-		clock_text = get_pretty_time(abs(t))
-		clock_pos = ((image.width // 2) - (get_text_size(font, clock_text)[0] // 2), -1)		
-		draw.text(clock_pos, clock_text, font=font, fill="#ffffff")
-
-		image.save(process.stdin, "gif")
-		image.close()
-
-	process.stdin.close()
-	process.wait()
-
-	optimize_gif(uri, filename)
-
-	return filename
+	return await executors.run_process(create_dota_gif_main, match, stratz_match, start_time, end_time, ms_per_second, filename, uri, hero_icons)
 
 async def create_dota_emoticon(emoticon, url):
 	uri = f"dota_emoticon:{emoticon.name}"
@@ -745,8 +582,9 @@ async def create_dota_emoticon(emoticon, url):
 
 	filename = await httpgetter.cache.new(uri, filetype)
 
-	image = Image.open(await httpgetter.get(url, "bytes", cache=True))
-	image = remove_semi_transparent(image, (255, 255, 255, 0))
+	with await httpgetter.get(url, "bytes", cache=True) as f:
+		image = Image.open(f)
+		image = remove_semi_transparent(image, (255, 255, 255, 0))
 
 	if filetype == "png":
 		image.save(filename, "png")
@@ -865,7 +703,35 @@ async def draw_meta_table(sorted_heroes, heroes):
 			TextCell(f"{get_hero_pickban_percent(hero, heroes):.0%}", fontsize=24)
 		])
 
-	image = table.render()
+	image = await executors.run_render(table.render)
+	border_image = Image.new('RGBA', (image.size[0] + (border_size * 2), image.size[1] + border_size), color=discord_color1)
+	image = paste_image(border_image, image, border_size, 0)
+
+	fp = BytesIO()
+	image.save(fp, format="PNG")
+	fp.seek(0)
+
+	return fp
+
+# hero_counts is a list of (hero_id, total matches, matching matches)
+async def draw_percent_table(hero_counts):
+	border_size = 10
+	table = Table(background=discord_color2)
+	table.add_row([
+		TextCell("Hero", background=discord_color1, padding=6),
+		TextCell("", background=discord_color1, padding=6),
+		TextCell("Matches", background=discord_color1, padding=6),
+		TextCell("Percent", background=discord_color1, padding=6)
+	])
+	for hero_id, total, matching in hero_counts:
+		table.add_row([
+			ImageCell(img=await get_hero_image(hero_id), height=48),
+			TextCell(get_hero_name(hero_id), fontsize=24),
+			TextCell(f"{matching} / {total}", fontsize=24),
+			TextCell(f"{matching / total:.0%}", fontsize=24)
+		])
+
+	image = await executors.run_render(table.render)
 	border_image = Image.new('RGBA', (image.size[0] + (border_size * 2), image.size[1] + border_size), color=discord_color1)
 	image = paste_image(border_image, image, border_size, 0)
 
@@ -926,7 +792,7 @@ async def draw_matches_table(matches, game_strings):
 			),
 			get_datetime_cell(match, region_data)
 		])
-	image = table.render()
+	image = await executors.run_render(table.render)
 
 	border_image = Image.new('RGBA', (image.size[0] + (border_size * 2), image.size[1] + border_size), color=discord_color1)
 	image = paste_image(border_image, image, border_size, 0)
@@ -1015,7 +881,7 @@ async def draw_courage(hero_id, icon_ids):
 		ImageCell(img=await get_item_image(icon_ids[4])),
 		ImageCell(img=await get_item_image(icon_ids[5]))
 	])
-	image = table.render()
+	image = await executors.run_render(table.render)
 	image = paste_image(image, hero_image, 0, 0)
 
 	fp = BytesIO()
@@ -1084,7 +950,7 @@ async def draw_artifact_deck(deck_string, cards, hero_turns, card_counts):
 		card_color = card.color.blend(Color(discord_color2), 0.5)
 		for cell in table.rows[len(table.rows) - 1]:
 			cell.background = card_color.hex
-	image = table.render()
+	image = await executors.run_render(table.render)
 
 	border_image = Image.new('RGBA', (image.size[0] + (border_size * 2), image.size[1] + border_size), color=discord_color1)
 	image = paste_image(border_image, image, border_size, 0)
@@ -1106,7 +972,7 @@ async def draw_neutralitems_tier(selected_tier, all_neutral_items):
 			ImageCell(img=await get_item_image(item.id)),
 			TextCell(item.localized_name, font_size=30, padding=10)
 		])
-	image = table.render()
+	image = await executors.run_render(table.render)
 	
 	fp = BytesIO()
 	image.save(fp, format="PNG")
@@ -1135,67 +1001,7 @@ async def draw_neutralitems(selected_tier, all_neutral_items):
 		footer_row = [ColorCell(color=discord_color1, height=20) for i in range(items_per_row)]
 		table.add_row(footer_row)
 
-	image = table.render()
-
-	fp = BytesIO()
-	image.save(fp, format="PNG")
-	fp.seek(0)
-
-	return fp
-
-def get_poly_points(n, radius, origin=(0, 0), radius_percentages=None):
-	radii = [radius for i in range(n)]
-	if radius_percentages:
-		radii = [radius * radius_percentages[i] for i in range(n)]
-	rot_start = 0 - (math.pi / 2)
-	return [
-		(math.cos(rot_start + th) * radii[j] + origin[0], 
-		 math.sin(rot_start + th) * radii[j] + origin[1]) 
-		for j, th in enumerate([i * (2 * math.pi) / n for i in range(n)])
-	]
-
-def draw_poly_label(draw, point, center, text):
-	font = ImageFont.truetype(settings.resource("images/arial_unicode_bold.ttf"), 16)
-	font_size = get_text_size(font, text)
-	point = list(point)
-	if point[0] < center[0]:
-		point[0] -= font_size[0]
-	if point[1] < center[1]:
-		point[1] -= font_size[1]
-	if point[0] == center[0]:
-		point[0] -= font_size[0] / 2
-	if point[1] == center[1]:
-		point[1] -= font_size[1] / 2
-	draw.text(tuple(point), text, font=font, fill="#ffffff")
-
-def draw_polygraph(values, labels):
-	size = (500, 500)
-	polygon_radius = 175
-	point_count = len(values)
-
-	center = (size[0] / 2, size[1] / 2)
-
-	image = Image.new('RGBA', size)
-	draw = ImageDraw.Draw(image)
-	draw.rectangle([0, 0, image.size[0], image.size[1]], fill=discord_color2)
-
-	points = get_poly_points(point_count, polygon_radius, center)
-
-	draw.polygon(points, fill="#2C2F33", outline="#111111")
-	for point in points:
-		draw.line((center[0], center[1], point[0], point[1]), fill="#111111")
-
-	for i in range(len(points)):
-		draw_poly_label(draw, points[i], center, labels[i])
-
-	image2 = Image.new('RGBA', size)
-	draw2 = ImageDraw.Draw(image2)
-	data_points = get_poly_points(point_count, polygon_radius, center, values)
-	draw2.polygon(data_points, fill="#FFDF0044", outline="#FFDF00")
-	for p in data_points:
-		dot_rad = 2
-		draw2.ellipse([(p[0] - dot_rad, p[1] - dot_rad), (p[0] + dot_rad, p[1] + dot_rad)], fill="#FFDF00")
-	image = paste_image(image, image2, 0, 0)
+	image = await executors.run_render(table.render)
 
 	fp = BytesIO()
 	image.save(fp, format="PNG")
@@ -1272,7 +1078,7 @@ async def draw_herostatstable(hero_stat, level, hero_count, reverse, hero_stat_c
 		table.add_row(new_row)
 		i += 1
 
-	image = table.render()
+	image = await executors.run_render(table.render)
 
 	fp = BytesIO()
 	image.save(fp, format="PNG")
@@ -1405,7 +1211,7 @@ async def draw_heroabilities(abilities):
 		# facet_grants icon removed in 7.41 (facets removed from the game)
 
 		table.add_row(row)
-	image = table.render()
+	image = await executors.run_render(table.render)
 	
 	fp = BytesIO()
 	image.save(fp, format="PNG")
@@ -1461,7 +1267,7 @@ async def draw_match_ability_upgrades(match):
 	for player in match["players"]:
 		if not is_player_radiant(player):
 			await add_player_ability_upgrades_row(table, player)
-	table_image = table.render()
+	table_image = await executors.run_render(table.render)
 
 	table_border = 10
 
@@ -1520,7 +1326,7 @@ async def draw_item_slots(slot_item_counts: typing.List[typing.Tuple[int, int]])
 			image_row = image_row.resize(((item_size_smaller[0] * len(images) + (border_gap * 2)), item_size_smaller[1]), Image.LANCZOS)
 		
 		table.add_row([ImageCell(img=image_row)])
-	image = table.render()
+	image = await executors.run_render(table.render)
 	
 	fp = BytesIO()
 	image.save(fp, format="PNG")
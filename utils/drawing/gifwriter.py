@@ -0,0 +1,111 @@
+import struct
+import typing
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+#
+# writes animated gifs one frame at a time, without holding all of the frames in memory or shelling out to gifsicle.
+# every frame is quantized to the same fixed palette, and after the first frame only the pixels that changed
+# are written (everything else in the frame is transparent, so the previous frame shows through)
+#
+
+# the palette index used for "same as the previous frame". palettes made by create_palette leave this one free
+TRANSPARENT_INDEX = 255
+
+def create_palette(images: typing.List[Image.Image]) -> Image.Image:
+	"""Creates a palette (as a "P" image, like Image.quantize wants) from the colors used in the given images.
+	The images should include everything that'll show up in the gif, so that none of those colors get lost"""
+	width = max(image.width for image in images)
+	height = sum(image.height for image in images)
+	source = Image.new("RGB", (width, height))
+	y = 0
+	for image in images:
+		if image.mode in ("RGBA", "LA", "P"):
+			image = image.convert("RGBA")
+			source.paste(image, (0, y), image)
+		else:
+			source.paste(image.convert("RGB"), (0, y))
+		y += image.height
+	return source.quantize(colors=TRANSPARENT_INDEX, method=Image.MEDIANCUT)
+
+def _skip_sub_blocks(data, i):
+	"""Skips past a run of gif data sub-blocks starting at i, returning the index after the terminating empty block"""
+	while data[i] != 0:
+		i += data[i] + 1
+	return i + 1
+
+def _split_gif(data: bytes):
+	"""Splits a single-frame gif (as written by Image.save) into its header (signature, screen descriptor and global
+	palette) and its frame (any extensions, the image descriptor and image data), returning (header, frame, image_index)
+	where image_index is where the image descriptor starts in frame"""
+	if data[:3] != b"GIF" or data[-1:] != b";":
+		raise ValueError("Pillow wrote something that doesn't look like a gif")
+	flags = data[10]
+	header_end = 13
+	if flags & 0x80: # global color table
+		header_end += 3 * (2 ** ((flags & 0x07) + 1))
+	frame = data[header_end:-1]
+	i = 0
+	while frame[i] == 0x21: # extension blocks, like the graphic control extension with the duration in it
+		i = _skip_sub_blocks(frame, i + 2)
+	if frame[i] != 0x2C:
+		raise ValueError("Couldn't find the image descriptor in the gif Pillow wrote")
+	return data[:header_end], frame, i
+
+class GifWriter:
+	"""Writes frames of a gif to the given file, using the given palette (see create_palette).
+	Each frame is encoded with Pillow's normal gif saving, and then just its frame data gets written to the file"""
+	def __init__(self, fp, palette: Image.Image, duration):
+		self.fp = fp
+		self.palette = palette
+		# padded out to 256 colors, so every frame has the same palette (including the reserved transparent index)
+		palette_colors = palette.getpalette()[:768]
+		self.palette_colors = palette_colors + [ 0 ] * (768 - len(palette_colors))
+		self.duration = duration # ms per frame
+		self.previous = None
+
+	def add_frame(self, image: Image.Image):
+		frame = image.convert("RGB").quantize(palette=self.palette, dither=Image.NONE)
+		pixels = np.array(frame)
+		pixels[pixels == TRANSPARENT_INDEX] = 0 # shouldnt happen, but this index is reserved
+
+		if self.previous is None:
+			self._write_frame(pixels, (0, 0), transparent=False, with_header=True)
+		else:
+			changed = pixels != self.previous
+			rows = np.flatnonzero(changed.any(axis=1))
+			if len(rows) == 0: # nothing changed, so just write a single transparent pixel
+				self._write_frame(np.full((1, 1), TRANSPARENT_INDEX, dtype=np.uint8), (0, 0))
+			else:
+				columns = np.flatnonzero(changed.any(axis=0))
+				top, bottom = rows[0], rows[-1] + 1
+				left, right = columns[0], columns[-1] + 1
+				delta = pixels[top:bottom, left:right].copy()
+				delta[~changed[top:bottom, left:right]] = TRANSPARENT_INDEX
+				self._write_frame(delta, (int(left), int(top)))
+		self.previous = pixels
+
+	def _write_frame(self, pixels, offset, transparent=True, with_header=False):
+		params = {
+			"duration": self.duration,
+			"disposal": 1, # leave this frame in place, so the next frame only has to draw what changed
+			"optimize": False # keeps pillow from re-ordering the palette, which every frame has to share
+		}
+		if transparent:
+			params["transparency"] = TRANSPARENT_INDEX
+		frame = Image.fromarray(pixels)
+		frame.putpalette(self.palette_colors) # makes it a "P" image
+		buffer = BytesIO()
+		frame.save(buffer, "GIF", **params)
+		header, frame_data, image_index = _split_gif(buffer.getvalue())
+		if with_header:
+			self.fp.write(header)
+		# move the image to where it goes in the full frame
+		frame_data = bytearray(frame_data)
+		frame_data[image_index + 1:image_index + 5] = struct.pack("<HH", *offset)
+		self.fp.write(frame_data)
+
+	def close(self):
+		self.fp.write(b";") # gif trailer
@@ -2,7 +2,13 @@ import math
 from io import BytesIO
 
 from PIL import Image, ImageDraw, ImageFont
-from utils.drawing.table import get_table_font
+from utils.tools.settings import settings
+from utils.drawing.imagetools import paste_image
+from utils.drawing.table import get_table_font, get_text_size
+
+# these get drawn in the process pool, so this shouldn't import utils.tools.globals (see utils/drawing/mapgif.py)
+
+discord_color2 = "#23272A"
 
 
 # draws a graph with the given data points
@@ -134,3 +140,63 @@ def drawgraph(lines, colors, labels):
 # line1 = [ 0, 146, -396, -677, -445, -481, -902, -1097, -33, -474, -801, -618, -550, 232, 708, 24, -1432, -4056, -3298, -2203, -147, -1423, -878, 1507, -205, 266, -1010, -468, 2080, 3856, 4479, 6769, 7951, 4922, 2960, 1805, 428, -3176, -3490, -4133, -3928, -4375, -3240, -3209, -2595, -2691, -3331, -3169, -3188, -3230, -3957, -6612, -8014, -8905, -8757, -9330, -9020, -3335, -223 ]
 # line2 = [ 0, 339, -305, -344, -474, -200, -204, 50, 1678, 1051, 438, 448, 806, 2623, 3537, 2345, 1078, -2874, -749, 165, 3918, 2539, 3613, 6386, 667, 1282, -464, -214, 6377, 11922, 12350, 17866, 19061, 7225, 6839, 3033, -2857, -2154, -1797, -4180, -6234, -9626, -4107, -5728, -3195, -4408, -5550, -3300, -3734, -4152, -7747, -22968, -22652, -20976, -20758, -21390, -19123, -10725, -1136 ]
 # drawgraph([line1, line2], ["#FFFF00", "#ADD8E6"], ["Gold", "Experience"])
+
+def get_poly_points(n, radius, origin=(0, 0), radius_percentages=None):
+	radii = [radius for i in range(n)]
+	if radius_percentages:
+		radii = [radius * radius_percentages[i] for i in range(n)]
+	rot_start = 0 - (math.pi / 2)
+	return [
+		(math.cos(rot_start + th) * radii[j] + origin[0], 
+		 math.sin(rot_start + th) * radii[j] + origin[1]) 
+		for j, th in enumerate([i * (2 * math.pi) / n for i in range(n)])
+	]
+
+def draw_poly_label(draw, point, center, text):
+	font = ImageFont.truetype(settings.resource("images/arial_unicode_bold.ttf"), 16)
+	font_size = get_text_size(font, text)
+	point = list(point)
+	if point[0] < center[0]:
+		point[0] -= font_size[0]
+	if point[1] < center[1]:
+		point[1] -= font_size[1]
+	if point[0] == center[0]:
+		point[0] -= font_size[0] / 2
+	if point[1] == center[1]:
+		point[1] -= font_size[1] / 2
+	draw.text(tuple(point), text, font=font, fill="#ffffff")
+
+def draw_polygraph(values, labels):
+	size = (500, 500)
+	polygon_radius = 175
+	point_count = len(values)
+
+	center = (size[0] / 2, size[1] / 2)
+
+	image = Image.new('RGBA', size)
+	draw = ImageDraw.Draw(image)
+	draw.rectangle([0, 0, image.size[0], image.size[1]], fill=discord_color2)
+
+	points = get_poly_points(point_count, polygon_radius, center)
+
+	draw.polygon(points, fill="#2C2F33", outline="#111111")
+	for point in points:
+		draw.line((center[0], center[1], point[0], point[1]), fill="#111111")
+
+	for i in range(len(points)):
+		draw_poly_label(draw, points[i], center, labels[i])
+
+	image2 = Image.new('RGBA', size)
+	draw2 = ImageDraw.Draw(image2)
+	data_points = get_poly_points(point_count, polygon_radius, center, values)
+	draw2.polygon(data_points, fill="#FFDF0044", outline="#FFDF00")
+	for p in data_points:
+		dot_rad = 2
+		draw2.ellipse([(p[0] - dot_rad, p[1] - dot_rad), (p[0] + dot_rad, p[1] + dot_rad)], fill="#FFDF00")
+	image = paste_image(image, image2, 0, 0)
+
+	fp = BytesIO()
+	image.save(fp, format="PNG")
+	fp.seek(0)
+
+	return fp
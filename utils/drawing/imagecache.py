@@ -0,0 +1,85 @@
+import threading
+import typing
+from collections import OrderedDict
+
+from PIL import Image
+from utils.tools.settings import settings
+
+#
+# a process-wide cache of decoded images, so that the same hero/item/ability icons aren't re-read and
+# re-decoded for every render. images in here are shared, so anything that gets an image from this
+# cache should treat it as read-only (resize/convert/paste make copies, so those are fine)
+#
+
+def get_image_bytes(image: Image.Image):
+	return image.width * image.height * len(image.getbands())
+
+# gets the key an image was cached under, or None if it didn't come from the cache
+def get_cache_key(image: Image.Image):
+	return getattr(image, "mango_cache_key", None)
+
+class ImageCache:
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.images: typing.OrderedDict[typing.Any, Image.Image] = OrderedDict()
+		self.total_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock() # the gif code uses this from a worker thread
+
+	def get(self, key):
+		with self.lock:
+			image = self.images.get(key)
+			if image is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.images.move_to_end(key)
+			return image
+
+	# adds an image to the cache, and returns it
+	def put(self, key, image: Image.Image):
+		image.load() # make sure we're caching the decoded image, not a lazy file handle
+		image.mango_cache_key = key
+		size = get_image_bytes(image)
+		if size > self.max_bytes:
+			return image
+		with self.lock:
+			old_image = self.images.pop(key, None)
+			if old_image is not None:
+				self.total_bytes -= get_image_bytes(old_image)
+			self.images[key] = image
+			self.total_bytes += size
+			while self.total_bytes > self.max_bytes:
+				evicted_key, evicted_image = self.images.popitem(last=False)
+				self.total_bytes -= get_image_bytes(evicted_image)
+		return image
+
+	@property
+	def size(self):
+		return len(self.images)
+
+image_cache = ImageCache(settings.image_cache_budget)
+
+# resizes an image, caching the result if the original came from the image cache
+def resize_cached(image: Image.Image, size, resample=Image.LANCZOS):
+	size = tuple(size)
+	key = get_cache_key(image)
+	if key is None:
+		return image.resize(size, resample)
+	variant_key = ("resize", key, size, resample)
+	result = image_cache.get(variant_key)
+	if result is None:
+		result = image_cache.put(variant_key, image.resize(size, resample))
+	return result
+
+# converts an image to grayscale (keeping the alpha), caching the result if the original came from the image cache
+def grayscale_cached(image: Image.Image):
+	key = get_cache_key(image)
+	if key is None:
+		return image.convert("LA")
+	variant_key = ("grayscale", key)
+	result = image_cache.get(variant_key)
+	if result is None:
+		result = image_cache.put(variant_key, image.convert("LA"))
+	return result
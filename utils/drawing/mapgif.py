@@ -0,0 +1,223 @@
+import math
+import os
+
+from PIL import Image, ImageDraw, ImageFont
+from utils.tools.settings import settings
+from utils.tools.logger import logger
+from utils.tools.helpers import get_pretty_time, read_json, run_command
+
+from .imagetools import paste_image
+from .imagecache import resize_cached, grayscale_cached
+from .timeline import get_position_timeline, get_death_timeline, RuneTimeline
+from .gifwriter import GifWriter, create_palette
+
+#
+# draws the match gifs. create_dota_gif_main runs in the process pool, whose workers only import this module (and
+# utils/drawing/graph.py), so nothing in here should import utils.tools.globals or anything else that opens the bot's
+# databases or http sessions when its imported
+#
+
+def optimize_gif(uri, filename):
+	# if need further, try doing O3 only after colors instead of before
+	optimization = [
+		["--colors", "256"],
+		["-O3"],
+		["--colors", "128"],
+		["-O3"],
+	]
+	size_limit = 8
+
+	logger.info(f"optimizing: {uri}")
+	file_size = os.path.getsize(filename) / 1000000
+	logger.info(f"bytes: {file_size} MB")
+	i = 0
+
+	while file_size >= size_limit and i < len(optimization):
+		output = run_command(["gifsicle", "--conserve-memory", filename, "-o", filename] + optimization[i])
+		file_size = os.path.getsize(filename) / 1000000
+		logger.info(f"bytes: {file_size} MB")
+		i += 1
+
+	if file_size >= size_limit:
+		raise ValueError(f"couldn't optimize {uri} far enough")
+
+# draws text by pasting characters that are each only rendered once. much faster than drawing the text each time
+# when drawing lots of short bits of text that use the same few characters (like the clock on every frame of a gif)
+class GlyphCache:
+	def __init__(self, font, fill):
+		self.font = font
+		self.fill = fill
+		self.height = font.getbbox("0123456789:")[3] + 2
+		self.glyphs = {}
+
+	def get_glyph(self, char):
+		glyph = self.glyphs.get(char)
+		if glyph is None:
+			advance = self.font.getlength(char)
+			image = Image.new("RGBA", (math.ceil(advance) + 2, self.height), (0, 0, 0, 0))
+			ImageDraw.Draw(image).text((0, 0), char, font=self.font, fill=self.fill)
+			glyph = (image, advance)
+			self.glyphs[char] = glyph
+		return glyph
+
+	def get_width(self, text):
+		return int(sum(self.get_glyph(char)[1] for char in text))
+
+	def draw(self, image, text, x, y):
+		for char in text:
+			glyph, advance = self.get_glyph(char)
+			image.paste(glyph, (int(x), y), glyph)
+			x += advance
+
+# gets the pixel position of the top left of an icon centered on the indicated x/y using the dota coordinant system
+def get_map_icon_position(map_image, icon, x, y):
+	map_padding_from_733_patch = 10
+	map_coord_padding = 64 - map_padding_from_733_patch
+	map_coord_size = 128 + (2 * map_padding_from_733_patch)
+
+	scale = map_image.width / map_coord_size
+	x = (x - map_coord_padding) * scale
+	y = (map_coord_size - (y - map_coord_padding)) * scale
+	return int(x - (icon.width / 2)), int(y - (icon.height / 2))
+
+# places an icon on the map at the indicated x/y using the dota coordinant system
+def place_icon_on_map(map_image, icon, x, y):
+	return paste_image(map_image, icon, *get_map_icon_position(map_image, icon, x, y))
+
+# same as place_icon_on_map, but pastes the icon straight onto the (RGB) map image using its alpha as the mask,
+# instead of compositing a whole new image. used for drawing lots of frames
+def paste_icon_on_map(map_image, icon, x, y):
+	map_image.paste(icon, get_map_icon_position(map_image, icon, x, y), icon if icon.mode in ("RGBA", "LA") else None)
+
+# the main code for creating the dota gif. this gets run in the process pool because it blocks for a while
+def create_dota_gif_main(match, stratz_match, start_time, end_time, ms_per_second, filename, uri, hero_icons):
+	building_data = read_json(settings.resource("json/building_data.json"))
+
+	map_image = Image.open(settings.resource("images/map/dota_map.png"))
+	map_image = map_image.resize((256, 256), Image.LANCZOS)
+
+	clock_bg_image = Image.open(settings.resource("images/map/clock_background.png")).convert("RGBA")
+	font = ImageFont.truetype(settings.resource("images/arial_unicode_bold.ttf"), 16)
+
+	reverse = end_time < start_time
+	if reverse:
+		temp = start_time
+		start_time = end_time
+		end_time = temp
+
+	match_start = -89
+	if start_time < match_start:
+		start_time = match_start
+	if end_time > match["duration"]:
+		end_time = match["duration"]
+
+	players = []
+	for player in stratz_match["players"]:
+		playbackData = player["playbackData"]
+		positionEvents = playbackData["playerUpdatePositionEvents"]
+		deathEvents = playbackData["deathEvents"]
+		scale = 0.75
+		icon = hero_icons[str(player["heroId"])]
+		icon = resize_cached(icon, (int(icon.width * scale), int(icon.height * scale)))
+		# icon = outline_image(icon, 2, (0, 255, 0) if player["isRadiant"] else (255, 0, 0))
+		xs, ys = get_position_timeline(positionEvents, match_start, start_time, end_time)
+		players.append({
+			"icon": icon,
+			"dead_icon": grayscale_cached(icon),
+			"x": xs,
+			"y": ys,
+			"dead": get_death_timeline(deathEvents, match_start, start_time, end_time)
+		})
+
+	objectiveEvents = match["objectives"]
+	buildings = []
+	for b in building_data:
+		icon = Image.open(settings.resource(f"images/map/{b['icon']}"))
+		size = {
+			"tower": int(map_image.width * (16 / 300)),
+			"barracks": int(map_image.width * (12 / 300)),
+			"ancient": int(map_image.width * (25 / 300))
+		}[b["type"]]
+		icon = icon.resize((size, size), Image.LANCZOS).convert("RGBA")
+
+		building = {
+			"icon": icon,
+			"x": b["x"],
+			"y": b["y"]
+		}
+		event = next((e for e in objectiveEvents if e.get("key") == b["key"]), None)
+		if event:
+			building["death"] = event["time"]
+		buildings.append(building)
+
+	#sort from top right to bottom left for drawing
+	buildings = sorted(buildings, key=lambda b: b["x"] + b["y"], reverse=True)
+
+	# runes
+	runes = RuneTimeline(stratz_match["playbackData"]["runeEvents"], match_start, end_time)
+	# rune icons
+	rune_icons = {}
+	for i in range(0, 10):
+		scale = 0.5
+		icon = Image.open(settings.resource(f"images/map/rune_{i}.png"))
+		rune_icons[i] = icon.resize((int(icon.width * scale), int(icon.height * scale)), Image.LANCZOS).convert("RGBA")
+
+
+	# the map with the buildings that are still standing is the same for every frame until a building dies,
+	# so we only draw it once for each set of standing buildings
+	map_image = map_image.convert("RGB")
+	base_layers = {}
+	def get_base_layer(t):
+		standing = tuple(i for i, building in enumerate(buildings) if t < building.get("death", t + 1))
+		base_layer = base_layers.get(standing)
+		if base_layer is None:
+			base_layer = map_image.copy()
+			for i in standing:
+				paste_icon_on_map(base_layer, buildings[i]["icon"], buildings[i]["x"], buildings[i]["y"])
+			base_layers[standing] = base_layer
+		return base_layer
+
+	# one palette for the whole gif, made from everything that can show up in it
+	clock_image = map_image.copy()
+	clock_image.paste(clock_bg_image, ((clock_image.width // 2) - (clock_bg_image.width // 2), 0), clock_bg_image)
+	ImageDraw.Draw(clock_image).text((0, 0), "0123456789:", font=font, fill="#ffffff")
+	palette_images = [ get_base_layer(match_start), clock_image ]
+	palette_images.extend(building["icon"] for building in buildings)
+	for player in players:
+		palette_images.extend([ player["icon"], player["dead_icon"] ])
+	palette_images.extend(rune_icons.values())
+	palette = create_palette(palette_images)
+
+	time_range = range(start_time, end_time + 1)
+
+	if reverse:
+		time_range = range(end_time, start_time - 1, -1)
+
+	clock_glyphs = GlyphCache(font, "#ffffff")
+
+	with open(filename, "wb") as f:
+		gif = GifWriter(f, palette, ms_per_second)
+		for t in time_range:
+			image = get_base_layer(t).copy()
+			i = t - start_time
+			for player in players:
+				icon = player["dead_icon"] if player["dead"][i] else player["icon"]
+				paste_icon_on_map(image, icon, player["x"][i], player["y"][i])
+			for rune in runes.get(t):
+				if rune["type"] in rune_icons:
+					paste_icon_on_map(image, rune_icons[rune["type"]], rune["x"], rune["y"])
+				else:
+					logger.error(f"Unknown rune_id {rune['type']} draw attempt at {t} seconds in match {stratz_match['id']}") # rune images grabbed from wiki. gotta update the range number that builds the list in this func too.
+
+			image.paste(clock_bg_image, ((image.width // 2) - (clock_bg_image.width // 2), 0), clock_bg_image)
+			clock_text = get_pretty_time(abs(t))
+			clock_glyphs.draw(image, clock_text, (image.width // 2) - (clock_glyphs.get_width(clock_text) // 2), -1)
+
+			gif.add_frame(image)
+			image.close()
+		gif.close()
+
+	# only needed if the gif came out really big
+	optimize_gif(uri, filename)
+
+	return filename
@@ -0,0 +1,42 @@
+import os
+import json
+import uuid
+import hashlib
+
+from utils.tools.globals import httpgetter, settings
+
+#
+# caches the finished pngs of images that are rendered from a single match, so that looking up a popular match
+# again is just a file read instead of a whole new render. a finished match's json doesnt change, so the render
+# only depends on the renderer, whether the match is parsed, and any options the renderer was given
+#
+
+# bump a renderer's version whenever the way it draws changes, so the images rendered by the old version stop getting used
+# (they'll get evicted from the cache like anything else that isn't used anymore)
+RENDERER_VERSIONS = {
+	"match_image": 1,
+	"match_ability_upgrades": 1,
+	"match_graph": 1
+}
+
+def get_render_uri(renderer, match, options=None):
+	parsed = 1 if match.get("version") is not None else 0
+	key = json.dumps(options or {}, sort_keys=True)
+	key = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+	return f"match_render:{renderer}:v{RENDERER_VERSIONS[renderer]}:{match['match_id']}:{parsed}:{key}"
+
+async def get_match_render(renderer, match, render, options=None):
+	"""Gets the filename of the png for this match from the given renderer, calling render() to create it if it isn't cached yet.
+	render should be an async function that returns the png as a BytesIO"""
+	uri = get_render_uri(renderer, match, options)
+	filename = await httpgetter.cache.get_filename(uri)
+	if filename and not settings.debug:
+		return filename
+
+	fp = await render()
+	filename = await httpgetter.cache.new(uri, "png")
+	temp_filename = f"{filename}.{uuid.uuid4()}.part"
+	with open(temp_filename, "wb") as f:
+		f.write(fp.getvalue())
+	os.replace(temp_filename, filename)
+	return filename
@@ -1,8 +1,9 @@
 import math
 
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
-from utils.tools.globals import settings
+from utils.tools.settings import settings
 from utils.drawing.imagetools import *
+from utils.drawing.imagecache import resize_cached
 
 table_font = settings.resource("images/arial_unicode_bold.ttf")
 
@@ -271,7 +272,7 @@ class ImageCell(Cell):
 	def render(self, draw, image, x, y, width, height):
 		if not self.image:
 			return image, draw # no image, so this is basically an empty cell
-		actual_image = self.image.resize((self.width - (self.padding[1] + self.padding[3]), self.height - (self.padding[0] + self.padding[2])), Image.LANCZOS)
+		actual_image = resize_cached(self.image, (self.width - (self.padding[1] + self.padding[3]), self.height - (self.padding[0] + self.padding[2])))
 		image = paste_image(image, actual_image, x + self.padding[3], y + self.padding[0])
 		draw = ImageDraw.Draw(image)
 		return image, draw
@@ -0,0 +1,87 @@
+import numpy as np
+
+#
+# builds per-second timelines from stratz playback events for the match gif. events are sorted once and then
+# looked up with searchsorted, instead of scanning all of the events for every second of the match
+#
+
+# gets the times and the indexes of the events that happen between start and end (inclusive). if more than one
+# event happens at the same time, only the first one is kept
+def get_event_times(events, start, end):
+	times = np.fromiter((e["time"] for e in events), dtype=np.int64, count=len(events))
+	indexes = np.flatnonzero((times >= start) & (times <= end))
+	times = times[indexes]
+	order = np.argsort(times, kind="stable")
+	times = times[order]
+	indexes = indexes[order]
+	first = np.ones(len(times), dtype=bool)
+	first[1:] = times[1:] != times[:-1]
+	return times[first], indexes[first]
+
+# for each second in seconds, gets the index into times of the last event at or before that second (-1 if there isnt one)
+def get_last_event(times, seconds):
+	return np.searchsorted(times, seconds, side="right") - 1
+
+def get_position_timeline(position_events, match_start, start_time, end_time):
+	"""Gets arrays of a player's x and y position for every second from start_time to end_time.
+	Positions start at 0, 0 and hold until the next position event"""
+	times, indexes = get_event_times(position_events, match_start, end_time)
+	seconds = np.arange(start_time, end_time + 1)
+	last = get_last_event(times, seconds)
+	xs = np.array([ position_events[i]["x"] for i in indexes ] + [ 0 ])
+	ys = np.array([ position_events[i]["y"] for i in indexes ] + [ 0 ])
+	# a last index of -1 picks the 0 we put on the end
+	return xs[last], ys[last]
+
+def get_death_timeline(death_events, match_start, start_time, end_time):
+	"""Gets an array of whether a player is dead for every second from start_time to end_time"""
+	times, indexes = get_event_times(death_events, match_start, end_time)
+	seconds = np.arange(start_time, end_time + 1)
+	last = get_last_event(times, seconds)
+	time_dead = np.array([ death_events[i]["timeDead"] for i in indexes ], dtype=np.int64)
+	# each death resets the timer, which then counts down by one every second
+	dead = np.zeros(len(seconds), dtype=bool)
+	died = last >= 0
+	dead[died] = (time_dead[last[died]] - (seconds[died] - times[last[died]])) > 0
+	return dead
+
+def get_rune_intervals(rune_events, match_start, end_time):
+	"""Gets a list of the runes on the map, each with the first and last second it was there.
+	A rune appears when it spawns (action 0), and is gone the second after it gets picked up (action 1)"""
+	events = [ e for e in rune_events if match_start <= e["time"] <= end_time ]
+	# spawns are handled before pickups that happen on the same second
+	events.sort(key=lambda e: (e["time"], e["action"]))
+	current = {}
+	intervals = []
+	for e in events:
+		if e["action"] == 0:
+			previous = current.get(e["indexId"])
+			if previous is not None and previous["start"] < e["time"]:
+				previous["end"] = e["time"] - 1
+				intervals.append(previous)
+			current[e["indexId"]] = {
+				"type": e["rune"],
+				"x": e["positionX"],
+				"y": e["positionY"],
+				"start": e["time"]
+			}
+		elif e["action"] == 1:
+			rune = current.pop(e["indexId"], None)
+			if rune is not None:
+				rune["end"] = e["time"]
+				intervals.append(rune)
+	for rune in current.values():
+		rune["end"] = end_time
+		intervals.append(rune)
+	intervals.sort(key=lambda r: r["start"])
+	return intervals
+
+class RuneTimeline:
+	"""Looks up which runes are on the map at a given second"""
+	def __init__(self, rune_events, match_start, end_time):
+		self.runes = get_rune_intervals(rune_events, match_start, end_time)
+		self.starts = np.array([ r["start"] for r in self.runes ], dtype=np.int64)
+		self.ends = np.array([ r["end"] for r in self.runes ], dtype=np.int64)
+
+	def get(self, t):
+		return [ self.runes[i] for i in np.flatnonzero((self.starts <= t) & (self.ends >= t)) ]
@@ -11,6 +11,10 @@ from utils.tools.botdata import GuildInfo
 from utils.tools.globals import botdata, logger, settings
 from utils.tools.helpers import *
 from utils.tools.logger import init_logger
+from utils.tools.matchstore import match_store
+from utils.tools.playerindex import player_index
+from utils.tools.audiolength import audio_lengths
+from utils.tools.pcmcache import pcm_cache
 
 # Note: This code used to be in mangobyte.py so look there for more history
 
@@ -68,7 +72,12 @@ async def initialize(bot: commands.Bot, startupTimer: SimpleTimer):
 
 		# start periodic tasts
 		periodic_tasks = [
-			httpgetter.cache.cleanup_and_flush
+			httpgetter.cache.cleanup_and_flush,
+			httpgetter.report_stats,
+			match_store.cleanup,
+			player_index.cleanup,
+			audio_lengths.cleanup,
+			pcm_cache.report_stats
 		]
 		if not settings.debug:
 			periodic_tasks.append(audio_cog.voice_channel_culler)
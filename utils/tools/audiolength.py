@@ -0,0 +1,206 @@
+import sqlite3
+import struct
+import threading
+from disnake.ext import tasks
+
+from utils.tools.helpers import *
+from utils.tools.logger import logger
+from utils.tools.settings import settings
+from utils.tools.executors import executors
+
+#
+# the lengths of audio files, so checking how long an intro/outro is doesnt spawn an ffprobe each time.
+# lengths are read straight from the mp3/ogg/wav headers when possible (ffprobe is only used as a fallback),
+# and are kept in a little sqlite db next to the cache index, keyed by the file's path, mtime and size
+#
+
+# how many bytes from the end of an ogg file to look through for the last page
+OGG_TAIL_SIZE = 64 * 1024
+
+MP3_BITRATES = {
+	1: [ 0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320 ], # mpeg 1
+	2: [ 0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160 ] # mpeg 2 and 2.5
+}
+MP3_SAMPLE_RATES = {
+	1: [ 44100, 48000, 32000 ],
+	2: [ 22050, 24000, 16000 ],
+	2.5: [ 11025, 12000, 8000 ]
+}
+
+def _parse_mp3_header(data, i):
+	"""Parses the (layer 3) mp3 frame header at i, returning (frame_length, samples, sample_rate, is_mono), or None if it isn't one"""
+	if i + 4 > len(data) or data[i] != 0xFF or (data[i + 1] & 0xE0) != 0xE0:
+		return None
+	version = { 0: 2.5, 2: 2, 3: 1 }.get((data[i + 1] >> 3) & 0x03)
+	layer = (data[i + 1] >> 1) & 0x03
+	bitrate_index = data[i + 2] >> 4
+	sample_rate_index = (data[i + 2] >> 2) & 0x03
+	if version is None or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+		return None
+	bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+	sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+	padding = (data[i + 2] >> 1) & 0x01
+	is_mono = (data[i + 3] >> 6) == 3
+	if version == 1:
+		return (144 * bitrate // sample_rate) + padding, 1152, sample_rate, is_mono
+	return (72 * bitrate // sample_rate) + padding, 576, sample_rate, is_mono
+
+def _mp3_length(data):
+	i = 0
+	if data[:3] == b"ID3" and len(data) >= 10: # skip the id3v2 tag
+		size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+		i = 10 + size + (10 if data[5] & 0x10 else 0)
+	# find the first frame (some files have junk before it)
+	while i < len(data) - 4:
+		header = _parse_mp3_header(data, i)
+		if header and _parse_mp3_header(data, i + header[0]) or (header and i + header[0] == len(data)):
+			break
+		i += 1
+	else:
+		return None
+	frame_length, samples, sample_rate, is_mono = header
+
+	# vbr files usually have a xing/info (or vbri) header in the first frame that says how many frames there are
+	side_info = (17 if is_mono else 32) if samples == 1152 else (9 if is_mono else 17)
+	xing = i + 4 + side_info
+	if data[xing:xing + 4] in (b"Xing", b"Info"):
+		flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+		if flags & 0x01:
+			frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+			return frames * samples / sample_rate
+	vbri = i + 4 + 32
+	if data[vbri:vbri + 4] == b"VBRI":
+		frames = struct.unpack(">I", data[vbri + 14:vbri + 18])[0]
+		return frames * samples / sample_rate
+
+	# otherwise count the frames ourselves
+	total_samples = 0
+	while header:
+		total_samples += header[1]
+		i += header[0]
+		header = _parse_mp3_header(data, i)
+	return total_samples / sample_rate
+
+def _wav_length(data):
+	i = 12
+	byte_rate = None
+	while i + 8 <= len(data):
+		chunk_id = data[i:i + 4]
+		chunk_size = struct.unpack("<I", data[i + 4:i + 8])[0]
+		if chunk_id == b"fmt ":
+			byte_rate = struct.unpack("<I", data[i + 16:i + 20])[0]
+		elif chunk_id == b"data":
+			if not byte_rate:
+				return None
+			# files that were streamed out sometimes dont have the real size filled in
+			chunk_size = min(chunk_size, len(data) - (i + 8))
+			return chunk_size / byte_rate
+		i += 8 + chunk_size + (chunk_size % 2)
+	return None
+
+def _ogg_length(data):
+	# the first page's packet says what the codec is. the last page's granule position is how many samples there are
+	packet = 27 + data[26]
+	if data[packet:packet + 7] == b"\x01vorbis":
+		sample_rate = struct.unpack("<I", data[packet + 12:packet + 16])[0]
+		pre_skip = 0
+	elif data[packet:packet + 8] == b"OpusHead":
+		sample_rate = 48000 # opus granule positions are always at 48khz
+		pre_skip = struct.unpack("<H", data[packet + 10:packet + 12])[0]
+	else:
+		return None
+	last_page = data.rfind(b"OggS", max(0, len(data) - OGG_TAIL_SIZE))
+	if last_page == -1 or not sample_rate:
+		return None
+	granule = struct.unpack("<q", data[last_page + 6:last_page + 14])[0]
+	return max(0, granule - pre_skip) / sample_rate
+
+def read_audio_length(filename):
+	"""Reads the length (in seconds) of an mp3, ogg or wav file from its headers, without decoding it.
+	Returns None if the format isn't recognized. Goes by the file's contents instead of its extension, because
+	tts clips are saved as .wav even though gtts gives us mp3s"""
+	with open(filename, "rb") as f:
+		data = f.read()
+	if len(data) < 16:
+		return None
+	try:
+		if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+			return _wav_length(data)
+		if data[:4] == b"OggS":
+			return _ogg_length(data)
+		return _mp3_length(data)
+	except (struct.error, IndexError):
+		return None
+
+def ffprobe_audio_length(filename):
+	return float(run_command(["ffprobe", "-i", filename, "-show_entries", "format=duration", "-v", "quiet", "-of", "csv=p=0"]))
+
+def get_audio_length(filename):
+	"""Gets the length of an audio file, using ffprobe if we can't read it ourselves"""
+	length = read_audio_length(filename)
+	if length is None:
+		logger.info(f"couldn't read the audio length of {filename}, so using ffprobe")
+		length = ffprobe_audio_length(filename)
+	return length
+
+class AudioLengths:
+	"""The lengths of audio files, keyed by path, mtime and size so that a file that gets replaced is re-read"""
+	def __init__(self, path):
+		self.path = path
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		self.lock = threading.Lock()
+		self.lengths: typing.Dict[str, tuple] = {}
+		self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS audio_lengths (
+			path TEXT PRIMARY KEY,
+			mtime REAL NOT NULL,
+			size INTEGER NOT NULL,
+			length REAL NOT NULL)""")
+		with self.lock:
+			for path, mtime, size, length in self.conn.execute("SELECT path, mtime, size, length FROM audio_lengths"):
+				self.lengths[path] = (mtime, size, length)
+
+	def _lookup(self, filename):
+		stat = os.stat(filename)
+		key = (stat.st_mtime, stat.st_size)
+		entry = self.lengths.get(filename)
+		if entry and entry[:2] == key:
+			return key, entry[2]
+		return key, None
+
+	def _store(self, filename, key, length):
+		self.lengths[filename] = (*key, length)
+		with self.lock:
+			self.conn.execute("INSERT OR REPLACE INTO audio_lengths (path, mtime, size, length) VALUES (?, ?, ?, ?)", (filename, *key, length))
+
+	def get(self, filename):
+		"""Gets the length of an audio file in seconds. This only blocks if the file hasn't been seen before and
+		has to go to ffprobe, so from async code, use fill() first"""
+		key, length = self._lookup(filename)
+		if length is None:
+			length = get_audio_length(filename)
+			self._store(filename, key, length)
+		return length
+
+	async def fill(self, filename):
+		"""Makes sure we know the length of an audio file (reading it if we dont), and returns it. The file gets read off of the event loop"""
+		key, length = self._lookup(filename)
+		if length is None:
+			length = await executors.run_thread(get_audio_length, filename)
+			self._store(filename, key, length)
+		return length
+
+	@tasks.loop(hours=24)
+	async def cleanup(self):
+		removed = [ path for path in list(self.lengths) if not os.path.exists(path) ]
+		for path in removed:
+			self.lengths.pop(path, None)
+		with self.lock:
+			self.conn.executemany("DELETE FROM audio_lengths WHERE path = ?", ((path,) for path in removed))
+		logger.event("audio_lengths_cleanup", {
+			"removed": len(removed),
+			"count": len(self.lengths)
+		})
+
+audio_lengths = AudioLengths(settings.resource("cache/_audio_lengths.db"))
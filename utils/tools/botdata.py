@@ -1,10 +1,13 @@
+import atexit
 import os
 from collections import OrderedDict
 
 import disnake
 import utils.command.botdatatypes as types
+from utils.tools.botdatastore import LIST_KEYS, JsonBotDataStore, SqliteBotDataStore
 from utils.tools.helpers import *
 from utils.tools.logger import logger
+from utils.tools.settings import settings
 
 
 class ListVar:
@@ -17,24 +20,30 @@ class BotDataItem:
 			"_botdata": botdata,
 			"_list_key": list_key,
 			"_primary_keys": primary_keys,
+			"_primary_key": next(iter(primary_keys.values())),
 			"defaults": defaults
 		})
 
 	@property
 	def json_data(self):
-		for item in self._botdata.json_data[self._list_key]:
-			if all(item.get(key) == self._primary_keys[key] for key in self._primary_keys):
-				return item
-		return None
+		return self._botdata.store.get_row(self._list_key, self._primary_key)
 
 	def __getattr__(self, key):
 		if key in self._primary_keys:
 			return self._primary_keys[key]
 		if key not in self.defaults:
 			raise ValueError(f"Tried to get invalid '{key}' in {self._list_key}")
-		if self.json_data:
-			return self.json_data.get(key, self.defaults.get(key))
-		return self.defaults.get(key)
+		json_data = self.json_data
+		if json_data and key in json_data:
+			return json_data[key]
+		return self.get_default(key)
+
+	# the defaults are shared by every item of this type, so give out copies of the mutable ones
+	def get_default(self, key):
+		value = self.defaults.get(key)
+		if isinstance(value, list):
+			return list(value)
+		return value
 
 	def __setattr__(self, key, val):
 		if key in self._primary_keys:
@@ -43,20 +52,16 @@ class BotDataItem:
 			raise ValueError(f"Tried to set invalid '{key}' in {self._list_key}")
 
 		# recreate to order correctly
+		json_data = self.json_data
 		newdict = OrderedDict(self._primary_keys)
 		for k in self.defaults:
 			if k == key:
 				if val != self.defaults[key]:
 					newdict[k] = val
-			elif self.json_data and k in self.json_data:
-				newdict[k] = self.json_data[k]
-		# now save to json
-		if self.json_data:
-			index = self._botdata.json_data[self._list_key].index(self.json_data)
-			self._botdata.json_data[self._list_key][index] = newdict
-		else:
-			self._botdata.json_data[self._list_key].append(newdict)
-		self._botdata.save_data()
+			elif json_data and k in json_data:
+				newdict[k] = json_data[k]
+		# now save just this row
+		self._botdata.store.set_row(self._list_key, self._primary_key, newdict)
 
 	__getitem__ = __getattr__
 	__setitem__ = __setattr__
@@ -145,11 +150,9 @@ userinfo_variables = [
 
 class UserInfo(BotDataItem):
 	variables = userinfo_variables
+	variable_defaults = OrderedDict((var["key"], var["default"]) for var in userinfo_variables)
 	def __init__(self, botdata, discord):
-		defaults = OrderedDict([])
-		for var in self.variables:
-			defaults[var["key"]] = var["default"]
-		BotDataItem.__init__(self, botdata, "userinfo", { "discord": discord }, defaults)
+		BotDataItem.__init__(self, botdata, "userinfo", { "discord": discord }, UserInfo.variable_defaults)
 
 	@staticmethod
 	def keys_list():
@@ -296,16 +299,14 @@ guildinfo_variables = [
 
 class GuildInfo(BotDataItem):
 	variables = guildinfo_variables
+	variable_defaults = OrderedDict([
+		("voicechannel", None),
+		("invalidcommands", False),
+		("banned_users", []),
+		("disabled_commands", [])
+	] + [(var["key"], var["default"]) for var in guildinfo_variables])
 	def __init__(self, botdata, guildid):
-		defaults = OrderedDict([
-			("voicechannel", None),
-			("invalidcommands", False),
-			("banned_users", []),
-			("disabled_commands", [])
-		])
-		for var in self.variables:
-			defaults[var["key"]] = var["default"]
-		BotDataItem.__init__(self, botdata, "guildinfo", { "id": guildid }, defaults)
+		BotDataItem.__init__(self, botdata, "guildinfo", { "id": guildid }, GuildInfo.variable_defaults)
 	
 
 	@staticmethod
@@ -336,45 +337,71 @@ class GuildInfo(BotDataItem):
 
 
 
+# how many UserInfo/GuildInfo objects to keep around in the item cache
+ITEM_CACHE_SIZE = 4096
+
 class BotData:
 	def __init__(self):
 		self.path = "botdata.json"
+		self.db_path = "botdata.db"
 		self.defaults = OrderedDict([
 			("userinfo" , []),
 			("guildinfo" , []),
 			("dotapatch", None),
 			("dotablog",None)
 		])
-		if not os.path.exists(self.path):
-			self.json_data = self.defaults
-			self.save_data()
+		self.item_cache = OrderedDict() # (item class, primary key) -> UserInfo/GuildInfo, so we're not re-creating these all the time
+		if settings.botdata_backend == "json":
+			self.store = JsonBotDataStore(self.path, self.defaults, write_delay=settings.botdata_write_delay)
 		else:
-			self.json_data = read_json(self.path)
-			if self.json_data.keys() != self.defaults.keys():
-				for key in self.defaults.keys():
-					if key not in self.json_data.keys():
-						self.json_data[key] = self.defaults[key]
-						logger.info("Adding " + str(key) + " field to botdata.json")
-				self.save_data()
+			needs_import = os.path.exists(self.path) and not os.path.exists(self.db_path)
+			self.store = SqliteBotDataStore(self.db_path, write_delay=settings.botdata_write_delay)
+			if needs_import:
+				timer = SimpleTimer()
+				counts = self.store.import_json(self.path)
+				logger.info(f"Imported {counts['userinfo']} users and {counts['guildinfo']} guilds from {self.path} into {self.db_path} in {timer.miliseconds}ms")
+		atexit.register(self.flush) # in case we exit without getting a chance to call flush_async
 
 	def __getitem__(self, key):
 		if key not in self.defaults:
 			return self.__dict__[key]
-		return self.json_data.get(key, self.defaults.get(key))
+		if key in LIST_KEYS:
+			return self.store.rows(key)
+		return self.store.get_value(key, self.defaults.get(key))
 
 	def __setitem__(self, key, val):
 		if key not in self.defaults:
 			self.__dict__[key] = val
-		self.json_data[key] = val
-		self.save_data()
-
-	def save_data(self):
-		write_json(self.path, self.json_data)
+			return
+		if key in LIST_KEYS:
+			raise ValueError(f"Can't overwrite the whole '{key}' list")
+		self.store.set_value(key, val)
+
+	# writes any changes that are still waiting to be written
+	def flush(self):
+		self.store.flush()
+
+	# same as flush, but does the writing in the store's worker thread. should be called before shutting down
+	async def flush_async(self):
+		await self.store.flush_async()
+
+	# gets an item from the item cache, creating it if it doesnt exist
+	def _get_item(self, item_class, primary_key):
+		cache_key = (item_class, primary_key)
+		item = self.item_cache.get(cache_key)
+		if item is None:
+			item = item_class(self, primary_key)
+			self.item_cache[cache_key] = item
+			if len(self.item_cache) > ITEM_CACHE_SIZE:
+				self.item_cache.popitem(last=False)
+		else:
+			self.item_cache.move_to_end(cache_key)
+		return item
 
 	def userinfo(self, userid) -> UserInfo:
 		if isinstance(userid, disnake.User) or isinstance(userid, disnake.Member):
 			userid = userid.id
-		return UserInfo(self, userid)
+		return self._get_item(UserInfo, userid)
 
 	def guildinfo(self, guildid) -> GuildInfo:
 		if isinstance(guildid, disnake.Interaction):
@@ -387,23 +414,23 @@ class BotData:
 			guildid = guildid.id
 		if guildid is None:
 			return None
-		return GuildInfo(self, guildid)
+		return self._get_item(GuildInfo, guildid)
 
 	def guildinfo_list(self):
 		guildinfos = []
-		for data in self.json_data['guildinfo']:
+		for data in self.store.rows("guildinfo"):
 			guildinfos.append(GuildInfo(self, data['id']))
 		return guildinfos
 
 	def userinfo_list(self):
 		userinfos = []
-		for data in self.json_data['userinfo']:
+		for data in self.store.rows("userinfo"):
 			userinfos.append(UserInfo(self, data['discord']))
 		return userinfos
 
 	def count_users_with_key(self, key):
 		count = 0
-		for data in self.json_data['userinfo']:
+		for data in self.store.rows("userinfo"):
 			if key in data and data[key]:
 				count += 1
 		return count
@@ -0,0 +1,268 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.tools.helpers import *
+from utils.tools.logger import logger
+
+#
+# storage backends for botdata. a store holds the rows of each list (userinfo/guildinfo), keyed by
+# that list's primary key, as well as the handful of top-level values like dotapatch and dotablog
+#
+
+# the lists stored in botdata, and the primary key for each one
+LIST_KEYS = OrderedDict([
+	("userinfo", "discord"),
+	("guildinfo", "id")
+])
+
+class BotDataStore:
+	"""The interface BotData uses to read and persist its data
+
+	Every store keeps an index of primary key -> row for each list, so looking up a user or guild is a dict hit.
+
+	Changes are write-behind: they update the in-memory data right away, and then get written to disk in a
+	worker thread after write_delay seconds, so a burst of changes turns into a single write."""
+	indexes: typing.Dict[str, typing.Dict[int, OrderedDict]]
+
+	def __init__(self, write_delay):
+		self.write_delay = write_delay
+		self.write_lock = threading.Lock()
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="botdata")
+		self.pending_changes = 0
+		self.flush_handle = None
+		self.flush_task = None
+
+	def _build_indexes(self, lists):
+		self.indexes = {}
+		for list_key, key_name in LIST_KEYS.items():
+			index = OrderedDict()
+			for row in lists.get(list_key, []):
+				primary_key = row.get(key_name)
+				if primary_key is not None and primary_key not in index:
+					index[primary_key] = row
+			self.indexes[list_key] = index
+
+	def get_row(self, list_key, primary_key):
+		"""Returns the row with the given primary key, or None if there isnt one"""
+		return self.indexes[list_key].get(primary_key)
+
+	def set_row(self, list_key, primary_key, row):
+		"""Inserts or replaces the row with the given primary key. Rows should be treated as immutable once set"""
+		self.indexes[list_key][primary_key] = row
+		self._mark_dirty(list_key, primary_key)
+
+	def rows(self, list_key):
+		"""Returns a list of all of the rows in the given list"""
+		return list(self.indexes[list_key].values())
+
+	def get_value(self, key, default=None):
+		raise NotImplementedError()
+
+	def set_value(self, key, value):
+		raise NotImplementedError()
+
+	def _snapshot(self):
+		"""Grabs everything that needs writing. Called on the event loop, so that the data can't change while it's being written"""
+		raise NotImplementedError()
+
+	def _write(self, snapshot):
+		"""Writes a snapshot to disk. Called from the worker thread"""
+		raise NotImplementedError()
+
+	def _requeue(self, snapshot):
+		"""Called when writing a snapshot failed, so that its changes get written next time"""
+		pass
+
+	def _mark_dirty(self, list_key=None, primary_key=None):
+		self.pending_changes += 1
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError: # no event loop running (startup, dev scripts), so just write now
+			self.flush()
+			return
+		if self.flush_handle is None and self.flush_task is None:
+			self.flush_handle = loop.call_later(self.write_delay, self._start_flush)
+
+	def _start_flush(self):
+		self.flush_handle = None
+		self.flush_task = asyncio.create_task(self._flush_async())
+
+	async def _flush_async(self):
+		changes = self.pending_changes
+		self.pending_changes = 0
+		snapshot = self._snapshot()
+		try:
+			timer = SimpleTimer()
+			await asyncio.get_running_loop().run_in_executor(self.executor, self._write_locked, snapshot)
+			logger.event("botdata_flush", {
+				"changes": changes,
+				"coalesced": changes - 1,
+				"time": timer.miliseconds
+			})
+		except Exception as e:
+			logger.error(f"Failed to write botdata: {e}")
+			self.pending_changes += changes
+			self._requeue(snapshot)
+		finally:
+			self.flush_task = None
+			if self.pending_changes > 0 and self.flush_handle is None:
+				self.flush_handle = asyncio.get_running_loop().call_later(self.write_delay, self._start_flush)
+
+	def _write_locked(self, snapshot):
+		with self.write_lock:
+			self._write(snapshot)
+
+	def flush(self):
+		"""Synchronously writes any pending changes"""
+		if self.flush_handle is not None:
+			self.flush_handle.cancel()
+			self.flush_handle = None
+		if self.pending_changes == 0:
+			return
+		self.pending_changes = 0
+		self._write_locked(self._snapshot())
+
+	async def flush_async(self):
+		"""Writes any pending changes, waiting on any write that's already in progress. Used when shutting down"""
+		if self.flush_task is not None:
+			await self.flush_task
+		if self.flush_handle is not None:
+			self.flush_handle.cancel()
+			self.flush_handle = None
+		if self.pending_changes > 0:
+			await self._flush_async()
+
+	def close(self):
+		self.flush()
+		self.executor.shutdown()
+
+
+class JsonBotDataStore(BotDataStore):
+	"""The original botdata.json store. Every write rewrites the whole file"""
+	def __init__(self, path, defaults, write_delay=0):
+		super().__init__(write_delay)
+		self.path = path
+		needs_save = False
+		if not os.path.exists(self.path):
+			self.json_data = OrderedDict(defaults)
+			needs_save = True
+		else:
+			self.json_data = read_json(self.path)
+			for key in defaults.keys():
+				if key not in self.json_data.keys():
+					self.json_data[key] = defaults[key]
+					logger.info("Adding " + str(key) + " field to botdata.json")
+					needs_save = True
+		self._build_indexes(self.json_data)
+		if needs_save:
+			self._write(self._snapshot())
+
+	def get_value(self, key, default=None):
+		return self.json_data.get(key, default)
+
+	def set_value(self, key, value):
+		self.json_data[key] = value
+		self._mark_dirty()
+
+	def _snapshot(self):
+		snapshot = OrderedDict(self.json_data)
+		for list_key in LIST_KEYS:
+			snapshot[list_key] = list(self.indexes[list_key].values())
+		return snapshot
+
+	def _write(self, snapshot):
+		# write to a temp file and then swap it in, so we never end up with half a botdata.json
+		temp_path = self.path + ".tmp"
+		with open(temp_path, "w+") as f:
+			f.write(json.dumps(snapshot, indent="\t"))
+		os.replace(temp_path, self.path)
+
+
+class SqliteBotDataStore(BotDataStore):
+	"""Stores botdata in an sqlite database (in WAL mode), with one row per user/guild, so a write only touches the rows that changed"""
+	def __init__(self, path, write_delay=0):
+		super().__init__(write_delay)
+		self.path = path
+		self.dirty_rows = {} # (list_key, primary_key) -> row
+		self.dirty_values = set()
+		self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		for list_key, key_name in LIST_KEYS.items():
+			self.conn.execute(f"CREATE TABLE IF NOT EXISTS {list_key} ({key_name} INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS botdata_values (key TEXT PRIMARY KEY, value TEXT)")
+		self._load()
+
+	def _load(self):
+		lists = {}
+		for list_key, key_name in LIST_KEYS.items():
+			cursor = self.conn.execute(f"SELECT data FROM {list_key} ORDER BY {key_name}")
+			lists[list_key] = [self._loads(data) for (data,) in cursor]
+		self._build_indexes(lists)
+		self.values = { key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM botdata_values") }
+
+	@staticmethod
+	def _loads(text):
+		return json.loads(text, object_pairs_hook=OrderedDict)
+
+	def _mark_dirty(self, list_key=None, primary_key=None):
+		if list_key is not None:
+			self.dirty_rows[(list_key, primary_key)] = self.indexes[list_key][primary_key]
+		super()._mark_dirty(list_key, primary_key)
+
+	def get_value(self, key, default=None):
+		return self.values.get(key, default)
+
+	def set_value(self, key, value):
+		self.values[key] = value
+		self.dirty_values.add(key)
+		self._mark_dirty()
+
+	def _snapshot(self):
+		rows = self.dirty_rows
+		values = { key: self.values[key] for key in self.dirty_values }
+		self.dirty_rows = {}
+		self.dirty_values = set()
+		return (rows, values)
+
+	def _requeue(self, snapshot):
+		rows, values = snapshot
+		for key, row in rows.items():
+			self.dirty_rows.setdefault(key, row)
+		self.dirty_values.update(values.keys())
+
+	def _write(self, snapshot):
+		rows, values = snapshot
+		with self.conn:
+			self.conn.execute("BEGIN")
+			for (list_key, primary_key), row in rows.items():
+				key_name = LIST_KEYS[list_key]
+				self.conn.execute(
+					f"INSERT INTO {list_key} ({key_name}, data) VALUES (?, ?) ON CONFLICT({key_name}) DO UPDATE SET data = excluded.data",
+					(primary_key, json.dumps(row)))
+			self.conn.executemany(
+				"INSERT INTO botdata_values (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+				((key, json.dumps(value)) for key, value in values.items()))
+
+	def import_json(self, json_path):
+		"""Imports everything from an existing botdata.json file in a single transaction"""
+		json_data = read_json(json_path)
+		with self.write_lock, self.conn:
+			self.conn.execute("BEGIN")
+			for list_key, key_name in LIST_KEYS.items():
+				self.conn.executemany(
+					f"INSERT OR REPLACE INTO {list_key} ({key_name}, data) VALUES (?, ?)",
+					((row[key_name], json.dumps(row)) for row in json_data.get(list_key, []) if row.get(key_name) is not None))
+			self.conn.executemany(
+				"INSERT OR REPLACE INTO botdata_values (key, value) VALUES (?, ?)",
+				((key, json.dumps(value)) for key, value in json_data.items() if key not in LIST_KEYS))
+		self._load()
+		return { list_key: len(json_data.get(list_key, [])) for list_key in LIST_KEYS }
+
+	def close(self):
+		super().close()
+		self.conn.close()
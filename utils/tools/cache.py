@@ -1,18 +1,49 @@
 import re
 import datetime
+import sqlite3
 import uuid
-from io import BytesIO
+import codecs
 from disnake.ext import tasks
 import orjson
 
 from utils.tools.helpers import *
 from utils.tools.logger import logger
 from utils.tools.settings import settings
+from utils.tools.executors import executors
 
 
 # currently set to 1 week timeout for cache files
 CACHE_FILE_TIMEOUT_MS = 1000 * 60 * 60 * 24 * 7
 
+# how many expired items to remove at a time during cleanup, before giving the lock back
+CLEANUP_BATCH_SIZE = 500
+
+# how much of a download to read into memory at a time while streaming it into the cache
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# the encoding aiohttp would use for response.text(). the body is streamed rather than read all at once, so if the
+# response doesnt say what it is, this falls back to utf-8 like aiohttp does by default
+def get_response_encoding(response):
+	try:
+		return response.get_encoding()
+	except RuntimeError: # aiohttp only guesses the fallback encoding from a body its already read
+		return "utf-8"
+
+# the classes of files in the cache, which can each be given their own byte budget in settings.json
+CACHE_CLASSES = [ "tts", "match", "image", "gif", "other" ]
+GENERATED_IMAGE_PREFIXES = [ "talents_icon:", "dota_emoticon:", "dota_rank:", "artifact_deck:", "dota_recipe:", "match_render:" ]
+
+def get_cache_class(uri: str):
+	if uri.startswith("clip_tts_"):
+		return "tts"
+	if uri.startswith("match_gif:"):
+		return "gif"
+	if re.search(r"/match(es)?/\d+(\?|$)", uri):
+		return "match"
+	if re.search(r"\.(png|jpe?g|gif|webp)$", uri.lower()) or any(uri.startswith(prefix) for prefix in GENERATED_IMAGE_PREFIXES):
+		return "image"
+	return "other"
+
 def get_timestamp(date=None):
 	if date is None:
 		date = datetime.datetime.now()
@@ -62,48 +93,197 @@ class Cache:
 		if not os.path.exists(self.cache_dir):
 			os.makedirs(self.cache_dir)
 		self.cache_data = {}
-		self.cache_index_filename = self.cache_dir + "_cache_index.json"
-		if os.path.exists(self.cache_index_filename):
-			with open(self.cache_index_filename, "rb") as f:
-				json_dict = orjson.loads(f.read())
-				for uri, item in json_dict.items():
-					self.cache_data[uri] = CacheItem(item)
-	
-	def _save_to_disk(self):
-		with open(self.cache_index_filename, "wb+") as f:
-			f.write(orjson.dumps(self.cache_data))
-	
+		self.touched_uris = set() # uris whose timestamps have been updated since the last flush
+		self.cache_index_filename = self.cache_dir + "_cache_index.db"
+		old_index_filename = self.cache_dir + "_cache_index.json"
+		needs_migration = os.path.exists(old_index_filename) and not os.path.exists(self.cache_index_filename)
+
+		self.conn = sqlite3.connect(self.cache_index_filename, isolation_level=None)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS cache_items (uri TEXT PRIMARY KEY, filename TEXT NOT NULL, timestamp INTEGER NOT NULL, permanent INTEGER NOT NULL, size INTEGER, cache_class TEXT)")
+		columns = [row[1] for row in self.conn.execute("PRAGMA table_info(cache_items)")]
+		if "size" not in columns: # indexes created before size tracking was added
+			self.conn.execute("ALTER TABLE cache_items ADD COLUMN size INTEGER")
+			self.conn.execute("ALTER TABLE cache_items ADD COLUMN cache_class TEXT")
+			self.conn.executemany("UPDATE cache_items SET cache_class = ? WHERE uri = ?",
+				[(get_cache_class(uri), uri) for (uri,) in self.conn.execute("SELECT uri FROM cache_items").fetchall()])
+		self.conn.execute("CREATE INDEX IF NOT EXISTS cache_items_timestamp ON cache_items (permanent, timestamp)")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS cache_items_lru ON cache_items (timestamp)")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS cache_items_class_lru ON cache_items (cache_class, timestamp)")
+		self.reset_stats()
+
+		if needs_migration:
+			self._migrate_json_index(old_index_filename)
+		for uri, filename, timestamp, permanent in self.conn.execute("SELECT uri, filename, timestamp, permanent FROM cache_items"):
+			self.cache_data[uri] = CacheItem({ "permanent": bool(permanent), "filename": filename, "timestamp": timestamp })
+
+	# imports the entries from the old _cache_index.json file
+	def _migrate_json_index(self, old_index_filename):
+		timer = SimpleTimer()
+		with open(old_index_filename, "rb") as f:
+			json_dict = orjson.loads(f.read())
+		with self.conn:
+			self.conn.execute("BEGIN")
+			self.conn.executemany(
+				"INSERT OR REPLACE INTO cache_items (uri, filename, timestamp, permanent, cache_class) VALUES (?, ?, ?, ?, ?)",
+				((uri, item["filename"], item["timestamp"], bool(item.get("permanent")), get_cache_class(uri)) for uri, item in json_dict.items()))
+		logger.info(f"Migrated {len(json_dict)} cache entries from {old_index_filename} in {timer.miliseconds}ms")
+
+	def _save_item(self, uri, item: CacheItem):
+		self.conn.execute(
+			"INSERT OR REPLACE INTO cache_items (uri, filename, timestamp, permanent, cache_class) VALUES (?, ?, ?, ?, ?)",
+			(uri, item.filename, item.timestamp, bool(item.permanent), get_cache_class(uri)))
+
+	# records the size of a cached file, so eviction doesn't have to look at the files themselves
+	def _save_size(self, uri, size):
+		self.conn.execute("UPDATE cache_items SET size = ? WHERE uri = ?", (size, uri))
+
+	# gets the sizes of the given (uri, filename) items' files. this stats every file, so it gets run in the thread pool
+	def _get_file_sizes(self, items):
+		sizes = []
+		for uri, filename in items:
+			filename = self.cache_dir + filename
+			if os.path.isfile(filename):
+				sizes.append((os.path.getsize(filename), uri))
+		return sizes
+
+	# fills in the size of any items whose files were written by something other than save()
+	async def _fill_missing_sizes(self):
+		async with self.lock:
+			items = self.conn.execute("SELECT uri, filename FROM cache_items WHERE size IS NULL").fetchall()
+		if not items:
+			return
+		sizes = await executors.run_thread(self._get_file_sizes, items)
+		async with self.lock:
+			with self.conn:
+				self.conn.execute("BEGIN")
+				self.conn.executemany("UPDATE cache_items SET size = ? WHERE uri = ? AND size IS NULL", sizes)
+
+	# removes the given (uri, filename) items from the index. the lock should be held when calling this
+	def _remove_items(self, items):
+		for uri, filename in items:
+			self.cache_data.pop(uri, None)
+		with self.conn:
+			self.conn.execute("BEGIN")
+			self.conn.executemany("DELETE FROM cache_items WHERE uri = ?", ((uri,) for uri, filename in items))
+
+	def _delete_files(self, items):
+		for uri, filename in items:
+			filename = self.cache_dir + filename
+			if os.path.isfile(filename):
+				os.remove(filename)
+
+	def reset_stats(self):
+		self.stats = { cache_class: { "hits": 0, "misses": 0, "evicted_count": 0, "evicted_bytes": 0 } for cache_class in CACHE_CLASSES }
+
+	# writes the timestamps of any items that have been accessed since the last flush
+	def _flush_timestamps(self):
+		touched = [(self.cache_data[uri].timestamp, uri) for uri in self.touched_uris if uri in self.cache_data]
+		self.touched_uris = set()
+		with self.conn:
+			self.conn.execute("BEGIN")
+			self.conn.executemany("UPDATE cache_items SET timestamp = ? WHERE uri = ?", touched)
+
 	@property
 	def size(self):
 		return len(self.cache_data)
 	
-	# Cleans up any old files and flushes the cache to disk
+	# Cleans up any old files, evicts the least recently used files if we're over budget, and flushes the cache to disk
 	@tasks.loop(hours=4)
 	async def cleanup_and_flush(self):
 		threshold = get_timestamp() - CACHE_FILE_TIMEOUT_MS
+		timer = SimpleTimer()
+		async with self.lock:
+			self._flush_timestamps()
+			expired = self.conn.execute("SELECT uri, filename FROM cache_items WHERE permanent = 0 AND timestamp < ?", (threshold,)).fetchall()
+		removed_count = 0
+		for i in range(0, len(expired), CLEANUP_BATCH_SIZE):
+			batch = expired[i:i + CLEANUP_BATCH_SIZE]
+			removed = []
+			async with self.lock:
+				for uri, filename in batch:
+					item = self.cache_data.get(uri)
+					# skip anything thats been accessed or re-created since we looked
+					if item is None or item.filename != filename or not item.is_expired(threshold):
+						continue
+					removed.append((uri, filename))
+				self._remove_items(removed)
+			self._delete_files(removed)
+			removed_count += len(removed)
+			await asyncio.sleep(0) # let other stuff run between batches
+		logger.info(f"{removed_count} culled from cache in {timer.miliseconds}ms. New cache size {self.size}")
+
+		await self.evict_over_budget()
+		self.report_stats()
+
+	# evicts the least recently used items from any cache class (or the whole cache) that is over its configured byte budget.
+	# permanent items only skip the expiry in cleanup_and_flush. they can always be downloaded again, so they count towards
+	# the budgets and get evicted like everything else
+	async def evict_over_budget(self):
+		budget = settings.cache_budget
+		if not budget:
+			return
 		async with self.lock:
-			timer = SimpleTimer()
-			removed_count = 0
-			for uri, item in list(self.cache_data.items()):
-				if item.is_expired(threshold):
-					filename = self.cache_dir + item.filename
-					if os.path.isfile(filename):
-						os.remove(filename)
-					removed_count += 1
-					del self.cache_data[uri]
-			self._save_to_disk()
-			logger.info(f"{removed_count} culled from cache in {timer.miliseconds}ms. New cache size {self.size}")
+			self._flush_timestamps()
+		await self._fill_missing_sizes()
+		targets = [ (cache_class, budget[cache_class]) for cache_class in CACHE_CLASSES if cache_class in budget ]
+		if "total" in budget:
+			targets.append((None, budget["total"]))
+		for cache_class, limit in targets:
+			async with self.lock:
+				if cache_class is None:
+					current_size = self.conn.execute("SELECT SUM(size) FROM cache_items").fetchone()[0] or 0
+					cursor = self.conn.execute("SELECT uri, filename, size, cache_class FROM cache_items ORDER BY timestamp")
+				else:
+					current_size = self.conn.execute("SELECT SUM(size) FROM cache_items WHERE cache_class = ?", (cache_class,)).fetchone()[0] or 0
+					cursor = self.conn.execute("SELECT uri, filename, size, cache_class FROM cache_items WHERE cache_class = ? ORDER BY timestamp", (cache_class,))
+				over_by = current_size - limit
+				evicted = []
+				for uri, filename, size, item_class in cursor:
+					if over_by <= 0:
+						break
+					size = size or 0
+					evicted.append((uri, filename))
+					over_by -= size
+					self.stats[item_class]["evicted_count"] += 1
+					self.stats[item_class]["evicted_bytes"] += size
+				cursor.close()
+				self._remove_items(evicted)
+			self._delete_files(evicted)
+			await asyncio.sleep(0)
+
+	# logs the hit rate and evictions for each class of cached file since the last report
+	def report_stats(self):
+		sizes = dict(self.conn.execute("SELECT cache_class, SUM(size) FROM cache_items GROUP BY cache_class").fetchall())
+		for cache_class, stats in self.stats.items():
+			lookups = stats["hits"] + stats["misses"]
+			logger.event("cache_stats", {
+				"cache_class": cache_class,
+				"hits": stats["hits"],
+				"misses": stats["misses"],
+				"hit_rate": round(stats["hits"] / lookups, 4) if lookups else None,
+				"evicted_count": stats["evicted_count"],
+				"evicted_bytes": stats["evicted_bytes"],
+				"size_bytes": sizes.get(cache_class) or 0
+			})
+		self.reset_stats()
 
 	# Returns the filename of the cached url if it exists, otherwise None
 	async def get_filename(self, uri):
+		stats = self.stats[get_cache_class(uri)]
 		async with self.lock:
 			item = self.cache_data.get(uri)
 			if item is None:
+				stats["misses"] += 1
 				return None
 			item.update_timestamp()
+			self.touched_uris.add(uri)
 			filename = self.cache_dir + item.filename
 		if not os.path.isfile(filename):
+			stats["misses"] += 1
 			return None
+		stats["hits"] += 1
 		return filename
 
 	# Returns the file if it exists, otherwise None
@@ -111,14 +291,19 @@ class Cache:
 		filename = await self.get_filename(uri)
 		if not filename:
 			return None
+		return self.read_file(filename, return_type)
+
+	# Reads a cached file as the given return type. json and text files are always saved as utf-8. bytes are returned as an
+	# open file rather than read into memory, so the caller should close it (using it in a with statement does that)
+	@staticmethod
+	def read_file(filename, return_type):
 		if return_type == "json":
 			return read_json(filename)
 		elif return_type == "text":
-			with open(filename, "r") as f:
+			with open(filename, "r", encoding="utf-8") as f:
 				return f.read()
 		elif return_type == "bytes":
-			with open(filename, "rb") as f:
-				return BytesIO(f.read())
+			return open(filename, "rb")
 		elif return_type == "filename":
 			return filename
 		else:
@@ -135,12 +320,14 @@ class Cache:
 			filename = str(uuid.uuid4())
 			if extension:
 				filename = f"{filename}.{extension}"
-			self.cache_data[uri] = CacheItem.create(filename, permanent=permanent)
-			self._save_to_disk()
+			item = CacheItem.create(filename, permanent=permanent)
+			self.cache_data[uri] = item
+			self._save_item(uri, item)
 		return self.cache_dir + filename
 
 
-	async def save(self, uri, return_type, response, permanent=False):
+	# Streams the body of the response into the cache, so the whole thing never has to be in memory at once. Returns the filename
+	async def save(self, uri, return_type, response, permanent=False, max_size=None):
 		extension = None
 		if return_type == "json":
 			extension = "json"
@@ -153,9 +340,38 @@ class Cache:
 		else:
 			raise ValueError(f"Invalid return type '{return_type}'")
 
+		if max_size is not None and (response.content_length or 0) > max_size:
+			raise HttpTooLargeError(uri, max_size)
+
 		filename = await self.new(uri, extension, permanent=permanent)
-		with open(filename, "wb+") as f:
-			f.write(await response.read())
+		# json and text get converted to utf-8 as they're written, so they can be read back without knowing the response's charset
+		decoder = None
+		if return_type in ["json", "text"]:
+			encoding = get_response_encoding(response)
+			if codecs.lookup(encoding).name != "utf-8":
+				decoder = codecs.getincrementaldecoder(encoding)()
+
+		# write to a temp file and rename it into place once its done, so nobody ever reads half a file
+		temp_filename = f"{filename}.{uuid.uuid4()}.part"
+		size = 0
+		try:
+			with open(temp_filename, "wb") as f:
+				async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+					size += len(chunk)
+					if max_size is not None and size > max_size:
+						raise HttpTooLargeError(uri, max_size)
+					if decoder:
+						chunk = decoder.decode(chunk).encode("utf-8")
+					f.write(chunk)
+				if decoder:
+					f.write(decoder.decode(b"", final=True).encode("utf-8"))
+				size = f.tell()
+			os.replace(temp_filename, filename)
+		finally:
+			if os.path.exists(temp_filename):
+				os.remove(temp_filename)
+		self._save_size(uri, size)
+		return filename
 
 
 	async def remove(self, uri):
@@ -165,4 +381,5 @@ class Cache:
 				filename = self.cache_dir + item.filename
 				if os.path.isfile(filename):
 					os.remove(filename)
-				del self.cache_data[uri]
\ No newline at end of file
+				del self.cache_data[uri]
+				self.conn.execute("DELETE FROM cache_items WHERE uri = ?", (uri,))
\ No newline at end of file
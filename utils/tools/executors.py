@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from utils.tools.helpers import *
+from utils.tools.settings import settings
+from utils.tools.logger import logger
+
+#
+# the shared pools that blocking work gets sent to, so it doesnt block the event loop (or spin up a new pool every call)
+# "process" is for heavy cpu-bound rendering (the match gif, graphs), "thread" is for blocking io (tts, youtube
+# downloads, decoding audio), and "render" is for rendering stuff that can't be pickled over to another process (like
+# Tables, which hold fonts). render gets its own threads so that a burst of tts can't starve renders, or the reverse
+#
+
+def get_default_executor_limits():
+	return {
+		"process": { "workers": max(1, min(4, (os.cpu_count() or 2) - 1)), "max_queue": 8 },
+		"thread": { "workers": 8, "max_queue": 64 },
+		"render": { "workers": 4, "max_queue": 32 }
+	}
+
+# the modules that the process pool's jobs come from. none of these import utils.tools.globals, so a worker never opens
+# the bot's databases or http sessions
+PROCESS_JOB_MODULES = [ "utils.drawing.mapgif", "utils.drawing.graph" ]
+
+# the process pool's workers are forked from a forkserver (or spawned, where that isn't available) instead of from the
+# bot itself. the bot has threads running, so a worker forked from it could start with a lock (like a logging handler's)
+# held by a thread that doesnt exist in the worker, along with open sqlite connections and http sessions. the forkserver
+# is a fresh single-threaded process that only imports the job modules, so its workers start with just those loaded
+def get_process_context():
+	if "forkserver" in multiprocessing.get_all_start_methods():
+		context = multiprocessing.get_context("forkserver")
+		context.set_forkserver_preload(PROCESS_JOB_MODULES)
+		return context
+	return multiprocessing.get_context("spawn")
+
+# runs when each process pool worker starts. the bot's logging handlers (like loki) are set up on its event loop,
+# which workers dont have, so worker logs go to stderr instead
+def _init_process_worker():
+	logger.addHandler(logging.StreamHandler())
+
+# runs in the worker, so that we know when the job actually started (vs how long it sat in the queue)
+def _timed_call(func, args, kwargs):
+	started = time.time()
+	result = func(*args, **kwargs)
+	return result, started, time.time()
+
+def get_job_name(func):
+	if isinstance(func, functools.partial):
+		func = func.func
+	return getattr(func, "__qualname__", None) or getattr(func, "__name__", None) or repr(func)
+
+class ExecutorOverloadedError(UserError):
+	def __init__(self, pool_name):
+		self.pool_name = pool_name
+		super().__init__("I'm a bit overloaded right now, try again in a minute or two")
+
+class Executors:
+	"""The shared process and thread pools. Each pool only lets so many jobs wait at once, so that if the bot is
+	overloaded, new jobs get turned away with a UserError instead of piling up forever"""
+	def __init__(self):
+		limits = get_default_executor_limits()
+		for pool_name, overrides in settings.executor_limits.items():
+			if pool_name in limits:
+				limits[pool_name].update(overrides)
+		self.limits = limits
+		self.pending = { pool_name: 0 for pool_name in limits }
+		self.pools = {}
+
+	def get_pool(self, pool_name):
+		pool = self.pools.get(pool_name)
+		if pool is None:
+			workers = self.limits[pool_name]["workers"]
+			if pool_name == "process":
+				pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_process_context(), initializer=_init_process_worker)
+			else:
+				pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"mango-{pool_name}")
+			self.pools[pool_name] = pool
+		return pool
+
+	async def run(self, pool_name, func, *args, **kwargs):
+		"""Runs func in the given pool and returns its result, raising ExecutorOverloadedError if too many jobs are already waiting"""
+		if self.pending[pool_name] >= self.limits[pool_name]["max_queue"]:
+			logger.event("executor_rejected", {
+				"pool": pool_name,
+				"job": get_job_name(func),
+				"pending": self.pending[pool_name]
+			})
+			raise ExecutorOverloadedError(pool_name)
+		self.pending[pool_name] += 1
+		try:
+			submitted = time.time()
+			result, started, finished = await asyncio.get_running_loop().run_in_executor(self.get_pool(pool_name), _timed_call, func, args, kwargs)
+		finally:
+			self.pending[pool_name] -= 1
+		logger.event("executor_job", {
+			"pool": pool_name,
+			"job": get_job_name(func),
+			"queue_time": int((started - submitted) * 1000),
+			"run_time": int((finished - started) * 1000),
+			"total_time": int((time.time() - submitted) * 1000),
+			"pending": self.pending[pool_name]
+		})
+		return result
+
+	async def run_process(self, func, *args, **kwargs):
+		"""Runs func in the process pool. func and its args have to be picklable"""
+		return await self.run("process", func, *args, **kwargs)
+
+	async def run_thread(self, func, *args, **kwargs):
+		"""Runs func in the thread pool"""
+		return await self.run("thread", func, *args, **kwargs)
+
+	async def run_render(self, func, *args, **kwargs):
+		"""Runs func in the render thread pool. For rendering stuff that can't go to the process pool, like Tables"""
+		return await self.run("render", func, *args, **kwargs)
+
+	def shutdown(self):
+		for pool in self.pools.values():
+			pool.shutdown(wait=False, cancel_futures=True)
+		self.pools = {}
+
+executors = Executors()
@@ -2,4 +2,5 @@
 from utils.tools.settings import settings
 from utils.tools.logger import logger
 from utils.tools.botdata import botdata
-from utils.tools.httpgetter import httpgetter
\ No newline at end of file
+from utils.tools.httpgetter import httpgetter
+from utils.tools.executors import executors
\ No newline at end of file
@@ -6,7 +6,7 @@ import re
 import subprocess
 import sys
 import typing
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import logging
 
 import disnake
@@ -268,6 +268,33 @@ class AsyncBundler():
 			result += f"\n{self.exceptions_dict[e]} failed with {e}"
 		return result
 
+async def gather_in_order(items, fetch, limit=None, max_concurrency=5):
+	"""Awaits fetch(item) for each item, running up to max_concurrency of them at a time. Returns the results that
+	werent None, in the same order as the items.
+
+	If limit is given, stops as soon as the first limit results are in, and cancels anything still running"""
+	results = []
+	items = iter(items)
+	running = deque()
+	try:
+		while True:
+			while len(running) < max_concurrency:
+				item = next(items, StopIteration)
+				if item is StopIteration:
+					break
+				running.append(asyncio.ensure_future(fetch(item)))
+			if not running:
+				break
+			result = await running.popleft()
+			if result is not None:
+				results.append(result)
+				if limit is not None and len(results) >= limit:
+					break
+	finally:
+		for task in running:
+			task.cancel()
+	return results
+
 class DeveloperNotifError(UserError):
 	"""A user error that also notifies the bot developer of something"""
 	def __init__(self, message, dev_message):
@@ -290,4 +317,14 @@ class Http404Error(HttpError):
 	"""An http error with a 404 error code"""
 	def __init__(self, message, url):
 		super().__init__(message, url, 404)
+
+
+class HttpTooLargeError(HttpError):
+	"""An http download that was bigger than we're willing to download"""
+	def __init__(self, url, max_size):
+		if max_size >= 1024 * 1024:
+			limit = f"{max_size // (1024 * 1024)}MB"
+		else:
+			limit = f"{max(1, max_size // 1024)}KB"
+		super().__init__(f"That file is too big for me to download (the limit is {limit})", url, 413)
 	
\ No newline at end of file
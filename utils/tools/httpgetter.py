@@ -3,10 +3,13 @@ import re
 from io import BytesIO
 
 import aiohttp
+from disnake.ext import tasks
 from utils.tools.helpers import *
 from utils.tools.logger import logger
 from utils.tools.settings import settings
-from utils.tools.cache import Cache
+from utils.tools.cache import Cache, DOWNLOAD_CHUNK_SIZE, get_response_encoding
+from utils.tools.httpsessions import create_session, get_pool_name, report_pool_stats, close_sessions
+from utils.tools.ratelimiter import HostLimiters, RETRY_STATUSES, MAX_RETRIES, MAX_RETRY_DELAY, parse_retry_after, get_backoff_delay
 
 async def get_cloudflare_id(request):
 	try:
@@ -27,88 +30,192 @@ def raise_error(url, code, errors):
 		logger.error(f"http {code} error on: {url}")
 		raise HttpError(template, url, code)
 
+# reads the whole body of the response, giving up if its bigger than max_size
+async def read_limited(url, r, max_size):
+	if (r.content_length or 0) > max_size:
+		raise HttpTooLargeError(url, max_size)
+	data = bytearray()
+	async for chunk in r.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+		data += chunk
+		if len(data) > max_size:
+			raise HttpTooLargeError(url, max_size)
+	return bytes(data)
+
+# turns a dict into something hashable, for use in a key
+def freeze_dict(d):
+	return frozenset(d.items()) if d else None
+
 class HttpGetter:
 	def __init__(self):
 		self.loop = asyncio.get_event_loop()
-		self.session = aiohttp.ClientSession(loop=self.loop)
+		self.session = create_session("default", loop=self.loop)
+		self.pool_sessions = { "wikipedia": create_session("wikipedia", loop=self.loop) }
 		self.cache = Cache(self.loop)
+		self.inflight: typing.Dict[tuple, asyncio.Task] = {} # requests currently being downloaded, so duplicate requests can share them
+		self.coalesced_count = 0
+		self.limiters = HostLimiters()
+
+	# gets the session for the connection pool the given url belongs in
+	def get_session(self, url) -> aiohttp.ClientSession:
+		return self.pool_sessions.get(get_pool_name(url), self.session)
 
-	async def get(self, url: str, return_type="json", cache=False, cache_permanent=False, errors={}, headers=None):
+	async def get(self, url: str, return_type="json", cache=False, cache_permanent=False, errors={}, headers=None, max_size=None):
+		if max_size is None:
+			max_size = settings.http_max_download_size
 		if cache_permanent:
 			cache = True
-		if cache and await self.cache.get_filename(url):
-			return await self.cache.get(url, return_type)
+		if cache:
+			cached = await self.cache.get(url, return_type)
+			if cached is not None:
+				return cached
 
-		timer = SimpleTimer()
-		async with self.session.get(url, headers=headers, timeout=60) as r:
-			logger.event("httprequest", {
+		# if this exact request is already being downloaded, wait for that one instead of downloading it again.
+		# the headers and errors are part of the key, so requests with different auth or error messages dont share a response
+		key = (url, return_type, cache, cache_permanent, freeze_dict(headers), freeze_dict(errors))
+		task = self.inflight.get(key)
+		if task is None:
+			task = asyncio.ensure_future(self._download(url, return_type, cache, cache_permanent, errors, headers, max_size))
+			self.inflight[key] = task
+			task.add_done_callback(lambda t: self._download_done(key, t))
+		else:
+			self.coalesced_count += 1
+			logger.event("httprequest_coalesced", {
 				"url": url,
-				"status": r.status,
-				"time": timer.miliseconds
+				"coalesced_total": self.coalesced_count
 			})
-			if r.status == 200:
-				if cache:
-					await self.cache.save(url, return_type, r, permanent=cache_permanent)
-					if return_type == "filename":
-						return await self.cache.get_filename(url)
-
-				if return_type == "json":
-					return json.loads(await r.text(), object_pairs_hook=OrderedDict)
-				elif return_type == "text":
-					return await r.text()
-				elif return_type == "bytes":
-					return BytesIO(await r.read())
-				else:
-					raise ValueError(f"Invalid return type '{return_type}'")
+		# shielded so that one caller getting cancelled doesnt cancel the download for everyone else
+		data = await asyncio.shield(task)
+
+		# each caller gets its own copy of the result, since they may modify it
+		if cache:
+			return self.cache.read_file(data, return_type)
+		elif return_type == "json":
+			return json.loads(data, object_pairs_hook=OrderedDict)
+		elif return_type == "bytes":
+			return BytesIO(data)
+		else:
+			return data
+
+	def _download_done(self, key, task: asyncio.Task):
+		del self.inflight[key]
+		if not task.cancelled():
+			task.exception() # marks the exception as retrieved, in case every caller was cancelled
+
+	# downloads the given url, returning the cache filename if its being cached, otherwise the body as text for json/text or bytes for bytes
+	async def _download(self, url: str, return_type, cache, cache_permanent, errors, headers, max_size):
+		limiter = self.limiters.get(url)
+		attempt = 0
+		while True:
+			async with limiter.limit() as wait_time:
+				timer = SimpleTimer()
+				async with self.get_session(url).get(url, headers=headers, timeout=60) as r:
+					self._log_request(url, r, timer, limiter, wait_time, attempt)
+					retry_delay = self._get_retry_delay(r, limiter, attempt)
+					if retry_delay is None:
+						return await self._read_response(url, r, return_type, cache, cache_permanent, errors, max_size)
+			# sleep outside of the limiter, so we're not holding an in-flight slot while waiting
+			attempt += 1
+			await asyncio.sleep(retry_delay)
+
+	def _log_request(self, url, r, timer, limiter, wait_time, attempt, method="GET"):
+		logger.event("httprequest", {
+			"url": url,
+			"status": r.status,
+			"time": timer.miliseconds,
+			"method": method,
+			"host": limiter.host,
+			"wait_time": wait_time,
+			"attempt": attempt,
+			"queue_depth": limiter.queue_depth,
+			"inflight": limiter.inflight,
+			"throttle_count": limiter.throttle_count,
+			"retry_count": limiter.retry_count
+		})
+
+	# returns how long to wait before retrying the given response, or None if it shouldn't be retried
+	def _get_retry_delay(self, r, limiter, attempt):
+		if r.status not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+			return None
+		retry_after = parse_retry_after(r.headers.get("Retry-After"))
+		if retry_after is not None:
+			if retry_after > MAX_RETRY_DELAY:
+				return None
+			if r.status == 429:
+				# the whole host is telling us to back off, not just this request
+				limiter.pause(retry_after)
+			delay = retry_after
+		else:
+			delay = get_backoff_delay(attempt)
+		limiter.retry_count += 1
+		logger.info(f"http {r.status} on {r.url}, retrying in {delay:.1f}s")
+		return delay
+
+	async def _read_response(self, url, r, return_type, cache, cache_permanent, errors, max_size):
+		if r.status == 200:
+			if cache:
+				return await self.cache.save(url, return_type, r, permanent=cache_permanent, max_size=max_size)
+
+			if return_type in ["json", "text"]:
+				return (await read_limited(url, r, max_size)).decode(get_response_encoding(r))
+			elif return_type == "bytes":
+				return await read_limited(url, r, max_size)
 			else:
-				# text = await r.text()
-				# print(f"ERROR TEXT: {text}")
-				if r.status == 403:
-					cloudflare_id = await get_cloudflare_id(r)
-					if cloudflare_id:
-						logger.error(f"http 403 cloudflare error. url: {url} RayID: {cloudflare_id}")
-						# raise HttpError(f"Getting cloudflare blocked. RayID: {cloudflare_id}. Please report to developer.", url, 403)
+				raise ValueError(f"Invalid return type '{return_type}'")
+		else:
+			# text = await r.text()
+			# print(f"ERROR TEXT: {text}")
+			if r.status == 403:
+				cloudflare_id = await get_cloudflare_id(r)
+				if cloudflare_id:
+					logger.error(f"http 403 cloudflare error. url: {url} RayID: {cloudflare_id}")
+					# raise HttpError(f"Getting cloudflare blocked. RayID: {cloudflare_id}. Please report to developer.", url, 403)
 
-					if "api.stratz.com" in url:
-						error_message = f"Http 403 Auth error on STRATZ request:\n<{url}>\n"
-						if cloudflare_id:
-							error_message += f"\nGotta complain in discord using this cloudflare ID: {cloudflare_id}"
-						else:
-							error_message += f"\nAPI token probably expired. Gotta get new one: <https://stratz.com/api>"
-						try:
-							text = await r.text()
-							if text:
-								error_message += f"\n```{text}```"
-						except:
-							pass
-						user_message = "Got a STRATZ auth error. I've notified the bot developer of the issue. Try again in a day or so."
-						raise DeveloperNotifError(user_message, error_message)
+				if "api.stratz.com" in url:
+					error_message = f"Http 403 Auth error on STRATZ request:\n<{url}>\n"
+					if cloudflare_id:
+						error_message += f"\nGotta complain in discord using this cloudflare ID: {cloudflare_id}"
+					else:
+						error_message += f"\nAPI token probably expired. Gotta get new one: <https://stratz.com/api>"
+					try:
+						text = await r.text()
+						if text:
+							error_message += f"\n```{text}```"
+					except:
+						pass
+					user_message = "Got a STRATZ auth error. I've notified the bot developer of the issue. Try again in a day or so."
+					raise DeveloperNotifError(user_message, error_message)
 
 
 
-				raise_error(url, r.status, errors)
+			raise_error(url, r.status, errors)
 
 	async def post(self, url, return_type="json", errors={}, body={}, headers={}):
-		timer = SimpleTimer()
-		async with self.session.post(url, json=body, headers=headers) as r:
-			logger.event("httprequest", {
-				"url": url,
-				"status": r.status,
-				"time": timer.miliseconds,
-				"method": "POST"
-			})
-			if r.status == 200:
-				if return_type == "json":
-					return json.loads(await r.text(), object_pairs_hook=OrderedDict)
-				elif return_type == "text":
-					return await r.text()
-				elif return_type == "bytes":
-					return BytesIO(await r.read())
+		# posts arent retried, since they may not be safe to send twice
+		limiter = self.limiters.get(url)
+		async with limiter.limit() as wait_time:
+			timer = SimpleTimer()
+			async with self.get_session(url).post(url, json=body, headers=headers) as r:
+				self._log_request(url, r, timer, limiter, wait_time, 0, method="POST")
+				if r.status == 200:
+					if return_type == "json":
+						return json.loads(await r.text(), object_pairs_hook=OrderedDict)
+					elif return_type == "text":
+						return await r.text()
+					elif return_type == "bytes":
+						return BytesIO(await r.read())
+					else:
+						raise ValueError(f"Invalid return type '{return_type}'")
 				else:
-					raise ValueError(f"Invalid return type '{return_type}'")
-			else:
-				raise_error(url, r.status, errors)
+					raise_error(url, r.status, errors)
 
-httpgetter = HttpGetter()
+	@tasks.loop(minutes=30)
+	async def report_stats(self):
+		report_pool_stats()
 
+	async def close(self):
+		"""Closes the http sessions used for requests. Called when shutting down"""
+		if self.report_stats.is_running():
+			self.report_stats.cancel()
+		await close_sessions("default", *self.pool_sessions.keys())
 
+httpgetter = HttpGetter()
@@ -0,0 +1,92 @@
+from urllib.parse import urlparse
+
+import aiohttp
+from utils.tools.helpers import *
+from utils.tools.logger import logger
+
+#
+# the aiohttp sessions the bot uses. each pool gets its own connector, so slow requests to one place (like
+# pushing logs to loki) can't use up the connections needed for user-facing api calls
+#
+
+# limit is the max connections for the whole pool, limit_per_host is the max connections to any one host.
+# keepalive_timeout is how many seconds an idle connection is kept around for reuse
+POOL_CONFIGS = {
+	"default": { "limit": 100, "limit_per_host": 20, "keepalive_timeout": 60 },
+	"wikipedia": { "limit": 10, "limit_per_host": 10, "keepalive_timeout": 30 },
+	"loki": { "limit": 4, "limit_per_host": 4, "keepalive_timeout": 120 }
+}
+# which pool to use for each host. anything not in here goes in the default pool
+POOL_HOSTS = {
+	"en.wikipedia.org": "wikipedia"
+}
+DNS_CACHE_TTL = 300 # seconds
+
+def get_pool_name(url):
+	return POOL_HOSTS.get(urlparse(url).hostname, "default")
+
+class PoolStats:
+	"""Counts how often a pool opens a new connection vs reuses one it already has open"""
+	def __init__(self):
+		self.created = 0
+		self.reused = 0
+
+	def create_trace_config(self):
+		trace_config = aiohttp.TraceConfig()
+		trace_config.on_connection_create_end.append(self._on_create)
+		trace_config.on_connection_reuseconn.append(self._on_reuse)
+		return trace_config
+
+	async def _on_create(self, session, context, params):
+		self.created += 1
+
+	async def _on_reuse(self, session, context, params):
+		self.reused += 1
+
+	def reset(self):
+		self.created = 0
+		self.reused = 0
+
+# every session created with create_session, so that they can all be closed on shutdown
+sessions: typing.Dict[str, aiohttp.ClientSession] = {}
+pool_stats: typing.Dict[str, PoolStats] = {}
+
+def create_connector(pool_name, loop=None):
+	config = POOL_CONFIGS[pool_name]
+	return aiohttp.TCPConnector(
+		loop=loop,
+		limit=config["limit"],
+		limit_per_host=config["limit_per_host"],
+		keepalive_timeout=config["keepalive_timeout"],
+		use_dns_cache=True,
+		ttl_dns_cache=DNS_CACHE_TTL)
+
+def create_session(pool_name, loop=None, **kwargs) -> aiohttp.ClientSession:
+	"""Creates the session for the given pool, with its own tuned connector"""
+	stats = pool_stats.setdefault(pool_name, PoolStats())
+	session = aiohttp.ClientSession(
+		loop=loop,
+		connector=create_connector(pool_name, loop),
+		trace_configs=[stats.create_trace_config()],
+		**kwargs)
+	sessions[pool_name] = session
+	return session
+
+# logs how well each pool is reusing its connections since the last report
+def report_pool_stats():
+	for pool_name, stats in pool_stats.items():
+		total = stats.created + stats.reused
+		logger.event("http_pool_stats", {
+			"pool": pool_name,
+			"connections_created": stats.created,
+			"connections_reused": stats.reused,
+			"reuse_ratio": round(stats.reused / total, 4) if total else None
+		})
+		stats.reset()
+
+async def close_sessions(*pool_names):
+	"""Closes the sessions for the given pools, or all of them if none are given"""
+	for pool_name in (pool_names or list(sessions.keys())):
+		session = sessions.pop(pool_name, None)
+		if session is not None and not session.closed:
+			await session.close()
@@ -166,8 +166,9 @@ async def init_logger():
 
 	baseurl = loki_config["base_url"]
 
+	from utils.tools.httpsessions import create_session # imported here because httpsessions uses this logger
 	loop = asyncio.get_event_loop()
-	session = aiohttp.ClientSession(loop=loop, auth=aiohttp.BasicAuth(loki_config["username"], loki_config["password"]))
+	session = create_session("loki", loop=loop, auth=aiohttp.BasicAuth(loki_config["username"], loki_config["password"]))
 	handler = AioLokiHandler(
 		baseurl,
 		tags={"application": loki_config["application"]},
@@ -0,0 +1,109 @@
+import math
+import typing
+import numpy as np
+
+#
+# aggregates a bunch of player matches (like the ones opendota's /players/{id}/matches gives) for stats commands.
+# each column gets turned into a numpy array once, and then every average/percent/grouping is computed from those
+# arrays, instead of looping through all of the match dicts again for each stat
+#
+
+class MatchStats:
+	"""A set of player matches, as a numpy array (of floats, with missing values as nan) for each column"""
+	def __init__(self, count, matches=None, history=None, indexes=None):
+		self.count = count
+		self.matches = matches
+		self.history = history
+		self.indexes = indexes
+		self.columns: typing.Dict[str, np.ndarray] = {}
+
+	@classmethod
+	def from_matches(cls, matches: typing.List[dict]):
+		"""Creates this from a list of player match dicts"""
+		return cls(len(matches), matches=matches)
+
+	@classmethod
+	def from_history(cls, history, indexes=None):
+		"""Creates this from a PlayerHistory (see playerindex), with only the matches at the given indexes"""
+		return cls(len(history) if indexes is None else len(indexes), history=history, indexes=indexes)
+
+	def __len__(self):
+		return self.count
+
+	def get(self, column):
+		"""Gets a column as an array of floats, with missing values as nan"""
+		array = self.columns.get(column)
+		if array is None:
+			if self.history is not None:
+				if not self.history.has_columns([ column ]):
+					array = np.full(self.count, np.nan)
+				else:
+					array = self.history.get_array(column)
+					if self.indexes is not None:
+						array = array[self.indexes]
+			else:
+				values = [ match.get(column) for match in self.matches ]
+				array = np.array([ np.nan if value is None else value for value in values ], dtype=np.float64)
+			self.columns[column] = array
+		return array
+
+	def has(self, column):
+		"""A mask of the matches that have a value for this column"""
+		return ~np.isnan(self.get(column))
+
+	def is_true(self, column):
+		"""A mask of the matches where this column has a truthy value (missing counts as false)"""
+		values = self.get(column)
+		return (values != 0) & ~np.isnan(values)
+
+	def won(self):
+		"""A mask of the matches the player won"""
+		return self.has("radiant_win") & ((self.get("radiant_win") == 1) == (self.get("player_slot") < 128))
+
+	def avg(self, values, round_place=0):
+		"""The average of the given values (a column name or an array), ignoring missing ones. None if there aren't any"""
+		if isinstance(values, str):
+			values = self.get(values)
+		values = values[~np.isnan(values)]
+		if len(values) == 0:
+			return None
+		value = round(float(values.sum()) / len(values), round_place)
+		return int(value) if round_place == 0 else value
+
+	def percent(self, mask, round_place=0, needs_key=None):
+		"""The percent of matches in the given mask, as a string like "52%". Matches without a value for needs_key
+		are left out. round_place can be "floor" to round down to a whole percent"""
+		if needs_key:
+			mask = mask[self.has(needs_key)]
+		if len(mask) == 0:
+			return None
+		count = int(np.count_nonzero(mask))
+		if round_place == "floor":
+			count = math.floor((count * 100) / len(mask))
+			round_place = 0
+		else:
+			count = round((count * 100) / len(mask), round_place)
+		value = int(count) if round_place == 0 else count
+		return f"{value}%"
+
+	def group_counts(self, column, mask=None):
+		"""Counts how many matches have each value of the column, as a list of (value, count), most common first.
+		Ties are in the order each value first shows up. Missing values are left out"""
+		values = self.get(column)
+		if mask is not None:
+			values = values[mask]
+		values = values[~np.isnan(values)]
+		if len(values) == 0:
+			return []
+		unique, first_indexes, counts = np.unique(values, return_index=True, return_counts=True)
+		order = np.lexsort((first_indexes, -counts))
+		return [ (int(unique[i]), int(counts[i])) for i in order ]
+
+	def map_values(self, column, func):
+		"""Maps each distinct value of a column through func (which is only called once per value), giving an object array"""
+		values = self.get(column)
+		unique, inverse = np.unique(values, return_inverse=True)
+		mapped = np.empty(len(unique), dtype=object)
+		for i, value in enumerate(unique):
+			mapped[i] = None if np.isnan(value) else func(int(value))
+		return mapped[inverse.reshape(-1)]
@@ -0,0 +1,320 @@
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from disnake.ext import tasks
+import orjson
+
+from utils.tools.helpers import *
+from utils.tools.logger import logger
+from utils.tools.settings import settings
+from utils.tools.executors import executors
+from utils.tools.cache import get_timestamp, CACHE_FILE_TIMEOUT_MS
+
+#
+# a local store for downloaded opendota/stratz match data. each match is split into sections (the summary,
+# the objectives, each player's time series, etc) which are compressed separately, so reading a match only
+# decodes the sections that actually get used. for example, /match info never has to decode stratz position events
+#
+
+COMPRESSION_LEVEL = 6
+
+# how each source's match data is split up. "sections" pulls top-level keys out of the summary, and
+# "player_sections" pulls keys out of each of the players. anything not listed stays in the summary
+MATCH_SECTIONS = {
+	"opendota": {
+		"sections": {
+			"objectives": [ "objectives" ],
+			"teamfights": [ "teamfights" ],
+			"advantages": [ "radiant_gold_adv", "radiant_xp_adv" ],
+			"chat": [ "chat", "all_word_counts", "my_word_counts", "cosmetics", "draft_timings" ]
+		},
+		"player_sections": {
+			"player_timeseries": [ "times", "gold_t", "lh_t", "dn_t", "xp_t" ],
+			"player_logs": [ "purchase_log", "kills_log", "buyback_log", "runes_log", "connection_log", "obs_log", "sen_log", "obs_left_log", "sen_left_log", "neutral_item_history" ],
+			"player_details": [ "lane_pos", "obs", "sen", "actions", "pings", "killed", "killed_by", "damage", "damage_taken", "damage_inflictor", "damage_inflictor_received", "damage_targets", "hero_hits", "ability_uses", "ability_targets", "item_uses", "gold_reasons", "xp_reasons", "purchase", "purchase_time", "first_purchase_time", "item_win", "item_usage", "life_state", "multi_kills", "kill_streaks", "cosmetics", "permanent_buffs", "additional_units", "benchmarks" ]
+		}
+	},
+	"stratz": {
+		"sections": {
+			"playback": [ "playbackData" ]
+		},
+		"player_sections": {
+			"player_playback": [ "playbackData" ],
+			"player_stats": [ "stats" ]
+		}
+	}
+}
+
+def encode_section(data):
+	return zlib.compress(orjson.dumps(data), COMPRESSION_LEVEL)
+
+def decode_section(blob):
+	return orjson.loads(zlib.decompress(blob))
+
+def split_match(source, match):
+	"""Splits match data into its sections. The summary keeps track of which keys were moved to which section"""
+	config = MATCH_SECTIONS[source]
+	summary = {}
+	sections = {}
+	lazy_keys = {}
+	top_level_sections = { key: section for section, keys in config["sections"].items() for key in keys }
+	for key, value in match.items():
+		section = top_level_sections.get(key)
+		if section is None:
+			summary[key] = value
+		else:
+			sections.setdefault(section, {})[key] = value
+			lazy_keys[key] = section
+
+	player_lazy_keys = []
+	if isinstance(match.get("players"), list):
+		player_sections = { key: section for section, keys in config["player_sections"].items() for key in keys }
+		players = []
+		for i, player in enumerate(match["players"]):
+			player_summary = {}
+			player_keys = {}
+			for key, value in player.items():
+				section = player_sections.get(key)
+				if section is None:
+					player_summary[key] = value
+				else:
+					player_keys[key] = section
+			for section in config["player_sections"]:
+				# each player section is a list with an entry for each player
+				sections.setdefault(section, [ {} for p in match["players"] ])[i] = { key: player[key] for key, s in player_keys.items() if s == section }
+			players.append(player_summary)
+			player_lazy_keys.append(player_keys)
+		summary["players"] = players
+
+	summary["_lazy_keys"] = lazy_keys
+	summary["_player_lazy_keys"] = player_lazy_keys
+	return summary, sections
+
+class LazyDict(dict):
+	"""A dict where some keys are only loaded from the match store the first time they're used.
+
+	Looking up a key (via [], get, or in) only loads the section that key is in. Anything that goes over the whole
+	dict (iterating, keys(), items(), len(), etc) loads everything first."""
+	def __init__(self, data, lazy_keys, stored_match):
+		super().__init__(data)
+		self._lazy_keys = lazy_keys
+		self._stored_match = stored_match
+
+	def _load_key(self, key):
+		section = self._lazy_keys.get(key)
+		if section is None:
+			return False
+		self._stored_match.load_section(section)
+		return True
+
+	def _fill(self, section, values):
+		for key, value in values.items():
+			if not dict.__contains__(self, key): # dont overwrite anything that was set while the section wasnt loaded
+				dict.__setitem__(self, key, value)
+		for key in [ key for key, s in self._lazy_keys.items() if s == section ]:
+			del self._lazy_keys[key]
+
+	def load_all(self):
+		for section in set(self._lazy_keys.values()):
+			self._stored_match.load_section(section)
+
+	def __missing__(self, key):
+		if self._load_key(key) and dict.__contains__(self, key):
+			return dict.__getitem__(self, key)
+		raise KeyError(key)
+
+	def get(self, key, default=None):
+		if not dict.__contains__(self, key) and not self._load_key(key):
+			return default
+		return dict.get(self, key, default)
+
+	def __contains__(self, key):
+		return dict.__contains__(self, key) or key in self._lazy_keys
+
+	def __setitem__(self, key, value):
+		self._lazy_keys.pop(key, None)
+		dict.__setitem__(self, key, value)
+
+	def __delitem__(self, key):
+		if self._load_key(key) and not dict.__contains__(self, key):
+			raise KeyError(key)
+		dict.__delitem__(self, key)
+
+	def __iter__(self):
+		self.load_all()
+		return dict.__iter__(self)
+
+	def __len__(self):
+		self.load_all()
+		return dict.__len__(self)
+
+	def __eq__(self, other):
+		self.load_all()
+		return dict.__eq__(self, other)
+
+	__hash__ = None
+
+	def __repr__(self):
+		self.load_all()
+		return dict.__repr__(self)
+
+	def keys(self):
+		self.load_all()
+		return dict.keys(self)
+
+	def values(self):
+		self.load_all()
+		return dict.values(self)
+
+	def items(self):
+		self.load_all()
+		return dict.items(self)
+
+	def copy(self):
+		self.load_all()
+		return dict(dict.items(self))
+
+	def pop(self, key, *args):
+		self._load_key(key)
+		return dict.pop(self, key, *args)
+
+	def setdefault(self, key, default=None):
+		self._load_key(key)
+		return dict.setdefault(self, key, default)
+
+	def __reduce__(self):
+		# pickles as a plain, fully loaded dict, so it can be sent to other processes
+		return (dict, (self.copy(),))
+
+class StoredMatch:
+	"""Keeps track of which sections of a match read from the store have been loaded so far"""
+	def __init__(self, store, source, match_id, summary):
+		self.store = store
+		self.source = source
+		self.match_id = match_id
+		self.loaded = set()
+		self.lock = threading.Lock() # the gif code reads matches from a worker thread
+		lazy_keys = summary.pop("_lazy_keys")
+		player_lazy_keys = summary.pop("_player_lazy_keys")
+		if "players" in summary:
+			summary["players"] = [ LazyDict(player, keys, self) for player, keys in zip(summary["players"], player_lazy_keys) ]
+			self.players = summary["players"]
+		else:
+			self.players = []
+		self.match = LazyDict(summary, lazy_keys, self)
+
+	def load_section(self, section):
+		with self.lock:
+			if section in self.loaded:
+				return
+			data = self.store.read_section(self.source, self.match_id, section)
+			if section in MATCH_SECTIONS[self.source]["player_sections"]:
+				data = data or []
+				for i, player in enumerate(self.players):
+					player._fill(section, data[i] if i < len(data) else {})
+			else:
+				self.match._fill(section, data or {})
+			self.loaded.add(section)
+
+class MatchStore:
+	"""Stores downloaded match data in an sqlite database, compressed and split into sections"""
+	def __init__(self, path):
+		self.path = path
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		self.lock = threading.Lock()
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="matchstore")
+		self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS matches (
+			source TEXT NOT NULL,
+			match_id INTEGER NOT NULL,
+			parsed INTEGER NOT NULL,
+			timestamp INTEGER NOT NULL,
+			size INTEGER NOT NULL,
+			PRIMARY KEY (source, match_id))""")
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS match_sections (
+			source TEXT NOT NULL,
+			match_id INTEGER NOT NULL,
+			section TEXT NOT NULL,
+			data BLOB NOT NULL,
+			PRIMARY KEY (source, match_id, section))""")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS matches_timestamp ON matches (timestamp)")
+
+	async def get(self, source, match_id) -> typing.Optional[LazyDict]:
+		"""Gets a match from the store, or None if we dont have it. Only the summary is decoded until other keys are used"""
+		return await executors.run_thread(self.load, source, match_id)
+
+	# reads and decodes a match's summary. this blocks, so get runs it in the thread pool
+	def load(self, source, match_id) -> typing.Optional[LazyDict]:
+		with self.lock:
+			row = self.conn.execute("SELECT data FROM match_sections WHERE source = ? AND match_id = ? AND section = 'summary'", (source, match_id)).fetchone()
+			if row is None:
+				return None
+			self.conn.execute("UPDATE matches SET timestamp = ? WHERE source = ? AND match_id = ?", (get_timestamp(), source, match_id))
+		return StoredMatch(self, source, match_id, decode_section(row[0])).match
+
+	def read_section(self, source, match_id, section):
+		with self.lock:
+			row = self.conn.execute("SELECT data FROM match_sections WHERE source = ? AND match_id = ? AND section = ?", (source, match_id, section)).fetchone()
+		return None if row is None else decode_section(row[0])
+
+	async def save(self, source, match_id, match, parsed=True):
+		"""Saves a match to the store. The compressing and writing is done in a worker thread"""
+		summary, sections = split_match(source, match)
+		await asyncio.get_running_loop().run_in_executor(self.executor, self._save, source, match_id, summary, sections, parsed)
+
+	def _save(self, source, match_id, summary, sections, parsed):
+		blobs = { section: encode_section(data) for section, data in sections.items() }
+		blobs["summary"] = encode_section(summary)
+		size = sum(len(blob) for blob in blobs.values())
+		with self.lock, self.conn:
+			self.conn.execute("BEGIN")
+			self.conn.execute("DELETE FROM match_sections WHERE source = ? AND match_id = ?", (source, match_id))
+			self.conn.executemany("INSERT INTO match_sections (source, match_id, section, data) VALUES (?, ?, ?, ?)",
+				((source, match_id, section, blob) for section, blob in blobs.items()))
+			self.conn.execute("INSERT OR REPLACE INTO matches (source, match_id, parsed, timestamp, size) VALUES (?, ?, ?, ?, ?)",
+				(source, match_id, int(parsed), get_timestamp(), size))
+
+	def _remove_matches(self, keys):
+		with self.lock, self.conn:
+			self.conn.execute("BEGIN")
+			self.conn.executemany("DELETE FROM match_sections WHERE source = ? AND match_id = ?", keys)
+			self.conn.executemany("DELETE FROM matches WHERE source = ? AND match_id = ?", keys)
+
+	# Removes matches that havent been used in a while, and the least recently used ones if we're over the "match" cache budget
+	@tasks.loop(hours=4)
+	async def cleanup(self):
+		timer = SimpleTimer()
+		threshold = get_timestamp() - CACHE_FILE_TIMEOUT_MS
+		with self.lock:
+			expired = self.conn.execute("SELECT source, match_id FROM matches WHERE timestamp < ?", (threshold,)).fetchall()
+		evicted = []
+		budget = settings.cache_budget.get("match")
+		if budget is not None:
+			with self.lock:
+				total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM matches WHERE timestamp >= ?", (threshold,)).fetchone()[0]
+				if total_size > budget:
+					for source, match_id, size in self.conn.execute("SELECT source, match_id, size FROM matches WHERE timestamp >= ? ORDER BY timestamp", (threshold,)).fetchall():
+						if total_size <= budget:
+							break
+						evicted.append((source, match_id))
+						total_size -= size
+		if expired or evicted:
+			await asyncio.get_running_loop().run_in_executor(self.executor, self._remove_matches, expired + evicted)
+		with self.lock:
+			count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM matches").fetchone()
+		logger.event("match_store_cleanup", {
+			"expired": len(expired),
+			"evicted": len(evicted),
+			"match_count": count,
+			"size_bytes": size,
+			"time": timer.miliseconds
+		})
+
+	def close(self):
+		self.executor.shutdown()
+		self.conn.close()
+
+match_store = MatchStore(settings.resource("cache/_match_store.db"))
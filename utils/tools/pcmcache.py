@@ -0,0 +1,161 @@
+import asyncio
+import os
+import subprocess
+import typing
+from collections import OrderedDict
+
+import disnake
+import numpy as np
+from disnake.ext import tasks
+from utils.tools.settings import settings
+from utils.tools.logger import logger
+from utils.tools.executors import executors, ExecutorOverloadedError
+from utils.tools.audiolength import audio_lengths
+
+#
+# keeps short clips that get played a lot (the default intro, chat wheel sounds, dota responses, etc) in memory as
+# the 48khz 16-bit stereo pcm that discord's voice client sends, so playing one doesnt spawn a new ffmpeg process.
+# the clip's volume is applied once when it's decoded, instead of to every frame while it's playing.
+# a clip only gets cached the second time it's played, so one-off clips (like most tts) dont push the popular ones out
+#
+
+# clips longer than this (in seconds) are streamed through ffmpeg like before, instead of being decoded into memory
+MAX_CACHED_LENGTH = 15
+# how many clips that have only been played once to remember, so we know to cache them if they get played again
+MAX_SEEN_CLIPS = 4096
+# what AudioSource.read() should return each time: 20ms of 48khz 16-bit stereo
+FRAME_SIZE = 3840
+
+def decode_pcm(filename, volume):
+	"""Decodes an audio file to 48khz 16-bit stereo pcm (with the volume applied) using ffmpeg"""
+	process = subprocess.run([ "ffmpeg", "-v", "error", "-i", filename, "-f", "s16le", "-ar", "48000", "-ac", "2", "pipe:1" ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+	samples = np.frombuffer(process.stdout, dtype=np.int16)
+	if volume != 1:
+		samples = np.clip(samples * np.float32(volume), -32768, 32767).astype(np.int16)
+	return samples.tobytes()
+
+class PCMAudio(disnake.AudioSource):
+	"""Plays already decoded pcm. The pcm isn't copied, so lots of guilds can play the same cached clip at once"""
+	def __init__(self, pcm: bytes):
+		self.pcm = memoryview(pcm)
+		self.position = 0
+
+	def read(self):
+		frame = self.pcm[self.position:self.position + FRAME_SIZE]
+		self.position += FRAME_SIZE
+		if len(frame) < FRAME_SIZE and len(frame) > 0:
+			return bytes(frame) + bytes(FRAME_SIZE - len(frame))
+		return bytes(frame)
+
+	def is_opus(self):
+		return False
+
+class PCMCache:
+	"""The decoded pcm of recently played clips, keyed by the clip's file (path, mtime and size) and volume"""
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.clips: typing.OrderedDict[tuple, bytes] = OrderedDict()
+		self.decoding: typing.Dict[tuple, asyncio.Task] = {}
+		self.seen: typing.OrderedDict[tuple, bool] = OrderedDict() # clips that have been played once, but arent cached
+		self.total_bytes = 0
+		self.reset_stats()
+
+	def reset_stats(self):
+		self.hits = 0
+		self.misses = 0
+		self.decoded = 0
+		self.evicted = 0
+
+	def get_key(self, filename, volume):
+		stat = os.stat(filename)
+		return (filename, stat.st_mtime, stat.st_size, volume)
+
+	def put(self, key, pcm: bytes):
+		if len(pcm) > self.max_bytes:
+			return
+		old_pcm = self.clips.pop(key, None)
+		if old_pcm is not None:
+			self.total_bytes -= len(old_pcm)
+		self.clips[key] = pcm
+		self.total_bytes += len(pcm)
+		while self.total_bytes > self.max_bytes:
+			evicted_key, evicted_pcm = self.clips.popitem(last=False)
+			self.total_bytes -= len(evicted_pcm)
+			self.evicted += 1
+
+	# whether this is at least the second time the clip is being played, which is when its worth caching
+	def is_replayed(self, key):
+		if key in self.seen:
+			del self.seen[key]
+			return True
+		self.seen[key] = True
+		if len(self.seen) > MAX_SEEN_CLIPS:
+			self.seen.popitem(last=False)
+		return False
+
+	async def prepare(self, filename, volume):
+		"""Decodes the clip into the cache if it's short enough, isn't already there, and has been played before, so that
+		get_source can play it from memory. If a few guilds want the same clip at once, it only gets decoded once.
+		Temp files (like youtube clips) are never cached, since they get deleted once they've played"""
+		if os.path.dirname(filename) == settings.resource("temp"):
+			return
+		try:
+			key = self.get_key(filename, volume)
+			if key in self.clips:
+				return
+			task = self.decoding.get(key)
+			if task is None and (not self.is_replayed(key) or (await audio_lengths.fill(filename)) > MAX_CACHED_LENGTH):
+				return
+		except Exception as e:
+			logger.warning(f"couldn't check whether to cache the pcm for {filename}: {e}")
+			return
+		task = self.decoding.get(key) # checked again, since someone else may have started decoding it while we were getting the length
+		if task is None:
+			task = asyncio.ensure_future(self._decode(key, filename, volume))
+			self.decoding[key] = task
+			task.add_done_callback(lambda t: self.decoding.pop(key, None))
+		await asyncio.shield(task)
+
+	async def _decode(self, key, filename, volume):
+		try:
+			pcm = await executors.run_thread(decode_pcm, filename, volume)
+		except subprocess.CalledProcessError as e:
+			logger.warning(f"couldn't decode {filename}: {e.stderr.decode('utf-8', 'ignore').strip()}")
+			return
+		except (OSError, ExecutorOverloadedError) as e: # it'll just get streamed through ffmpeg instead
+			logger.warning(f"couldn't decode {filename}: {e}")
+			return
+		self.decoded += 1
+		self.put(key, pcm)
+
+	def get_source(self, filename, volume) -> disnake.AudioSource:
+		"""Gets an AudioSource to play the clip, from memory if it's been prepared, otherwise streamed through ffmpeg"""
+		key = self.get_key(filename, volume)
+		pcm = self.clips.get(key)
+		if pcm is not None:
+			self.hits += 1
+			self.clips.move_to_end(key)
+			return PCMAudio(pcm)
+		self.misses += 1
+		return disnake.PCMVolumeTransformer(disnake.FFmpegPCMAudio(filename), volume=volume)
+
+	@property
+	def size(self):
+		return len(self.clips)
+
+	# logs how well the cache is doing since the last report
+	@tasks.loop(minutes=30)
+	async def report_stats(self):
+		lookups = self.hits + self.misses
+		logger.event("pcm_cache_stats", {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": round(self.hits / lookups, 4) if lookups else None,
+			"decoded": self.decoded,
+			"evicted": self.evicted,
+			"clip_count": len(self.clips),
+			"size_bytes": self.total_bytes
+		})
+		self.reset_stats()
+
+pcm_cache = PCMCache(settings.pcm_cache_budget)
@@ -0,0 +1,301 @@
+import sqlite3
+import threading
+import time
+import math
+import orjson
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from disnake.ext import tasks
+
+from utils.tools.helpers import *
+from utils.tools.logger import logger
+from utils.tools.settings import settings
+from utils.tools.executors import executors
+from utils.tools.matchstore import encode_section, decode_section
+
+#
+# a local copy of each player's opendota match history (/players/{id}/matches), so commands dont have to pull
+# the whole thing every time. once a player has been synced, later syncs only ask for the matches played since
+# then, and new columns (projections) are fetched on their own and merged in, instead of re-pulling everything
+#
+
+# the columns opendota sends when nothing is projected
+DEFAULT_COLUMNS = [ "match_id", "player_slot", "radiant_win", "start_time", "duration", "game_mode", "lobby_type", "hero_id", "version", "kills", "deaths", "assists", "party_size" ]
+# the columns that every history has, which is enough to check most matchfilters. anything else gets added the first time a command asks for it
+BASE_COLUMNS = DEFAULT_COLUMNS + [ "lane_role", "is_roaming", "region" ]
+# opendota always sends these, so they dont need to be projected
+ALWAYS_RETURNED_COLUMNS = [ "match_id", "player_slot", "radiant_win" ]
+# our own column for whether opendota counts the match as significant (its default filter)
+SIGNIFICANT_COLUMN = "_significant"
+# the columns that are always loaded, even if they werent asked for
+REQUIRED_COLUMNS = [ "match_id", "start_time", SIGNIFICANT_COLUMN ]
+# incremental syncs go back this many days before the newest match we have, so matches that got parsed since
+# the last sync get their new version
+RECHECK_DAYS = 2
+
+# sync_interval is how many seconds a history is used for before checking for new matches, full_sync_interval is
+# how many seconds before the whole history gets pulled again (to catch anything older that changed), and
+# expire_days is how long a history is kept after it was last used. can be overridden with the "player_index" setting
+def get_player_index_settings():
+	config = { "sync_interval": 5 * 60, "full_sync_interval": 7 * 24 * 60 * 60, "expire_days": 30 }
+	config.update(settings.player_index)
+	return config
+
+class PlayerHistory:
+	"""A player's match history, stored as a list of values for each column. Sorted newest first, like opendota sends it.
+	A history loaded from the index might only have some of its columns loaded. column_names is all of the ones it has"""
+	def __init__(self, steam_id, columns=None, synced_at=0, full_synced_at=0, column_names=None):
+		self.steam_id = steam_id
+		self.columns: typing.Dict[str, list] = columns or { column: [] for column in BASE_COLUMNS + [ SIGNIFICANT_COLUMN ] }
+		self.column_names = column_names or list(self.columns)
+		self.synced_at = synced_at
+		self.full_synced_at = full_synced_at
+		self.arrays = {}
+
+	def __len__(self):
+		return len(self.columns["match_id"])
+
+	def has_columns(self, columns):
+		return all(column in self.column_names for column in columns)
+
+	def get_array(self, column):
+		"""Gets a column as a numpy array of floats, with missing values as nan"""
+		array = self.arrays.get(column)
+		if array is None:
+			array = np.array(self.columns[column], dtype=np.float64)
+			self.arrays[column] = array
+		return array
+
+	def rows(self, columns=None, significant_only=False, indexes=None):
+		"""Gets the matches as a list of dicts like opendota returns, with only the given columns (or all of them).
+		If indexes is given, only the matches at those indexes are included"""
+		columns = [ column for column in (columns or self.columns) if column != SIGNIFICANT_COLUMN ]
+		for column in ALWAYS_RETURNED_COLUMNS:
+			if column not in columns:
+				columns.append(column)
+		values = [ self.columns[column] for column in columns ]
+		if indexes is not None:
+			values = [ [ column_values[i] for i in indexes ] for column_values in values ]
+		rows = [ dict(zip(columns, row)) for row in zip(*values) ]
+		if significant_only:
+			significant = self.columns[SIGNIFICANT_COLUMN]
+			if indexes is not None:
+				significant = [ significant[i] for i in indexes ]
+			rows = [ row for row, is_significant in zip(rows, significant) if is_significant ]
+		return rows
+
+	def merge(self, matches, significant_ids, since=None):
+		"""Merges in matches from opendota, which should have all of our columns. significant_ids is the ids of the
+		matches opendota counts as significant, out of everything played after since (or all of them if since is None)"""
+		positions = { match_id: i for i, match_id in enumerate(self.columns["match_id"]) }
+		for match in matches:
+			i = positions.get(match["match_id"])
+			if i is None:
+				for column, values in self.columns.items():
+					values.append(match.get(column))
+			else:
+				for column, values in self.columns.items():
+					if column != SIGNIFICANT_COLUMN:
+						values[i] = match.get(column)
+		self.arrays = {}
+		significant = self.columns[SIGNIFICANT_COLUMN]
+		for i, (match_id, start_time) in enumerate(zip(self.columns["match_id"], self.columns["start_time"])):
+			if since is None or (start_time or 0) >= since:
+				significant[i] = match_id in significant_ids
+		self._sort()
+
+	def set_column(self, column, matches):
+		"""Adds (or replaces) a column, using the values from the given opendota matches"""
+		values = { match["match_id"]: match.get(column) for match in matches }
+		self.columns[column] = [ values.get(match_id) for match_id in self.columns["match_id"] ]
+		self.arrays.pop(column, None)
+		if column not in self.column_names:
+			self.column_names.append(column)
+
+	def _sort(self):
+		order = sorted(range(len(self)), key=lambda i: (self.columns["start_time"][i] or 0, self.columns["match_id"][i]), reverse=True)
+		for column, values in self.columns.items():
+			self.columns[column] = [ values[i] for i in order ]
+
+class PlayerIndex:
+	"""Keeps synced copies of player match histories in an sqlite database. Each column is compressed separately, so
+	a command only has to decode the columns it uses"""
+	def __init__(self, path):
+		self.path = path
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		self.lock = threading.Lock()
+		self.sync_locks: typing.Dict[int, asyncio.Lock] = {}
+		self.sync_lock_users: typing.Dict[int, int] = {} # how many gets are holding or waiting on each sync lock, so we know when to remove it
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="playerindex")
+		self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS player_histories (
+			steam_id INTEGER PRIMARY KEY,
+			synced_at REAL NOT NULL,
+			full_synced_at REAL NOT NULL,
+			last_used REAL NOT NULL,
+			match_count INTEGER NOT NULL,
+			size INTEGER NOT NULL,
+			column_names TEXT NOT NULL)""")
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS player_history_columns (
+			steam_id INTEGER NOT NULL,
+			column_name TEXT NOT NULL,
+			data BLOB NOT NULL,
+			PRIMARY KEY (steam_id, column_name))""")
+
+	def load(self, steam_id, columns=None) -> typing.Optional[PlayerHistory]:
+		"""Gets the history we have for this player (however old it is), or None if we dont have one.
+		If columns is given, only those columns (plus the required ones) are loaded. This blocks, so from async code, run it in the thread pool"""
+		with self.lock:
+			row = self.conn.execute("SELECT synced_at, full_synced_at, column_names FROM player_histories WHERE steam_id = ?", (steam_id,)).fetchone()
+			if row is None:
+				return None
+			synced_at, full_synced_at, column_names = row
+			column_names = orjson.loads(column_names)
+			if columns is not None:
+				column_names_to_load = [ column for column in column_names if column in columns or column in REQUIRED_COLUMNS ]
+			else:
+				column_names_to_load = column_names
+			blobs = self.conn.execute(f"SELECT column_name, data FROM player_history_columns WHERE steam_id = ? AND column_name IN ({', '.join('?' * len(column_names_to_load))})",
+				(steam_id, *column_names_to_load)).fetchall()
+			self.conn.execute("UPDATE player_histories SET last_used = ? WHERE steam_id = ?", (time.time(), steam_id))
+		loaded = { column: decode_section(blob) for column, blob in blobs }
+		return PlayerHistory(steam_id, loaded, synced_at, full_synced_at, column_names)
+
+	def _save(self, history: PlayerHistory, columns):
+		blobs = [ (history.steam_id, column, encode_section(history.columns[column])) for column in columns ]
+		with self.lock, self.conn:
+			self.conn.execute("BEGIN")
+			self.conn.executemany("INSERT OR REPLACE INTO player_history_columns (steam_id, column_name, data) VALUES (?, ?, ?)", blobs)
+			size = self.conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM player_history_columns WHERE steam_id = ?", (history.steam_id,)).fetchone()[0]
+			self.conn.execute("INSERT OR REPLACE INTO player_histories (steam_id, synced_at, full_synced_at, last_used, match_count, size, column_names) VALUES (?, ?, ?, ?, ?, ?, ?)",
+				(history.steam_id, history.synced_at, history.full_synced_at, time.time(), len(history), size, orjson.dumps(history.column_names).decode("utf-8")))
+
+	async def save(self, history: PlayerHistory, columns=None):
+		"""Saves the given columns of the history (or all of them)"""
+		await asyncio.get_running_loop().run_in_executor(self.executor, self._save, history, columns or list(history.columns))
+
+	def _remove_players(self, steam_ids):
+		with self.lock, self.conn:
+			self.conn.execute("BEGIN")
+			self.conn.executemany("DELETE FROM player_history_columns WHERE steam_id = ?", ((steam_id,) for steam_id in steam_ids))
+			self.conn.executemany("DELETE FROM player_histories WHERE steam_id = ?", ((steam_id,) for steam_id in steam_ids))
+
+	async def get(self, steam_id, columns, query, max_age=None, covered_only=False) -> typing.Optional[PlayerHistory]:
+		"""Gets a player's match history with (at least) the given columns, syncing it with opendota first if it's out of date.
+		query should be an async function that takes an opendota querystring (like opendota_query).
+		max_age overrides how many seconds old the history can be before we check for new matches.
+		If covered_only is set, this returns None instead of pulling a whole history or a new column from opendota"""
+		config = get_player_index_settings()
+		if max_age is None:
+			max_age = config["sync_interval"]
+		# so that a couple commands for the same player at once dont both sync it
+		lock = self.sync_locks.setdefault(steam_id, asyncio.Lock())
+		self.sync_lock_users[steam_id] = self.sync_lock_users.get(steam_id, 0) + 1
+		try:
+			async with lock:
+				return await self._get(steam_id, columns, query, max_age, config, covered_only)
+		finally:
+			self.sync_lock_users[steam_id] -= 1
+			if self.sync_lock_users[steam_id] == 0:
+				del self.sync_lock_users[steam_id]
+				del self.sync_locks[steam_id]
+
+	async def _get(self, steam_id, columns, query, max_age, config, covered_only):
+		history = await executors.run_thread(self.load, steam_id, columns)
+		now = time.time()
+		if covered_only and (history is None or not history.has_columns(columns) or now - history.full_synced_at > config["full_sync_interval"]):
+			return None
+		if history is None or now - history.full_synced_at > config["full_sync_interval"]:
+			known_columns = history.column_names if history else []
+			return await self.full_sync(steam_id, known_columns + list(columns), query)
+
+		missing_columns = [ column for column in columns if column not in history.column_names ]
+		needs_sync = now - history.synced_at > max_age
+		if not (missing_columns or needs_sync):
+			return history
+		if needs_sync:
+			history = await executors.run_thread(self.load, steam_id) # new matches need a value in every column
+		timer = SimpleTimer()
+		count = len(history)
+		try:
+			if missing_columns:
+				matches = await query(self.get_querystring(steam_id, missing_columns))
+				for column in missing_columns:
+					history.set_column(column, matches)
+			if needs_sync:
+				newest = history.columns["start_time"][0] if len(history) else 0
+				days = max(1, math.ceil((now - (newest or 0)) / 86400) + RECHECK_DAYS)
+				matches, significant = await asyncio.gather(
+					query(self.get_querystring(steam_id, history.column_names, date=days)),
+					query(self.get_querystring(steam_id, [ "start_time" ], date=days, significant=True)))
+				history.merge(matches, set(m["match_id"] for m in significant), since=now - (days * 86400))
+				history.synced_at = now
+		except HttpError as e:
+			if missing_columns:
+				raise
+			# we've still got the old history, which is better than nothing
+			logger.warning(f"player index sync failed, using a history that's {int(now - history.synced_at)} seconds old: {e}")
+			return history
+		await self.save(history, None if needs_sync else missing_columns)
+		logger.event("player_index_sync", {
+			"sync_type": "columns" if missing_columns else "recent",
+			"new_columns": len(missing_columns),
+			"new_matches": len(history) - count,
+			"match_count": len(history),
+			"time": timer.miliseconds
+		})
+		return history
+
+	async def full_sync(self, steam_id, columns, query) -> PlayerHistory:
+		"""Pulls the player's whole match history from opendota"""
+		timer = SimpleTimer()
+		history = PlayerHistory(steam_id)
+		for column in columns:
+			if column not in history.columns:
+				history.columns[column] = []
+				history.column_names.append(column)
+		matches, significant = await asyncio.gather(
+			query(self.get_querystring(steam_id, history.column_names)),
+			query(self.get_querystring(steam_id, [ "start_time" ], significant=True)))
+		history.merge(matches, set(m["match_id"] for m in significant))
+		history.synced_at = history.full_synced_at = time.time()
+		await self.save(history)
+		logger.event("player_index_sync", {
+			"sync_type": "full",
+			"new_columns": len(history.columns),
+			"new_matches": len(history),
+			"match_count": len(history),
+			"time": timer.miliseconds
+		})
+		return history
+
+	def get_querystring(self, steam_id, columns, date=None, significant=False):
+		args = [] if significant else [ "significant=0" ]
+		if date is not None:
+			args.append(f"date={date}")
+		args.extend(f"project={column}" for column in columns if column not in ALWAYS_RETURNED_COLUMNS and column != SIGNIFICANT_COLUMN)
+		return f"/players/{steam_id}/matches?{'&'.join(args)}"
+
+	# Removes the histories of players that havent been looked up in a while
+	@tasks.loop(hours=4)
+	async def cleanup(self):
+		threshold = time.time() - (get_player_index_settings()["expire_days"] * 86400)
+		with self.lock:
+			expired = [ row[0] for row in self.conn.execute("SELECT steam_id FROM player_histories WHERE last_used < ?", (threshold,)).fetchall() ]
+		if expired:
+			await asyncio.get_running_loop().run_in_executor(self.executor, self._remove_players, expired)
+		with self.lock:
+			count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM player_histories").fetchone()
+		logger.event("player_index_cleanup", {
+			"expired": len(expired),
+			"player_count": count,
+			"size_bytes": size
+		})
+
+	def close(self):
+		self.executor.shutdown()
+		self.conn.close()
+
+player_index = PlayerIndex(settings.resource("cache/_player_index.db"))
@@ -0,0 +1,129 @@
+import time
+import random
+import email.utils
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+from utils.tools.helpers import *
+from utils.tools.settings import settings
+
+#
+# per-host rate limiting for HttpGetter, so a burst of requests (playerstats, whoishere, etc) gets spread out
+# instead of getting us 429'd or cloudflare blocked
+#
+
+# the http statuses that are worth retrying
+RETRY_STATUSES = { 429, 500, 502, 503, 504 }
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1 # seconds, doubled for each retry
+MAX_RETRY_DELAY = 60 # if a host asks us to wait longer than this, we just give up
+
+# the default limits for each host. rate is requests per second, burst is how many requests can go out at once
+# before the rate kicks in, and max_inflight is how many requests to a host can be running at the same time.
+# any of these can be overridden with the "http_host_limits" setting
+def get_default_host_limits():
+	return {
+		"api.opendota.com": { "rate": 20 if settings.odota else 1, "burst": 20 if settings.odota else 10, "max_inflight": 10 },
+		"api.stratz.com": { "rate": 5, "burst": 10, "max_inflight": 5 },
+		"pokeapi.co": { "rate": 10, "burst": 10, "max_inflight": 5 },
+		"en.wikipedia.org": { "rate": 10, "burst": 10, "max_inflight": 5 },
+		"default": { "rate": 20, "burst": 20, "max_inflight": 10 }
+	}
+
+# parses a Retry-After header, which is either a number of seconds or an http date
+def parse_retry_after(value):
+	if value is None:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		retry_date = email.utils.parsedate_to_datetime(value)
+	except (TypeError, ValueError):
+		return None
+	if retry_date is None:
+		return None
+	return max(0.0, retry_date.timestamp() - time.time())
+
+# how long to wait before the given retry attempt (0 being the first retry). jittered so that a bunch of requests that
+# failed at the same time dont all retry at the same time
+def get_backoff_delay(attempt):
+	delay = RETRY_BASE_DELAY * (2 ** attempt)
+	return delay * random.uniform(0.5, 1.5)
+
+class HostLimiter:
+	"""A token bucket plus a cap on in-flight requests for a single host"""
+	def __init__(self, host, rate, burst, max_inflight):
+		self.host = host
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.updated = time.monotonic()
+		self.paused_until = 0
+		self.semaphore = asyncio.Semaphore(max_inflight)
+		self.queue_depth = 0 # requests waiting for a slot or a token
+		self.inflight = 0
+		self.throttle_count = 0 # how many requests have had to wait for a token
+		self.retry_count = 0
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + ((now - self.updated) * self.rate))
+		self.updated = now
+		return now
+
+	# stops any requests going out to this host for the given number of seconds. used when we get a Retry-After
+	def pause(self, seconds):
+		self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+	@asynccontextmanager
+	async def limit(self):
+		"""Waits until a request to this host is allowed to go out, and holds an in-flight slot while its running. Yields how many ms were spent waiting"""
+		timer = SimpleTimer()
+		self.queue_depth += 1
+		try:
+			await self.semaphore.acquire()
+		finally:
+			self.queue_depth -= 1
+		try:
+			throttled = False
+			while True:
+				now = self._refill()
+				if now < self.paused_until:
+					delay = self.paused_until - now
+				elif self.tokens >= 1:
+					self.tokens -= 1
+					break
+				else:
+					delay = (1 - self.tokens) / self.rate
+				if not throttled:
+					throttled = True
+					self.throttle_count += 1
+				await asyncio.sleep(delay)
+			self.inflight += 1
+			try:
+				yield timer.miliseconds
+			finally:
+				self.inflight -= 1
+		finally:
+			self.semaphore.release()
+
+class HostLimiters:
+	"""Hands out the HostLimiter for each host, creating them as needed"""
+	def __init__(self):
+		self.limiters: typing.Dict[str, HostLimiter] = {}
+
+	def get(self, url) -> HostLimiter:
+		host = urlparse(url).hostname or ""
+		limiter = self.limiters.get(host)
+		if limiter is None:
+			host_limits = get_default_host_limits()
+			# merged key by key, so an override can change just one of a host's limits
+			for override_host, overrides in settings.http_host_limits.items():
+				host_limits.setdefault(override_host, {}).update(overrides)
+			limits = dict(host_limits["default"])
+			limits.update(host_limits.get(host, {}))
+			limiter = HostLimiter(host, limits["rate"], limits["burst"], limits["max_inflight"])
+			self.limiters[host] = limiter
+		return limiter
@@ -81,6 +81,61 @@ class Settings:
 	def loki(self):
 		return self.json_data.get("loki", None)
 	
+	# which storage backend to use for botdata. either "sqlite" (botdata.db, the default) or "json" (the old botdata.json file)
+	@property
+	def botdata_backend(self):
+		return self.json_data.get("botdata_backend", "sqlite")
+
+	# how many seconds to wait after a botdata change before writing it, so that a burst of changes becomes one write
+	@property
+	def botdata_write_delay(self):
+		return self.json_data.get("botdata_write_delay", 2)
+
+	# optional byte budgets for the http cache. "total" limits the whole cache, and "tts", "match", "image", "gif", and "other" limit each class of cached file. files cached permanently (like vpk images) dont expire, but still count towards these and get evicted when over budget
+	@property
+	def cache_budget(self):
+		return self.json_data.get("cache_budget", {})
+
+	# optional per-host overrides for the http rate limits, like { "api.opendota.com": { "rate": 1, "burst": 10, "max_inflight": 5 } }. rate is requests per second. "default" applies to any host not listed
+	@property
+	def http_host_limits(self):
+		return self.json_data.get("http_host_limits", {})
+
+	# the biggest file (in bytes) that the bot will download
+	@property
+	def http_max_download_size(self):
+		return self.json_data.get("http_max_download_size", 100 * 1024 * 1024)
+
+	# optional overrides for the shared worker pools, like { "process": { "workers": 2, "max_queue": 8 }, "thread": { "workers": 8, "max_queue": 64 }, "render": { "workers": 4, "max_queue": 32 } }. max_queue is how many jobs can be waiting or running in a pool before new ones get turned away
+	@property
+	def executor_limits(self):
+		return self.json_data.get("executor_limits", {})
+
+	# optional overrides for how often the local copies of player match histories get synced, like { "sync_interval": 300, "full_sync_interval": 604800, "expire_days": 30 }. the intervals are in seconds
+	@property
+	def player_index(self):
+		return self.json_data.get("player_index", {})
+
+	# how many bytes of decoded images (hero/item/ability icons etc) to keep in memory for drawing
+	@property
+	def image_cache_budget(self):
+		return self.json_data.get("image_cache_budget", 128 * 1024 * 1024)
+
+	# how many bytes of decoded audio (short clips that are kept in memory ready to play) to keep around
+	@property
+	def pcm_cache_budget(self):
+		return self.json_data.get("pcm_cache_budget", 64 * 1024 * 1024)
+
+	# how many clips a guild can have waiting to be played before new ones get turned away (so a spammy tts channel cant build up a huge backlog)
+	@property
+	def clip_queue_limit(self):
+		return self.json_data.get("clip_queue_limit", 20)
+
+	# optional overrides for how tts clips get made, like { "engines": [ "gtts", "pico2wave" ], "workers": 4, "remote_timeout": 5, "remote_cooldown": 60 }
+	@property
+	def tts(self):
+		return self.json_data.get("tts", {})
+
 	# used for storing emoji mango needs to use
 	@property
 	def emoji_dev_servers(self):
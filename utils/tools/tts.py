@@ -0,0 +1,228 @@
+import re
+import time
+import shutil
+import string
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from gtts import gTTS
+from utils.tools.helpers import *
+from utils.tools.globals import httpgetter, logger, settings, executors
+
+#
+# turns text into speech for tts clips. engines are tried in the order they're configured in, and if a remote engine
+# (gtts) is too slow, we fall back to the next one (like pico2wave, which runs locally). finished clips are cached in the
+# httpgetter cache under a normalized version of the text, and if the same text is already being synthesized for
+# someone else, we just wait for that one instead of doing it again. clips made by a fallback engine are cached under
+# their own uri, so that once the preferred engine is working again it gets to replace them
+#
+
+# engines is the order to try the tts engines in, workers is how many remote tts requests can run at once, and
+# remote_timeout is how many seconds to wait for a remote engine before falling back to the next one. when that
+# happens, the remote engine gets skipped for remote_cooldown seconds. can be overridden with the "tts" setting
+def get_tts_settings():
+	config = { "engines": [ "gtts", "pico2wave" ], "workers": 4, "remote_timeout": 5, "remote_cooldown": 60 }
+	config.update(settings.tts)
+	return config
+
+def normalize_tts_text(text):
+	"""Normalizes text so that messages that would sound the same ("lol", "LOL", "lol!") share a clip"""
+	normalized = re.sub(r"\s+", " ", text).strip().lower()
+	normalized = normalized.strip(string.punctuation + " ")
+	return normalized or text
+
+# an error with the text itself, which another engine wouldn't do any better with
+class TtsInputError(UserError):
+	pass
+
+class TtsEngine:
+	"""A way of turning text into speech"""
+	name = None
+	remote = False # remote engines run in the tts worker pool and can time out
+
+	def is_available(self):
+		return True
+
+	def supports(self, lang):
+		return True
+
+	def save(self, filename, text, lang):
+		"""Saves the text as speech to the given file. This blocks, so it gets run in a worker thread"""
+		raise NotImplementedError()
+
+class GttsEngine(TtsEngine):
+	name = "gtts"
+	remote = True
+
+	def save(self, filename, text, lang):
+		loop_count = 10
+		if "-" in lang:
+			lang = "en"
+		while loop_count > 0:
+			loop_count -= 1
+			try:
+				tts = gTTS(text=text, lang=lang, lang_check=False)
+				tts.save(filename)
+			except ValueError as e:
+				if loop_count > 0 and e.args and e.args[0] == "Unable to find token seed! Did https://translate.google.com change?":
+					logger.error(f"Got bad seed exception. Looping {loop_count} more times")
+					continue # loop, as reccomended here: https://github.com/pndurette/gTTS/issues/176#issuecomment-723393140
+				else:
+					raise
+			except AttributeError:
+				raise UserError("Whoops. Looks like gtts is broken right now.")
+			except (RecursionError, requests.exceptions.HTTPError):
+				raise UserError("There was a problem converting that via gtts")
+			except AssertionError as e:
+				if e.args and e.args[0] == "No text to send to TTS API":
+					raise TtsInputError("I can't convert that to TTS. Looks like there's not much there.")
+				else:
+					raise
+			return # if we succeed, return
+
+class Pico2WaveEngine(TtsEngine):
+	name = "pico2wave"
+	# the languages pico has voices for, and which one to use for each of our ttslangs
+	LANGUAGES = {
+		"en": "en-GB",
+		"en-au": "en-GB",
+		"en-uk": "en-GB",
+		"en-gb": "en-GB",
+		"en-us": "en-US",
+		"de": "de-DE",
+		"es": "es-ES",
+		"fr": "fr-FR",
+		"it": "it-IT"
+	}
+
+	def is_available(self):
+		return shutil.which("pico2wave") is not None
+
+	def supports(self, lang):
+		return lang.lower() in self.LANGUAGES
+
+	def save(self, filename, text, lang):
+		# pico2wave only writes to files that end in .wav
+		temp_filename = f"{filename}.pico.wav"
+		run_command([ "pico2wave", "--wave", temp_filename, "-l", self.LANGUAGES[lang.lower()], text ])
+		os.replace(temp_filename, filename)
+
+TTS_ENGINES = { engine.name: engine for engine in [ GttsEngine(), Pico2WaveEngine() ] }
+
+class TtsService:
+	"""Synthesizes (and caches) tts clips"""
+	def __init__(self):
+		self.config = get_tts_settings()
+		self.engines = [ TTS_ENGINES[name] for name in self.config["engines"] if name in TTS_ENGINES ]
+		self.executor = ThreadPoolExecutor(max_workers=self.config["workers"], thread_name_prefix="tts")
+		self.inflight: typing.Dict[str, asyncio.Future] = {}
+		self.remote_skipped_until = 0
+
+	# the engine is only given for clips made by a fallback engine. the preferred engine's clips dont include it, so they
+	# stay under the same uri as before there were fallbacks
+	def get_uri(self, text, lang, engine=None):
+		if engine is None:
+			return f"clip_tts_{lang}:{normalize_tts_text(text)}"
+		return f"clip_tts_{lang}_{engine.name}:{normalize_tts_text(text)}"
+
+	def get_engines(self, lang):
+		"""Gets the engines that can do this language, in the order they should be tried"""
+		return [ engine for engine in self.engines if engine.supports(lang) and engine.is_available() ]
+
+	def is_skipped(self, engine):
+		return engine.remote and time.time() < self.remote_skipped_until
+
+	async def get(self, text, lang):
+		"""Gets the filename of a tts clip for this text, synthesizing it if it isn't cached yet"""
+		uri = self.get_uri(text, lang)
+		filename = await httpgetter.cache.get_filename(uri)
+		if filename:
+			return filename
+		engines = self.get_engines(lang)
+		if engines and self.is_skipped(engines[0]):
+			# the preferred engine is being skipped for now anyway, so a clip from a fallback engine is as good as we'd get
+			for engine in engines[1:]:
+				filename = await httpgetter.cache.get_filename(self.get_uri(text, lang, engine))
+				if filename:
+					return filename
+		future = self.inflight.get(uri)
+		if future is None:
+			# only the cache key is normalized. the first request's text is what gets spoken, so capitals and punctuation still
+			# affect how it sounds
+			future = asyncio.ensure_future(self.synthesize(uri, text, lang))
+			self.inflight[uri] = future
+			future.add_done_callback(lambda f: self.inflight.pop(uri, None))
+		return await asyncio.shield(future)
+
+	async def synthesize(self, uri, text, lang):
+		filename = await httpgetter.cache.new(uri, "wav")
+		try:
+			engine = await self.run_engines(filename, text, lang)
+		except:
+			await httpgetter.cache.remove(uri)
+			raise
+		if engine is not self.get_engines(lang)[0]:
+			fallback_filename = await httpgetter.cache.new(self.get_uri(text, lang, engine), "wav")
+			os.replace(filename, fallback_filename)
+			await httpgetter.cache.remove(uri)
+			filename = fallback_filename
+		return filename
+
+	# synthesizes the text to the given file, and returns the engine that did it
+	async def run_engines(self, filename, text, lang):
+		engines = self.get_engines(lang)
+		if not engines:
+			raise UserError("I don't have any way to do tts in that language right now")
+		error = None
+		for i, engine in enumerate(engines):
+			is_last = i == len(engines) - 1
+			if not is_last and self.is_skipped(engine):
+				continue # its been slow lately, so go straight to the fallback
+			timer = SimpleTimer()
+			try:
+				await self.run_engine(engine, filename, text, lang, timeout=None if is_last else self.config["remote_timeout"])
+			except asyncio.TimeoutError:
+				logger.warning(f"tts engine {engine.name} took too long, falling back")
+				self.remote_skipped_until = time.time() + self.config["remote_cooldown"]
+				continue
+			except Exception as e:
+				if is_last or isinstance(e, TtsInputError):
+					raise error or e
+				logger.warning(f"tts engine {engine.name} failed ({e}), falling back")
+				error = error or e
+				continue
+			logger.event("tts_synthesis", {
+				"engine": engine.name,
+				"lang": lang,
+				"fallback": i > 0,
+				"time": timer.miliseconds
+			})
+			return engine
+
+	async def run_engine(self, engine, filename, text, lang, timeout=None):
+		if not engine.remote:
+			await executors.run_thread(engine.save, filename, text, lang)
+			return
+		# remote engines write to their own file, so that one that finishes after we've given up on it doesnt clobber the fallback's clip
+		temp_filename = f"{filename}.{engine.name}.part"
+		def remove_temp_file(future=None):
+			if future is not None and not future.cancelled():
+				future.exception() # so it doesnt get logged as never retrieved
+			if os.path.exists(temp_filename):
+				os.remove(temp_filename)
+		future = asyncio.get_running_loop().run_in_executor(self.executor, engine.save, temp_filename, text, lang)
+		try:
+			await asyncio.wait_for(asyncio.shield(future), timeout)
+		except asyncio.TimeoutError:
+			future.add_done_callback(remove_temp_file) # it keeps going in the background, so clean up after it
+			raise
+		except:
+			remove_temp_file()
+			raise
+		os.replace(temp_filename, filename)
+
+	def shutdown(self):
+		self.executor.shutdown(wait=False, cancel_futures=True)
+
+tts_service = TtsService()